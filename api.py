@@ -1,10 +1,19 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flasgger import swag_from
+import json
 import logging
+from itertools import chain
 from app import db
 from models import Product, ProductRecommendation, ApiKey, User, Transaction
-from recommendation import get_recommendations, batch_process_transactions
+from recommendation import (
+    get_recommendations, iter_recommendations, get_batch_recommendations, iter_rule_export,
+    batch_process_transactions, stream_process_transactions, iter_uploaded_transactions,
+    get_recommendation_index, training_setting_error, MINING_ENGINES, DEFAULT_MINING_ENGINE,
+    RECOMMENDATION_FIELDS, TRAINING_INTEGER_SETTINGS
+)
+from cache import recommendation_cache
+from jobs import submit_job
 from auth import api_key_required
 
 # Configure logging
@@ -13,6 +22,136 @@ logger = logging.getLogger(__name__)
 # Create API blueprint
 api_bp = Blueprint('api', __name__)
 
+# Upper bound on baskets accepted by one /recommend/batch call
+MAX_BATCH_BASKETS = 10000
+
+# Newline-delimited JSON, negotiated through the Accept header
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Upload format for each accepted /transactions/stream Content-Type
+UPLOAD_MIMETYPES = {
+    NDJSON_MIMETYPE: 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv'
+}
+
+
+def wants_ndjson():
+    """Whether the client asked for a streamed NDJSON response"""
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_response(rows, status=200):
+    """
+    Stream rows as one JSON document per line
+    
+    Args:
+        rows (iterable): JSON-serializable rows, typically a generator
+        status (int): HTTP status code
+        
+    Returns:
+        Response: Streaming response; rows are serialized as they are produced
+    """
+    lines = (json.dumps(row, default=str) + '\n' for row in rows)
+    return Response(stream_with_context(lines), status=status, mimetype=NDJSON_MIMETYPE)
+
+
+def parse_recommend_request(data):
+    """
+    Validate an /api/recommend body and resolve its request context
+    
+    Shared by the Flask view and the async server so both accept exactly the
+    same requests.
+    
+    Args:
+        data (dict): Parsed JSON body
+        
+    Returns:
+        tuple: (parameters dict, None) when valid, otherwise (None, error message)
+    """
+    from datetime import datetime
+    from recommendation import get_time_of_day, context_slot
+    
+    if not data or 'product_ids' not in data:
+        return None, 'Missing product_ids parameter'
+    
+    product_ids = data.get('product_ids', [])
+    if not product_ids or not isinstance(product_ids, list):
+        return None, 'product_ids must be a non-empty array'
+    
+    # Optional parameters for enhanced recommendations
+    time_of_day = data.get('time_of_day')  # Override the current time of day
+    
+    # Validate optional parameters
+    if time_of_day and time_of_day not in ['morning', 'midday', 'evening', 'late_night']:
+        return None, 'time_of_day must be one of: morning, midday, evening, late_night'
+    
+    # Field projection, as a list or a comma-separated string
+    fields = data.get('fields')
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if fields is not None:
+        if not isinstance(fields, list) or not fields or any(field not in RECOMMENDATION_FIELDS for field in fields):
+            return None, f'fields must be a non-empty list of: {", ".join(RECOMMENDATION_FIELDS)}'
+        fields = list(dict.fromkeys(fields))
+    
+    # Current context for enhanced recommendations
+    time_period = time_of_day if time_of_day else get_time_of_day()
+    month = datetime.now().month
+    
+    return {
+        'product_ids': product_ids,
+        'limit': data.get('limit', 5),
+        'min_confidence': data.get('min_confidence', 0.1),
+        'time_of_day': time_of_day,
+        'ignore_seasonal': data.get('ignore_seasonal', False),  # Ignore seasonal factors
+        'fields': fields,
+        'time_period': time_period,
+        'month': month,
+        # Context slot the rules are scored for
+        'slot': context_slot(time_period, month)
+    }, None
+
+
+def recommend_cache_key(user_id, params, model_version):
+    """Result cache key of an /api/recommend request for one model version"""
+    return (
+        user_id,
+        tuple(sorted(params['product_ids'])),
+        params['limit'],
+        params['min_confidence'],
+        params['time_period'],
+        params['month'],
+        tuple(params['fields']) if params['fields'] else None,
+        model_version
+    )
+
+
+def restore_request_order(cached, product_ids):
+    """Cached lists are per product; return them in the request's order"""
+    by_product = {rec['product_id']: rec for rec in cached}
+    return [by_product[pid] for pid in product_ids if pid in by_product]
+
+
+def recommend_context(params, time_boost_applied):
+    """Context block of an /api/recommend response"""
+    return {
+        'algorithm_version': '3.0',
+        'time_of_day': params['time_period'],
+        'current_month': params['month'],
+        'seasonal_boost_applied': not params['ignore_seasonal'],
+        'time_boost_applied': time_boost_applied
+    }
+
+
+def cache_when_consumed(rows, cache_key, tenant):
+    """Pass rows through and cache the full list once the stream has been sent"""
+    produced = []
+    for row in rows:
+        produced.append(row)
+        yield row
+    recommendation_cache.set(cache_key, produced, tenant=tenant)
+
 
 @api_bp.route('/health', methods=['GET'])
 def health_check():
@@ -82,6 +221,22 @@ def recommend_products():
               description: Ignore seasonal factors in recommendations
               default: false
               example: false
+            fields:
+              type: array
+              description: Attributes to return for each recommended product (all by default);
+                product metadata is only loaded when requested
+              items:
+                type: string
+                enum: [product_id, name, confidence, support, category, score, is_seasonal, is_time_relevant, time_of_day, metadata]
+              example: ["product_id", "name", "score"]
+      - name: Accept
+        in: header
+        type: string
+        required: false
+        description: Send application/x-ndjson to stream one JSON line per source product
+    produces:
+      - application/json
+      - application/x-ndjson
     responses:
       200:
         description: Product recommendations
@@ -135,64 +290,222 @@ def recommend_products():
       404:
         description: Products not found
     """
-    from datetime import datetime
-    from recommendation import get_time_of_day
-    
-    data = request.json
-    if not data or 'product_ids' not in data:
-        return jsonify({'error': 'Missing product_ids parameter'}), 400
-    
-    product_ids = data.get('product_ids', [])
-    if not product_ids or not isinstance(product_ids, list):
-        return jsonify({'error': 'product_ids must be a non-empty array'}), 400
-    
-    limit = data.get('limit', 5)
-    min_confidence = data.get('min_confidence', 0.1)
-    
-    # Optional parameters for enhanced recommendations
-    time_of_day = data.get('time_of_day')  # Override the current time of day
-    ignore_seasonal = data.get('ignore_seasonal', False)  # Ignore seasonal factors
-    
-    # Validate optional parameters
-    if time_of_day and time_of_day not in ['morning', 'midday', 'evening', 'late_night']:
-        return jsonify({'error': 'time_of_day must be one of: morning, midday, evening, late_night'}), 400
+    params, error = parse_recommend_request(request.json)
+    if error:
+        return jsonify({'error': error}), 400
+    product_ids = params['product_ids']
     
-    # Get current context for enhanced recommendations
-    current_time_period = time_of_day if time_of_day else get_time_of_day()
-    current_month = datetime.now().month
+    # Get current user ID from API key
+    api_key = request.headers.get('X-API-Key')
+    api_key_obj = ApiKey.query.filter_by(key=api_key, active=True).first()
+    user_id = api_key_obj.user_id
     
     try:
-        # Get recommendations for the provided product IDs
-        recommendations = get_recommendations(product_ids, limit, min_confidence)
+        # Serve repeated baskets from the result cache; the model version in the
+        # key makes entries from an older model unreachable
+        cache_key = recommend_cache_key(user_id, params, get_recommendation_index().version)
+        cached = recommendation_cache.get(cache_key)
+        if cached is not None:
+            # Cached lists are per product, so restore the request's order
+            recommendations = restore_request_order(cached, product_ids)
+        elif wants_ndjson():
+            # Stream each product's list as soon as it is built; peek at the
+            # first one so an empty result still gets the 404 below
+            rows = iter_recommendations(
+                product_ids, params['limit'], params['min_confidence'], fields=params['fields'], slot=params['slot']
+            )
+            first = next(rows, None)
+            if first is not None:
+                response = ndjson_response(cache_when_consumed(chain([first], rows), cache_key, user_id))
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            recommendations = []
+            recommendation_cache.set(cache_key, recommendations, tenant=user_id)
+        else:
+            # Get recommendations for the provided product IDs
+            recommendations = get_recommendations(
+                product_ids, params['limit'], params['min_confidence'], fields=params['fields'], slot=params['slot']
+            )
+            recommendation_cache.set(cache_key, recommendations, tenant=user_id)
         
         if not recommendations:
             return jsonify({
                 'recommendations': [],
                 'message': 'No recommendations found for the given products',
-                'context': {
-                    'algorithm_version': '3.0',
-                    'time_of_day': current_time_period,
-                    'current_month': current_month,
-                    'seasonal_boost_applied': not ignore_seasonal,
-                    'time_boost_applied': time_of_day is not None
-                }
+                'context': recommend_context(params, params['time_of_day'] is not None)
             }), 404
         
+        if wants_ndjson():
+            response = ndjson_response(recommendations)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+        
         # Return recommendations with enhanced context information
-        return jsonify({
+        response = jsonify({
             'recommendations': recommendations,
+            'context': recommend_context(params, True)
+        })
+        response.headers['X-Cache'] = 'HIT' if cached is not None else 'MISS'
+        return response, 200
+    
+    except Exception as e:
+        logger.error(f"Error getting recommendations: {str(e)}")
+        return jsonify({'error': 'Failed to get recommendations', 'details': str(e)}), 500
+
+
+@api_bp.route('/recommend/batch', methods=['POST'])
+@api_key_required
+def recommend_batch():
+    """
+    Get recommendations for many baskets in one call (offline and email campaigns)
+    ---
+    tags:
+      - Recommendations
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - baskets
+          properties:
+            baskets:
+              type: array
+              description: Baskets to score, at most 10000 per call
+              items:
+                type: object
+                required:
+                  - product_ids
+                properties:
+                  basket_id:
+                    type: string
+                    description: Caller's identifier, echoed back (defaults to the basket's position)
+                  product_ids:
+                    type: array
+                    items:
+                      type: string
+              example: [{"basket_id": "customer-1", "product_ids": ["P001", "P002"]}]
+            limit:
+              type: integer
+              description: Maximum number of recommendations per basket
+              default: 5
+              example: 5
+            min_confidence:
+              type: number
+              description: Minimum confidence score (0-1)
+              default: 0.1
+              example: 0.1
+    responses:
+      200:
+        description: Recommendations per basket
+        schema:
+          properties:
+            results:
+              type: array
+              items:
+                type: object
+                properties:
+                  basket_id:
+                    type: string
+                  recommendations:
+                    type: array
+                    items:
+                      type: object
+                      properties:
+                        product_id:
+                          type: string
+                        score:
+                          type: number
+            context:
+              type: object
+      400:
+        description: Invalid request parameters
+    """
+    from datetime import datetime
+    from recommendation import get_time_of_day
+    
+    data = request.json
+    if not data or 'baskets' not in data:
+        return jsonify({'error': 'Missing baskets parameter'}), 400
+    
+    baskets = data.get('baskets')
+    if not baskets or not isinstance(baskets, list):
+        return jsonify({'error': 'baskets must be a non-empty array'}), 400
+    if len(baskets) > MAX_BATCH_BASKETS:
+        return jsonify({'error': f'At most {MAX_BATCH_BASKETS} baskets are accepted per request'}), 400
+    
+    basket_ids = []
+    basket_products = []
+    for position, basket in enumerate(baskets):
+        product_ids = basket.get('product_ids') if isinstance(basket, dict) else None
+        if not product_ids or not isinstance(product_ids, list):
+            return jsonify({'error': f'Basket {position} must have a non-empty product_ids array'}), 400
+        basket_ids.append(basket.get('basket_id', position))
+        basket_products.append(product_ids)
+    
+    limit = data.get('limit', 5)
+    min_confidence = data.get('min_confidence', 0.1)
+    
+    try:
+        results = get_batch_recommendations(basket_products, limit, min_confidence)
+        
+        return jsonify({
+            'results': [
+                {'basket_id': basket_id, 'recommendations': recommendations}
+                for basket_id, recommendations in zip(basket_ids, results)
+            ],
             'context': {
                 'algorithm_version': '3.0',
-                'time_of_day': current_time_period,
-                'current_month': current_month,
-                'seasonal_boost_applied': not ignore_seasonal,
-                'time_boost_applied': True
+                'time_of_day': get_time_of_day(),
+                'current_month': datetime.now().month,
+                'baskets': len(basket_ids)
             }
         }), 200
     
     except Exception as e:
-        logger.error(f"Error getting recommendations: {str(e)}")
-        return jsonify({'error': 'Failed to get recommendations', 'details': str(e)}), 500
+        logger.error(f"Error getting batch recommendations: {str(e)}")
+        return jsonify({'error': 'Failed to get batch recommendations', 'details': str(e)}), 500
+
+
+@api_bp.route('/rules/export', methods=['GET'])
+@api_key_required
+def export_rules():
+    """
+    Export the calling tenant's association rules as a stream
+    
+    Only rules whose source product was created by the API key's user are included.
+    ---
+    tags:
+      - Recommendations
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: One JSON line per source product with its rules, best score first
+        schema:
+          properties:
+            product_id:
+              type: string
+            rules:
+              type: array
+              items:
+                type: object
+                properties:
+                  product_id:
+                    type: string
+                  confidence:
+                    type: number
+                  support:
+                    type: number
+                  score:
+                    type: number
+    """
+    # Get current user ID from API key
+    api_key = request.headers.get('X-API-Key')
+    api_key_obj = ApiKey.query.filter_by(key=api_key, active=True).first()
+    
+    return ndjson_response(iter_rule_export(api_key_obj.user_id))
 
 
 @api_bp.route('/transactions', methods=['POST'])
@@ -251,9 +564,9 @@ def upload_transactions():
     user_id = api_key_obj.user_id
     
     try:
-        # Process the transactions asynchronously
-        # In a real production environment, this would be a background job
-        job_id = batch_process_transactions(transactions, user_id)
+        # Queue the transactions; a background worker ingests them and retrains
+        job_id = batch_process_transactions(transactions, user_id, api_key_obj.config)
+        submit_job(job_id)
         
         return jsonify({
             'status': 'accepted',
@@ -266,6 +579,87 @@ def upload_transactions():
         return jsonify({'error': 'Failed to process transactions', 'details': str(e)}), 500
 
 
+@api_bp.route('/transactions/stream', methods=['POST'])
+@api_key_required
+def upload_transaction_stream():
+    """
+    Upload a large transaction export as a stream
+    
+    The body is parsed incrementally and stored in chunks while it arrives,
+    so uploads of any size are ingested with flat memory. Training then runs
+    as a background job, as for /transactions.
+    ---
+    tags:
+      - Data Management
+    consumes:
+      - application/x-ndjson
+      - text/csv
+    parameters:
+      - name: Content-Type
+        in: header
+        type: string
+        required: true
+        description: application/x-ndjson (one transaction object per line) or text/csv
+      - name: Content-Encoding
+        in: header
+        type: string
+        required: false
+        description: gzip for a compressed body
+      - name: body
+        in: body
+        required: true
+        description: >
+          NDJSON lines shaped like the /transactions items, or CSV with a header
+          row of transaction_id, products (JSON array or IDs separated by ';'),
+          timestamp and metadata (JSON object)
+        schema:
+          type: string
+    responses:
+      202:
+        description: Transactions stored, training queued
+      400:
+        description: Unsupported body format
+      415:
+        description: Unsupported Content-Type or Content-Encoding
+    """
+    upload_format = UPLOAD_MIMETYPES.get(request.mimetype)
+    if upload_format is None:
+        return jsonify({
+            'error': 'Unsupported Content-Type',
+            'message': f"Send one of: {', '.join(UPLOAD_MIMETYPES)}"
+        }), 415
+    
+    content_encoding = (request.content_encoding or 'identity').lower()
+    if content_encoding not in ('identity', 'gzip'):
+        return jsonify({'error': 'Unsupported Content-Encoding', 'message': 'Send gzip or uncompressed bodies'}), 415
+    
+    # Get current user ID from API key
+    api_key = request.headers.get('X-API-Key')
+    api_key_obj = ApiKey.query.filter_by(key=api_key, active=True).first()
+    user_id = api_key_obj.user_id
+    
+    try:
+        records = iter_uploaded_transactions(request.stream, upload_format, compressed=content_encoding == 'gzip')
+        job_id, ingestion = stream_process_transactions(records, user_id, api_key_obj.config)
+        submit_job(job_id)
+        
+        return jsonify({
+            'status': 'accepted',
+            'message': 'Transactions stored, recommendations are being updated',
+            'job_id': job_id,
+            'ingestion': ingestion
+        }), 202
+    
+    except (OSError, EOFError, UnicodeDecodeError) as e:
+        # Corrupt gzip data or a body that is not UTF-8 text
+        logger.error(f"Error reading transaction stream: {str(e)}")
+        return jsonify({'error': 'Invalid upload body', 'details': str(e)}), 400
+    
+    except Exception as e:
+        logger.error(f"Error processing transaction stream: {str(e)}")
+        return jsonify({'error': 'Failed to process transactions', 'details': str(e)}), 500
+
+
 @api_bp.route('/products', methods=['POST'])
 @api_key_required
 def add_products():
@@ -388,6 +782,45 @@ def get_job_status(job_id):
     responses:
       200:
         description: Job status information
+        schema:
+          properties:
+            job_id:
+              type: integer
+            status:
+              type: string
+              enum: [receiving, pending, processing, completed, failed, superseded]
+            queue_position:
+              type: integer
+              description: Pending jobs ahead of this one (pending jobs only)
+            scheduled_for:
+              type: string
+              description: Earliest start, once the tenant's uploads have paused (pending jobs only)
+            superseded_by:
+              type: integer
+              description: Job whose training run covers this upload (superseded jobs only)
+            worker:
+              type: string
+              description: Worker running or having run the job
+            heartbeat_at:
+              type: string
+              description: Last lease renewal by the worker (processing jobs only)
+            created_at:
+              type: string
+            started_at:
+              type: string
+            completed_at:
+              type: string
+            result_stats:
+              type: object
+              description: >
+                Job statistics; 'phases' lists wall time, CPU time of the job's thread,
+                process-wide child CPU time and RSS, and rows in/out for each phase (ingestion, loading, matrix, planning, mining, rules,
+                scoring, persistence, statistics)
+            phases:
+              type: array
+              description: Phase timings recorded so far (pending and failed jobs)
+              items:
+                type: object
       404:
         description: Job not found
     """
@@ -406,17 +839,66 @@ def get_job_status(job_id):
         'job_id': job.id,
         'status': job.status,
         'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
         'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+        'worker': job.worker
     }
     
-    if job.status == 'completed':
+    if job.status == 'pending':
+        result['queue_position'] = RecommendationJob.query.filter(
+            RecommendationJob.status == 'pending',
+            RecommendationJob.created_at < job.created_at
+        ).count()
+        result['scheduled_for'] = job.not_before.isoformat() if job.not_before else None
+        result['phases'] = (job.result_stats or {}).get('phases')
+    elif job.status == 'processing':
+        result['heartbeat_at'] = job.heartbeat_at.isoformat() if job.heartbeat_at else None
+    elif job.status == 'superseded':
+        # The upload is trained on by the superseding job; follow superseded_by for its outcome
+        result['superseded_by'] = job.superseded_by
+        result['result_stats'] = job.result_stats
+    elif job.status == 'completed':
         result['result_stats'] = job.result_stats
     elif job.status == 'failed':
         result['error'] = job.error
+        result['phases'] = (job.result_stats or {}).get('phases')
     
     return jsonify(result), 200
 
 
+@api_bp.route('/cache/stats', methods=['GET'])
+@api_key_required
+def cache_stats():
+    """
+    Recommendation result cache statistics
+    ---
+    tags:
+      - System
+    responses:
+      200:
+        description: Cache hit/miss counters
+        schema:
+          properties:
+            size:
+              type: integer
+            maxsize:
+              type: integer
+            ttl_seconds:
+              type: number
+            hits:
+              type: integer
+            misses:
+              type: integer
+            hit_rate:
+              type: number
+            evictions:
+              type: integer
+            tenant_invalidations:
+              type: integer
+    """
+    return jsonify(recommendation_cache.stats()), 200
+
+
 @api_bp.route('/config', methods=['GET', 'PUT'])
 @api_key_required
 def manage_config():
@@ -444,6 +926,27 @@ def manage_config():
               type: integer
               description: Default maximum recommendations to return
               example: 5
+            algorithm:
+              type: string
+              description: Frequent pattern mining engine used for training
+              enum: [apriori, fp_growth, eclat, pairs]
+              example: "fp_growth"
+            itemset_budget:
+              type: integer
+              description: Target number of frequent itemsets used to plan the training support threshold
+              example: 20000
+            workers:
+              type: integer
+              description: Worker processes for partitioned training (1 trains in-process), at most the training node's CPU count
+              example: 1
+            chunk_size:
+              type: integer
+              description: Transactions per training partition when workers > 1 (null splits evenly)
+              example: 50000
+            retrain_quiet_seconds:
+              type: integer
+              description: Uploads arriving within this many seconds of each other share one training run
+              example: 30
     responses:
       200:
         description: Current configuration
@@ -459,7 +962,8 @@ def manage_config():
         config = api_key_obj.config or {
             'min_confidence': 0.1,
             'min_support': 0.01,
-            'max_recommendations': 5
+            'max_recommendations': 5,
+            'algorithm': DEFAULT_MINING_ENGINE
         }
         return jsonify(config), 200
     
@@ -468,8 +972,19 @@ def manage_config():
         if not data:
             return jsonify({'error': 'No configuration data provided'}), 400
         
+        if 'algorithm' in data and data['algorithm'] not in MINING_ENGINES:
+            return jsonify({'error': f"algorithm must be one of: {', '.join(MINING_ENGINES)}"}), 400
+        
+        # Training settings reach worker processes; reject anything but sane integers
+        for key in TRAINING_INTEGER_SETTINGS:
+            if key in data and not (key == 'chunk_size' and data[key] is None):
+                error = training_setting_error(key, data[key])
+                if error:
+                    return jsonify({'error': error}), 400
+        
         # Get current config and update with new values
-        current_config = api_key_obj.config or {}
+        # Copy so SQLAlchemy sees a new value rather than an in-place JSONB mutation
+        current_config = dict(api_key_obj.config or {})
         
         # Update config with new values
         for key, value in data.items():
@@ -100,10 +100,25 @@ with app.app_context():
     from models import User, Product, Transaction, ApiKey
     db.create_all()
     
+    # Tables of an earlier version are upgraded explicitly (flask upgrade-db)
+    from utils import check_schema, init_db
+    check_schema()
+    
     # Initialize database with default data if needed
-    from utils import init_db
     init_db()
 
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Add the columns and constraints an existing database is missing"""
+    import click
+    from utils import upgrade_schema
+    
+    changes = upgrade_schema()
+    for change in changes:
+        click.echo(change)
+    click.echo("Database schema is up to date" if not changes else f"Applied {len(changes)} schema changes")
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
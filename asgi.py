@@ -0,0 +1,307 @@
+"""
+Async (ASGI) serving entry point for the recommendation read path
+
+The Flask app in main.py holds a worker thread for every in-flight request.
+This module serves the hot endpoints, /api/health and /api/recommend, from a
+single event loop instead: API-key checks, model version checks and metadata
+reads go through an async SQLAlchemy engine, and recommendations come from
+the same in-memory index and assembly code as the Flask view, so the two
+paths return identical responses. Uploads, configuration and the demo UI stay
+on the WSGI app.
+
+Run with any ASGI server, e.g.:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+DATABASE_URL selects the database as for the Flask app; postgresql:// URLs
+are served through asyncpg and sqlite:// URLs through aiosqlite.
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from app import app as flask_app
+from models import ApiKey, Product
+from api import (
+    parse_recommend_request, recommend_cache_key, restore_request_order, recommend_context,
+    NDJSON_MIMETYPE
+)
+from cache import recommendation_cache
+from recommendation import (
+    peek_recommendation_index, refresh_recommendation_index, model_version_statement,
+    iter_assembled_recommendations, rendered_product_ids
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Async driver used for each database backend
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite'
+}
+
+
+def async_database_url(url):
+    """
+    Rewrite a database URL to use the backend's async driver
+
+    Args:
+        url (str): Synchronous SQLAlchemy database URL
+
+    Returns:
+        sqlalchemy.engine.URL: URL with the async driver
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend '{backend}'")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_engine_for(url):
+    """Async engine for a database URL; pool sizing comes from the environment"""
+    url = async_database_url(url)
+    options = {'pool_pre_ping': True}
+    if url.get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=int(os.environ.get("ASYNC_DB_POOL_SIZE", 20)),
+            max_overflow=int(os.environ.get("ASYNC_DB_MAX_OVERFLOW", 20)),
+            pool_recycle=300
+        )
+    return create_async_engine(url, **options)
+
+
+engine = create_engine_for(flask_app.config["SQLALCHEMY_DATABASE_URI"])
+
+# Serialises index rebuilds so a version change triggers one rebuild, not one per request
+_index_refresh_lock = asyncio.Lock()
+
+
+def _refresh_index(version):
+    with flask_app.app_context():
+        return refresh_recommendation_index(version)
+
+
+async def current_index(conn):
+    """
+    Current recommendation index, re-checking the model version on the async connection
+
+    Rebuilding the index is a bulk read done rarely, so it runs on the
+    synchronous engine in a worker thread without blocking the event loop.
+
+    Args:
+        conn (AsyncConnection): Connection of the current request
+
+    Returns:
+        RecommendationIndex: The current index
+    """
+    index, check_version = peek_recommendation_index()
+    if not check_version:
+        return index
+
+    version = int((await conn.execute(model_version_statement())).scalar())
+    if index is not None and index.version == version:
+        return index
+
+    async with _index_refresh_lock:
+        index, _ = peek_recommendation_index()
+        if index is None or index.version != version:
+            index = await asyncio.to_thread(_refresh_index, version)
+    return index
+
+
+async def authenticate(conn, api_key):
+    """
+    Resolve an active API key to its user, recording its use
+
+    Args:
+        conn (AsyncConnection): Connection of the current request
+        api_key (str): Value of the X-API-Key header
+
+    Returns:
+        int: User ID, or None if the key is missing, unknown or inactive
+    """
+    if not api_key:
+        return None
+
+    user_id = (await conn.execute(
+        select(ApiKey.user_id).where(ApiKey.key == api_key, ApiKey.active.is_(True))
+    )).scalar()
+    if user_id is not None:
+        await conn.execute(update(ApiKey).where(ApiKey.key == api_key).values(last_used=datetime.now()))
+    return user_id
+
+
+async def get_recommendations_async(conn, user_id, params):
+    """
+    Async counterpart of the cached /api/recommend lookup
+
+    Args:
+        conn (AsyncConnection): Connection of the current request
+        user_id (int): Tenant the result is cached for
+        params (dict): Request parameters from parse_recommend_request
+
+    Returns:
+        tuple: (list of recommendation objects, whether it was a cache hit)
+    """
+    product_ids = params['product_ids']
+    index = await current_index(conn)
+
+    cache_key = recommend_cache_key(user_id, params, index.version)
+    cached = recommendation_cache.get(cache_key)
+    if cached is not None:
+        return restore_request_order(cached, product_ids), True
+
+    product_map, candidates = index.candidates(product_ids, params['min_confidence'], params['slot'])
+    recommendations = []
+    if product_map:
+        products = index.products
+        if params['fields'] is None or 'metadata' in params['fields']:
+            internal_ids = rendered_product_ids(product_map, candidates)
+            missing = index.missing_metadata(internal_ids)
+            if missing:
+                rows = await conn.execute(
+                    select(Product.id, Product.product_metadata).where(Product.id.in_(missing))
+                )
+                index.store_metadata(rows.all())
+            products = index.with_metadata(internal_ids)
+
+        recommendations = list(iter_assembled_recommendations(
+            product_ids, product_map, products, candidates, params['limit'], params['fields']
+        ))
+    else:
+        logger.warning(f"No products found for IDs: {product_ids}")
+
+    recommendation_cache.set(cache_key, recommendations, tenant=user_id)
+    return recommendations, False
+
+
+async def read_body(receive):
+    """Read the full request body from the ASGI receive channel"""
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def send_response(send, payload, status=200, headers=None, ndjson=False):
+    """
+    Send a JSON response, or one NDJSON line per row of a list payload
+
+    NDJSON rows are sent as separate body chunks so clients can start
+    consuming before the last row is written.
+    """
+    content_type = NDJSON_MIMETYPE if ndjson else 'application/json'
+    response_headers = [(b'content-type', content_type.encode())]
+    response_headers.extend((name.lower().encode(), value.encode()) for name, value in (headers or {}).items())
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+
+    if not ndjson:
+        await send({'type': 'http.response.body', 'body': json.dumps(payload, default=str).encode()})
+        return
+
+    for row in payload:
+        await send({
+            'type': 'http.response.body',
+            'body': (json.dumps(row, default=str) + '\n').encode(),
+            'more_body': True
+        })
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def health_check(request_headers, body, send):
+    await send_response(send, {'status': 'ok', 'version': '1.0.0'})
+
+
+async def recommend_products(request_headers, body, send):
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    params, error = parse_recommend_request(data)
+
+    api_key = request_headers.get('x-api-key')
+    if not api_key:
+        return await send_response(send, {
+            'error': 'Missing API key',
+            'message': 'API key must be provided in the X-API-Key header'
+        }, 401)
+
+    try:
+        async with engine.begin() as conn:
+            user_id = await authenticate(conn, api_key)
+            if user_id is None:
+                return await send_response(send, {
+                    'error': 'Invalid API key',
+                    'message': 'The provided API key is invalid or inactive'
+                }, 401)
+            if error:
+                return await send_response(send, {'error': error}, 400)
+
+            recommendations, cache_hit = await get_recommendations_async(conn, user_id, params)
+
+    except Exception as e:
+        logger.error(f"Error getting recommendations: {str(e)}")
+        return await send_response(send, {'error': 'Failed to get recommendations', 'details': str(e)}, 500)
+
+    if not recommendations:
+        return await send_response(send, {
+            'recommendations': [],
+            'message': 'No recommendations found for the given products',
+            'context': recommend_context(params, params['time_of_day'] is not None)
+        }, 404)
+
+    accept = parse_accept_header(request_headers.get('accept'), MIMEAccept)
+    headers = {'X-Cache': 'HIT' if cache_hit else 'MISS'}
+    if accept.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        return await send_response(send, recommendations, headers=headers, ndjson=True)
+
+    await send_response(send, {
+        'recommendations': recommendations,
+        'context': recommend_context(params, True)
+    }, headers=headers)
+
+
+# (method, path) -> handler
+ROUTES = {
+    ('GET', '/api/health'): health_check,
+    ('POST', '/api/recommend'): recommend_products
+}
+
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        allowed = any(path == scope['path'] for _, path in ROUTES)
+        return await send_response(
+            send, {'error': 'Method not allowed' if allowed else 'Not found'}, 405 if allowed else 404
+        )
+
+    request_headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    body = await read_body(receive)
+    await handler(request_headers, body, send)
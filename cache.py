@@ -0,0 +1,123 @@
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TTLCache:
+    """
+    Thread-safe bounded LRU cache whose entries also expire after a TTL
+
+    Entries are tagged with a tenant so that everything cached for one tenant
+    can be dropped at once, e.g. when a recommendation job for it completes.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, tenant, value)
+        self._tenant_keys = {}  # tenant -> set of keys
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Look up a cached value
+
+        Args:
+            key: Cache key
+
+        Returns:
+            The cached value, or None on a miss or expired entry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, value, tenant=None):
+        """
+        Store a value, evicting the least recently used entries when full
+
+        Args:
+            key: Cache key
+            value: Value to cache
+            tenant (optional): Tenant the entry belongs to
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (monotonic() + self.ttl, tenant, value)
+            self._tenant_keys.setdefault(tenant, set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_tenant(self, tenant):
+        """
+        Drop every entry cached for a tenant
+
+        Args:
+            tenant: Tenant whose entries are dropped
+
+        Returns:
+            int: Number of entries removed
+        """
+        with self._lock:
+            keys = self._tenant_keys.pop(tenant, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            self.invalidations += 1
+            return len(keys)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._tenant_keys.clear()
+
+    def stats(self):
+        """
+        Hit/miss counters for monitoring
+
+        Returns:
+            dict: Cache statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'tenant_invalidations': self.invalidations
+            }
+
+    def _remove(self, key):
+        _, tenant, _ = self._entries.pop(key)
+        keys = self._tenant_keys.get(tenant)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tenant_keys[tenant]
+
+
+# Cache of /api/recommend results, sized and timed through the environment
+recommendation_cache = TTLCache(
+    maxsize=int(os.environ.get("RECOMMENDATION_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("RECOMMENDATION_CACHE_TTL", 300))
+)
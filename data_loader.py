@@ -15,6 +15,7 @@ from datetime import datetime, timedelta
 import random
 from app import db
 from models import Product, Transaction
+from recommendation import ingest_transactions
 from sqlalchemy.exc import SQLAlchemyError
 
 # Configure logging
@@ -527,8 +528,12 @@ def load_grocery_data_into_db(user_id):
         # Convert to products and transactions
         products, transaction_objects = convert_to_products_and_transactions(transactions, user_id)
         
-        # Add products to database
-        existing_products = {p.product_id for p in Product.query.filter_by(created_by=user_id).all()}
+        # Add products to database, looking up only the dataset's product IDs
+        existing_products = {
+            product_id for (product_id,) in db.session.query(Product.product_id).filter(
+                Product.product_id.in_([p.product_id for p in products])
+            )
+        }
         new_products = [p for p in products if p.product_id not in existing_products]
         
         if new_products:
@@ -536,20 +541,24 @@ def load_grocery_data_into_db(user_id):
             db.session.add_all(new_products)
             db.session.commit()
         
-        # Add transactions to database
-        existing_transactions = {t.transaction_id for t in Transaction.query.filter_by(user_id=user_id).all()}
-        new_transactions = [t for t in transaction_objects if t.transaction_id not in existing_transactions]
-        
-        if new_transactions:
-            logger.info(f"Adding {len(new_transactions)} new transactions to database")
-            db.session.add_all(new_transactions)
-            db.session.commit()
+        # Add transactions to database; already loaded ones are skipped by the database
+        _, ingestion = ingest_transactions(user_id, [
+            {
+                'transaction_id': t.transaction_id,
+                'timestamp': t.timestamp.isoformat(),
+                'products': t.products,
+                'metadata': t.transaction_metadata
+            }
+            for t in transaction_objects
+        ])
+        logger.info(f"Added {ingestion['rows_ingested']} new transactions to database")
         
         return {
             'products_total': len(products),
             'products_added': len(new_products),
             'transactions_total': len(transaction_objects),
-            'transactions_added': len(new_transactions),
+            'transactions_added': ingestion['rows_ingested'],
+            'transactions_skipped': ingestion['rows_duplicate'],
             'unique_items': len(set(item for tx in transactions for item in tx))
         }
         
@@ -0,0 +1,479 @@
+"""
+Background execution of recommendation jobs
+
+Uploads only create a pending RecommendationJob; workers claim pending jobs
+and run them with run_recommendation_job(), so requests return immediately.
+
+On PostgreSQL a pool of worker processes polls the job table and claims jobs
+with SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers (also in
+other processes or hosts) can share the queue without running a job twice.
+Other databases (SQLite) cannot share work across processes, so jobs are
+handed to worker threads through an in-process queue instead.
+
+A tenant's jobs run one at a time (incremental updates read and write the
+same statistics); a job whose tenant is busy waits for a later claim. Uploads
+are coalesced per tenant: a new upload supersedes the tenant's queued job and
+takes over its transactions, and is not claimed before its quiet window
+(RECOMMENDATION_RETRAIN_QUIET_SECONDS) has passed, so a burst of uploads
+results in one training run (see recommendation.coalesce_pending_jobs).
+
+A running job holds a lease that its worker renews every
+RECOMMENDATION_JOB_HEARTBEAT_INTERVAL seconds. If the worker dies (crash,
+restart) the lease runs out after RECOMMENDATION_JOB_LEASE_SECONDS; the job
+stops blocking its tenant and is put back to pending for another worker.
+
+Completed jobs reach the serving processes through the model version stored
+with each tenant's model state (RecommendationModelState.model_version): a
+worker only refreshes its own process's index and result cache, and every
+other process (e.g. web servers when the workers are separate processes)
+rebuilds its index and stops using older cache entries once its periodic
+version check (RECOMMENDATION_INDEX_CHECK_INTERVAL, default 30 seconds) sees
+the new version.
+
+The worker count comes from RECOMMENDATION_JOB_WORKERS (0 runs jobs inline in
+the request, as before, once no other job of the tenant is running). Workers
+can also run on their own; RECOMMENDATION_EXTERNAL_JOB_WORKERS=1 starts no
+workers in the web process and leaves uploaded jobs pending for them:
+    RECOMMENDATION_EXTERNAL_JOB_WORKERS=1 gunicorn main:app   # web only
+    python jobs.py                                             # workers only (PostgreSQL)
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+
+from flask import current_app
+from sqlalchemy.orm import aliased
+
+from app import db
+from models import RecommendationJob, User
+from recommendation import run_recommendation_job
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of workers started with the app
+DEFAULT_JOB_WORKERS = int(os.environ.get("RECOMMENDATION_JOB_WORKERS", 2))
+
+# Leave jobs pending for workers in another process (python jobs.py)
+EXTERNAL_JOB_WORKERS = bool(int(os.environ.get("RECOMMENDATION_EXTERNAL_JOB_WORKERS", 0)))
+
+# Seconds an idle worker waits before looking for new jobs
+JOB_POLL_INTERVAL = float(os.environ.get("RECOMMENDATION_JOB_POLL_INTERVAL", 1.0))
+
+# Seconds between lease renewals of a running job
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("RECOMMENDATION_JOB_HEARTBEAT_INTERVAL", 30.0))
+
+# Seconds without renewal after which a running job's worker is presumed dead
+JOB_LEASE_SECONDS = float(os.environ.get("RECOMMENDATION_JOB_LEASE_SECONDS", 120.0))
+
+_job_workers = None
+
+
+def lease_expired(job=RecommendationJob):
+    """Condition: the job's worker has not renewed its lease in time"""
+    last_seen = db.func.coalesce(job.heartbeat_at, job.started_at, job.created_at)
+    return last_seen < datetime.now() - timedelta(seconds=JOB_LEASE_SECONDS)
+
+
+def tenant_idle():
+    """Condition: no job of the same tenant is being processed by a live worker"""
+    running = aliased(RecommendationJob)
+    return ~db.session.query(running.id).filter(
+        running.user_id == RecommendationJob.user_id,
+        running.status == 'processing',
+        ~lease_expired(running)
+    ).exists()
+
+
+def job_due():
+    """Condition: the job's quiet window has passed"""
+    return db.or_(RecommendationJob.not_before.is_(None), RecommendationJob.not_before <= datetime.now())
+
+
+def claim_next_job(worker_name):
+    """
+    Claim the oldest due pending job of an idle tenant, skipping jobs other
+    workers hold locked
+
+    Args:
+        worker_name (str): Name recorded on the claimed job
+
+    Returns:
+        int: ID of the claimed job, or None if nothing can be claimed
+    """
+    job = (
+        RecommendationJob.query
+        .filter(RecommendationJob.status == 'pending', job_due(), tenant_idle())
+        .order_by(RecommendationJob.created_at, RecommendationJob.id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if job is None:
+        db.session.rollback()
+        return None
+    
+    # Two workers may pick different jobs of one tenant at the same time; the
+    # tenant row lock orders them, and the second sees the first's claim
+    db.session.query(User.id).filter_by(id=job.user_id).with_for_update().one()
+    busy = (
+        RecommendationJob.query
+        .filter_by(user_id=job.user_id, status='processing')
+        .filter(~lease_expired())
+        .first()
+    )
+    if busy is not None:
+        db.session.rollback()
+        return None
+
+    job.status = 'processing'
+    job.started_at = job.heartbeat_at = datetime.now()
+    job.worker = worker_name
+    db.session.commit()
+    return job.id
+
+
+def claim_job(job_id, worker_name, wait=True):
+    """
+    Claim one specific job if it is still pending
+
+    The checks and the update are a single conditional UPDATE, so a job is
+    claimed at most once, and never while its tenant has a job processing.
+
+    Args:
+        job_id (int): ID of the job
+        worker_name (str): Name recorded on the claimed job
+        wait (bool): Leave the job pending during its quiet window
+
+    Returns:
+        bool: Whether this worker claimed the job
+    """
+    query = RecommendationJob.query.filter(
+        RecommendationJob.id == job_id, RecommendationJob.status == 'pending', tenant_idle()
+    )
+    if wait:
+        query = query.filter(job_due())
+    now = datetime.now()
+    claimed = (
+        query
+        .update(
+            {'status': 'processing', 'started_at': now, 'heartbeat_at': now, 'worker': worker_name},
+            synchronize_session=False
+        )
+    )
+    db.session.commit()
+    return claimed == 1
+
+
+def requeue_stale_jobs():
+    """
+    Put processing jobs whose worker stopped renewing its lease back to pending
+
+    Returns:
+        list: IDs of the re-queued jobs
+    """
+    stale = [
+        job_id for (job_id,) in
+        db.session.query(RecommendationJob.id).filter(RecommendationJob.status == 'processing', lease_expired())
+    ]
+    if not stale:
+        db.session.rollback()
+        return []
+
+    (
+        RecommendationJob.query
+        .filter(RecommendationJob.id.in_(stale), RecommendationJob.status == 'processing', lease_expired())
+        .update(
+            {'status': 'pending', 'started_at': None, 'heartbeat_at': None, 'worker': None},
+            synchronize_session=False
+        )
+    )
+    db.session.commit()
+    logger.warning(f"Re-queued recommendation jobs {stale}: their workers stopped renewing the lease")
+    return stale
+
+
+class JobHeartbeat(threading.Thread):
+    """Background thread renewing the lease of a running job until stopped"""
+
+    def __init__(self, app, job_id, worker_name, interval=JOB_HEARTBEAT_INTERVAL):
+        super().__init__(daemon=True)
+        self.app = app
+        self.job_id = job_id
+        self.worker_name = worker_name
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    renewed = (
+                        RecommendationJob.query
+                        .filter_by(id=self.job_id, status='processing', worker=self.worker_name)
+                        .update({'heartbeat_at': datetime.now()}, synchronize_session=False)
+                    )
+                    db.session.commit()
+                except Exception as e:
+                    # E.g. SQLite busy with the job's own writes: retry next time
+                    db.session.rollback()
+                    logger.warning(f"Could not renew the lease of recommendation job {self.job_id}: {str(e)}")
+                    continue
+                finally:
+                    db.session.remove()
+            if not renewed:
+                logger.warning(f"{self.worker_name} lost the lease of recommendation job {self.job_id}")
+                return
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+@contextmanager
+def job_lease(job_id, worker_name):
+    """Renew the claimed job's lease while the enclosed block runs it"""
+    heartbeat = JobHeartbeat(current_app._get_current_object(), job_id, worker_name)
+    heartbeat.start()
+    try:
+        yield
+    finally:
+        heartbeat.stop()
+
+
+def run_claimed_job(job_id, worker_name):
+    """Run a claimed job; failures are recorded on the job by run_recommendation_job"""
+    logger.info(f"{worker_name} running recommendation job {job_id}")
+    try:
+        with job_lease(job_id, worker_name):
+            run_recommendation_job(job_id)
+    except Exception:
+        logger.exception(f"{worker_name} failed to run recommendation job {job_id}")
+    finally:
+        db.session.remove()
+
+
+def _poll_jobs(app, worker_name, poll_interval, stop_event):
+    """Worker process: claim and run pending jobs until stopped"""
+    with app.app_context():
+        # Connections inherited from the parent process must not be shared
+        db.engine.dispose(close=False)
+
+    swept_at = float('-inf')
+    while not stop_event.is_set():
+        with app.app_context():
+            try:
+                job_id = claim_next_job(worker_name)
+                if job_id is not None:
+                    run_claimed_job(job_id, worker_name)
+                    continue
+                if monotonic() - swept_at >= JOB_HEARTBEAT_INTERVAL:
+                    swept_at = monotonic()
+                    requeue_stale_jobs()
+            except Exception:
+                # E.g. a dropped connection: keep the worker alive and poll again
+                logger.exception(f"{worker_name} could not poll for recommendation jobs")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+        stop_event.wait(poll_interval)
+
+
+class JobWorkerPool:
+    """
+    Pool of workers running pending recommendation jobs
+
+    Uses worker processes claiming jobs with FOR UPDATE SKIP LOCKED on
+    PostgreSQL, and worker threads fed by an in-process queue elsewhere.
+    """
+
+    def __init__(self, app, workers=DEFAULT_JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        with app.app_context():
+            self.dialect = db.engine.dialect.name
+        self.uses_processes = self.dialect == 'postgresql'
+        self._queue = None if self.uses_processes else queue.Queue()
+        self._stop = None
+        self._workers = []
+        self._swept_at = float('-inf')
+
+    def start(self):
+        """Start the workers"""
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        # Jobs orphaned by a crashed or restarted worker become pending again
+        with self.app.app_context():
+            requeue_stale_jobs()
+            db.session.remove()
+
+        if self.uses_processes:
+            context = multiprocessing.get_context('fork')
+            self._stop = context.Event()
+            # Not daemonic: partitioned mining starts a process pool inside the worker
+            for number in range(self.workers):
+                worker = context.Process(
+                    target=_poll_jobs,
+                    args=(self.app, f"{prefix}/worker-{number}", self.poll_interval, self._stop),
+                    daemon=False
+                )
+                worker.start()
+                self._workers.append(worker)
+            # Non-daemonic workers are joined at exit, so they must be told to stop first
+            atexit.register(self.stop)
+        else:
+            self._stop = threading.Event()
+            for number in range(self.workers):
+                worker = threading.Thread(
+                    target=self._consume_queue, args=(f"{prefix}/thread-{number}",), daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+
+            # Jobs left pending by a previous run would otherwise never be queued
+            with self.app.app_context():
+                for (job_id,) in (
+                    db.session.query(RecommendationJob.id)
+                    .filter_by(status='pending')
+                    .order_by(RecommendationJob.created_at, RecommendationJob.id)
+                ):
+                    self._queue.put(job_id)
+
+        logger.info(
+            f"Started {self.workers} recommendation job {'processes' if self.uses_processes else 'threads'}"
+        )
+        return self
+
+    def submit(self, job_id):
+        """
+        Make a pending job available to the workers
+
+        Worker processes find pending jobs in the table themselves, so this
+        only matters for the in-process queue.
+        """
+        if self._queue is not None:
+            self._queue.put(job_id)
+
+    def join(self, timeout=None):
+        """Wait for the workers to exit"""
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def stop(self, timeout=None):
+        """Ask the workers to finish their current job and exit"""
+        self._stop.set()
+        self.join(timeout)
+
+    def _consume_queue(self, worker_name):
+        while not self._stop.is_set():
+            try:
+                job_id = self._queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                job_id = None
+            if job_id is None:
+                self._requeue_stale_jobs()
+                continue
+            with self.app.app_context():
+                try:
+                    if claim_job(job_id, worker_name):
+                        run_claimed_job(job_id, worker_name)
+                        continue
+                    still_pending = RecommendationJob.query.filter_by(id=job_id, status='pending').count()
+                except Exception:
+                    # E.g. SQLite busy: keep the thread alive and retry the job later
+                    logger.exception(f"{worker_name} could not claim recommendation job {job_id}")
+                    db.session.rollback()
+                    still_pending = True
+                finally:
+                    db.session.remove()
+            if still_pending:
+                # Its quiet window is open or its tenant busy: try again later
+                self._stop.wait(self.poll_interval)
+                self._queue.put(job_id)
+
+    def _requeue_stale_jobs(self):
+        """Queue jobs whose worker lost its lease, at most once per heartbeat interval"""
+        if monotonic() - self._swept_at < JOB_HEARTBEAT_INTERVAL:
+            return
+        self._swept_at = monotonic()
+        with self.app.app_context():
+            try:
+                for job_id in requeue_stale_jobs():
+                    self._queue.put(job_id)
+            except Exception:
+                logger.exception("Could not re-queue recommendation jobs with expired leases")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def start_job_workers(app, workers=None):
+    """
+    Start the background workers for this process
+
+    Args:
+        app (Flask): Application whose database the jobs use
+        workers (int, optional): Number of workers (defaults to RECOMMENDATION_JOB_WORKERS)
+
+    Returns:
+        JobWorkerPool: The started pool, or None when workers are disabled or external
+    """
+    global _job_workers
+
+    workers = DEFAULT_JOB_WORKERS if workers is None else workers
+    if workers <= 0 or EXTERNAL_JOB_WORKERS:
+        return None
+    _job_workers = JobWorkerPool(app, workers).start()
+    return _job_workers
+
+
+def submit_job(job_id):
+    """
+    Hand a newly created pending job to the workers
+
+    With external workers the job is left pending for them. Without any
+    workers the job is run inline, without waiting for its quiet window but
+    only once its tenant has no other job processing; if a later upload
+    supersedes it in the meantime, that upload's request trains it instead.
+
+    Args:
+        job_id (int): ID of the pending job
+    """
+    if _job_workers is not None:
+        _job_workers.submit(job_id)
+        return
+    if EXTERNAL_JOB_WORKERS:
+        return
+
+    worker_name = f"{socket.gethostname()}:{os.getpid()}/inline"
+    while not claim_job(job_id, worker_name, wait=False):
+        if not RecommendationJob.query.filter_by(id=job_id, status='pending').count():
+            return
+        sleep(JOB_POLL_INTERVAL)
+
+    logger.info(f"{worker_name} running recommendation job {job_id}")
+    try:
+        with job_lease(job_id, worker_name):
+            run_recommendation_job(job_id)
+    except Exception:
+        logger.exception(f"{worker_name} failed to run recommendation job {job_id}")
+
+
+if __name__ == '__main__':
+    from app import app
+
+    pool = JobWorkerPool(app, max(1, DEFAULT_JOB_WORKERS))
+    if not pool.uses_processes:
+        raise SystemExit("Standalone workers need PostgreSQL; other databases run workers inside the web process")
+    pool.start()
+    try:
+        pool.join()
+    except KeyboardInterrupt:
+        pool.stop()
@@ -13,6 +13,7 @@ if "SESSION_SECRET" not in os.environ:
 from app import app
 from api import api_bp
 from demo import demo_bp
+from jobs import start_job_workers
 
 # Configure logging for debugging
 logging.basicConfig(level=logging.DEBUG)
@@ -21,6 +22,9 @@ logging.basicConfig(level=logging.DEBUG)
 app.register_blueprint(api_bp, url_prefix='/api')
 app.register_blueprint(demo_bp)  # No prefix to make it the root of the application
 
+# Start the background workers that run uploaded-transaction jobs
+start_job_workers(app)
+
 # Add a root route to redirect to login page
 @app.route('/')
 def root():
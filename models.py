@@ -60,6 +60,12 @@ class Transaction(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.now)
     products = db.Column(JSONB, nullable=False)  # Array of product IDs in this transaction
     transaction_metadata = db.Column(JSONB, default={})  # Additional transaction metadata
+    job_id = db.Column(db.Integer, db.ForeignKey('recommendation_job.id'), index=True)  # Upload job that ingested the row
+    
+    # Re-uploaded transactions are skipped on ingestion instead of counted twice
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'transaction_id', name='unique_user_transaction'),
+    )
 
 
 class ProductRecommendation(db.Model):
@@ -70,6 +76,8 @@ class ProductRecommendation(db.Model):
     confidence = db.Column(db.Float, nullable=False)  # Confidence score (0-1)
     support = db.Column(db.Float, nullable=False)  # Support score
     lift = db.Column(db.Float)  # Lift score
+    # Score per (time period, month) context: float32[4 x 12], see recommendation.context_slot
+    context_scores = db.Column(db.LargeBinary)
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, onupdate=datetime.now)
     
@@ -86,10 +94,47 @@ class RecommendationJob(db.Model):
     """Model to track recommendation generation jobs"""
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    status = db.Column(db.String(20), default='pending')  # pending, processing, completed, failed
+    status = db.Column(db.String(20), default='pending')  # receiving, pending, processing, completed, failed, superseded
     config = db.Column(JSONB, default={})  # Job configuration parameters
+    payload = db.Column(JSONB)  # Uploaded transactions waiting for a worker (cleared once ingested)
     result_stats = db.Column(JSONB, default={})  # Summary statistics of the job
     error = db.Column(db.Text)  # Error message if job failed
+    worker = db.Column(db.String(128))  # Worker that claimed the job
+    heartbeat_at = db.Column(db.DateTime)  # Last lease renewal by the worker running the job
+    not_before = db.Column(db.DateTime)  # Earliest time a worker may claim the job (end of the quiet window)
+    superseded_by = db.Column(db.Integer, db.ForeignKey('recommendation_job.id'))  # Job that took over this upload's training
+    trained_at = db.Column(db.DateTime)  # When the upload's transactions were folded into the tenant's statistics
     created_at = db.Column(db.DateTime, default=datetime.now)
     updated_at = db.Column(db.DateTime, onupdate=datetime.now)
+    started_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
+
+
+class RecommendationModelState(db.Model):
+    """Per-tenant bookkeeping for the trained recommendation model"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)  # Baskets covered by the co-occurrence counts
+    model_version = db.Column(db.Integer, nullable=False, default=0)  # Bumped whenever the tenant's rules change
+    min_support = db.Column(db.Float)  # Support threshold planned by the last full training pass
+    min_confidence = db.Column(db.Float)  # Confidence threshold planned by the last full training pass
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, onupdate=datetime.now)
+
+
+class CooccurrenceCount(db.Model):
+    """
+    Per-tenant basket co-occurrence counts used for incremental model updates
+
+    Pairs are stored in both directions; item counts live on the diagonal
+    (product_id == other_product_id).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.String(64), nullable=False)  # External product ID
+    other_product_id = db.Column(db.String(64), nullable=False)  # External product ID
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'product_id', 'other_product_id', name='unique_cooccurrence'),
+    )
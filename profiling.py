@@ -0,0 +1,177 @@
+"""
+Per-phase resource probes for recommendation jobs
+
+A PhaseRecorder measures each named phase of a job (loading, mining,
+persistence, ...): wall time, CPU time of the thread running the phase, CPU
+time of child processes reaped meanwhile (e.g. partitioned mining workers),
+resident memory and the rows going in and out. The report is a
+JSON-serialisable list, stored in RecommendationJob.result_stats['phases'].
+
+Child CPU time and RSS can only be read for the whole process, so their keys
+carry a 'process_' prefix: when other threads work at the same time (job
+threads on SQLite, request threads of the web server) they include their
+usage too. cpu_seconds is per thread and only counts the phase itself.
+
+Peak RSS is sampled from /proc by a background thread while a phase runs.
+Where /proc is unavailable (e.g. macOS) the process-lifetime high-water mark
+from getrusage() is reported instead.
+"""
+import os
+import resource
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter, thread_time
+
+# Seconds between RSS samples while a phase runs
+RSS_SAMPLE_INTERVAL = 0.05
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+_MB = 1024 * 1024
+
+
+def current_rss():
+    """
+    Resident set size of this process
+
+    Returns:
+        int: RSS in bytes, or None when /proc is unavailable
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss():
+    """Peak RSS of this process over its lifetime, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def child_cpu_time():
+    """CPU seconds used by terminated child processes of this process"""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class _RssSampler(threading.Thread):
+    """Background thread tracking the highest RSS seen until stopped"""
+
+    def __init__(self, interval, initial):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = initial
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            rss = current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+class PhaseProbe:
+    """Handle of a running phase; set rows_in / rows_out while it runs"""
+
+    def __init__(self, rows_in=None, rows_out=None):
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+
+
+class PhaseRecorder:
+    """
+    Record timing and memory for the phases of one job
+
+    Phases recorded more than once under the same name (e.g. ingestion of
+    several uploads) are merged: times and row counts add up, the peak is
+    the highest seen, and 'calls' counts the runs.
+    """
+
+    def __init__(self, phases=None, sample_interval=RSS_SAMPLE_INTERVAL):
+        """
+        Args:
+            phases (list, optional): Report of earlier phases to continue from
+            sample_interval (float): Seconds between RSS samples
+        """
+        self.phases = [dict(phase) for phase in phases or []]
+        self.sample_interval = sample_interval
+
+    @contextmanager
+    def phase(self, name, rows_in=None):
+        """
+        Measure the enclosed block as one phase
+
+        Args:
+            name (str): Phase name
+            rows_in (int, optional): Rows the phase consumes
+
+        Yields:
+            PhaseProbe: Handle to record rows_in / rows_out on
+        """
+        probe = PhaseProbe(rows_in)
+        rss_start = current_rss()
+        sampler = None
+        if rss_start is not None:
+            sampler = _RssSampler(self.sample_interval, rss_start)
+            sampler.start()
+
+        wall_start = perf_counter()
+        cpu_start = thread_time()
+        child_cpu_start = child_cpu_time()
+        try:
+            yield probe
+        finally:
+            wall = perf_counter() - wall_start
+            cpu = thread_time() - cpu_start
+            child_cpu = child_cpu_time() - child_cpu_start
+            rss_end = current_rss()
+            if sampler is not None:
+                peak = max(sampler.stop(), rss_end or 0)
+            else:
+                peak = max_rss()
+
+            self._record({
+                'phase': name,
+                'calls': 1,
+                'wall_seconds': wall,
+                'cpu_seconds': cpu,
+                'process_child_cpu_seconds': child_cpu,
+                'process_rss_start_mb': rss_start / _MB if rss_start is not None else None,
+                'process_rss_end_mb': rss_end / _MB if rss_end is not None else None,
+                'process_peak_rss_mb': peak / _MB,
+                'rows_in': probe.rows_in,
+                'rows_out': probe.rows_out
+            })
+
+    def _record(self, entry):
+        entry = {
+            key: round(value, 4 if key.endswith('seconds') else 1) if isinstance(value, float) else value
+            for key, value in entry.items()
+        }
+        previous = next((phase for phase in self.phases if phase['phase'] == entry['phase']), None)
+        if previous is None:
+            self.phases.append(entry)
+            return
+
+        for key in ('calls', 'wall_seconds', 'cpu_seconds', 'process_child_cpu_seconds', 'rows_in', 'rows_out'):
+            if entry[key] is not None:
+                previous[key] = round((previous.get(key) or 0) + entry[key], 4)
+        previous['process_peak_rss_mb'] = max(previous.get('process_peak_rss_mb') or 0, entry['process_peak_rss_mb'])
+        previous['process_rss_end_mb'] = entry['process_rss_end_mb']
+
+    def report(self):
+        """
+        Phases in the order they first ran
+
+        Returns:
+            list: One dict per phase
+        """
+        return [dict(phase) for phase in self.phases]
@@ -1,12 +1,33 @@
 import logging
+import os
+import io
+import csv
+import gzip
+import json
 import pandas as pd
 import numpy as np
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 import calendar
-from mlxtend.frequent_patterns import apriori, association_rules
+from array import array
+from scipy import sparse
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import defer
+from mlxtend.frequent_patterns import apriori, fpgrowth
 from app import db
-from models import Product, ProductRecommendation, Transaction, RecommendationJob
+from cache import recommendation_cache
+from profiling import PhaseRecorder
+from models import (
+    Product, ProductRecommendation, Transaction, RecommendationJob,
+    RecommendationModelState, CooccurrenceCount
+)
 from collections import Counter
+from itertools import combinations, islice
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter, monotonic
+import threading
+from functools import lru_cache
+import multiprocessing
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -129,6 +150,130 @@ def get_time_of_day():
         return 'late_night'
 
 
+# Boost factor of each preference tier, highest first
+SEASONAL_BOOST_FACTORS = {'high_boost': 1.5, 'medium_boost': 1.3, 'low_boost': 1.15}
+TIME_OF_DAY_BOOST_FACTORS = {'high_boost': 1.4, 'medium_boost': 1.25, 'low_boost': 1.1}
+
+
+def _compile_tiers(preferences, factors):
+    """Normalize category names once: key -> [(factor, normalized names), ...] highest tier first"""
+    return {
+        key: [
+            (factor, tuple(category.lower().strip() for category in tiers.get(tier, [])))
+            for tier, factor in factors.items()
+        ]
+        for key, tiers in preferences.items()
+    }
+
+
+def _match_tiers(tiers, product_category):
+    """Factor of the first tier with a category overlapping product_category, else 1.0"""
+    normalized_category = product_category.lower().strip()
+    for factor, categories in tiers:
+        if any(cat in normalized_category or normalized_category in cat for cat in categories):
+            return factor
+    return 1.0
+
+
+@lru_cache(maxsize=8192)
+def seasonal_boost_for(product_category, month):
+    """
+    Cached seasonal boost of a category for a month (1-12)
+    
+    Returns:
+        float: Boost factor (1.0 = no boost)
+    """
+    if not product_category or month not in _SEASONAL_TIERS:
+        return 1.0
+    return _match_tiers(_SEASONAL_TIERS[month], product_category)
+
+
+@lru_cache(maxsize=8192)
+def time_of_day_boost_for(product_category, time_period):
+    """
+    Cached time-of-day boost of a category for a time period
+    
+    Returns:
+        float: Boost factor (1.0 = no boost)
+    """
+    if not product_category or time_period not in _TIME_OF_DAY_TIERS:
+        return 1.0
+    return _match_tiers(_TIME_OF_DAY_TIERS[time_period], product_category)
+
+
+def compile_boost_tables():
+    """
+    (Re)compile the seasonal and time-of-day boost tables
+    
+    Runs at import; call it again after changing SEASONAL_CATEGORIES or
+    TIME_OF_DAY_PREFERENCES so cached lookups pick up the new configuration.
+    """
+    global _SEASONAL_TIERS, _TIME_OF_DAY_TIERS
+    _SEASONAL_TIERS = _compile_tiers(SEASONAL_CATEGORIES, SEASONAL_BOOST_FACTORS)
+    _TIME_OF_DAY_TIERS = _compile_tiers(TIME_OF_DAY_PREFERENCES, TIME_OF_DAY_BOOST_FACTORS)
+    seasonal_boost_for.cache_clear()
+    time_of_day_boost_for.cache_clear()
+
+
+compile_boost_tables()
+
+
+# Precomputed score vectors hold one score per (time period, month) context,
+# time period major: slot = period index * 12 + (month - 1)
+CONTEXT_TIME_PERIODS = ('morning', 'midday', 'evening', 'late_night')
+CONTEXT_SLOTS = len(CONTEXT_TIME_PERIODS) * 12
+
+
+def context_slot(time_period=None, month=None):
+    """
+    Position of a (time period, month) context in a score vector
+    
+    Args:
+        time_period (str, optional): Time period (defaults to the current period)
+        month (int, optional): Month 1-12 (defaults to the current month)
+        
+    Returns:
+        int: Slot index in [0, CONTEXT_SLOTS)
+    """
+    if time_period is None:
+        time_period = get_time_of_day()
+    if month is None:
+        month = datetime.now().month
+    return CONTEXT_TIME_PERIODS.index(time_period) * 12 + (month - 1)
+
+
+def context_factor_matrix(categories):
+    """
+    Seasonal x time-of-day boost of each category in every context
+    
+    Args:
+        categories (iterable): Product categories (None allowed)
+        
+    Returns:
+        numpy.ndarray: (len(categories), CONTEXT_SLOTS) boost factors
+    """
+    categories = list(categories)
+    seasonal = np.array(
+        [[seasonal_boost_for(category, month) for month in range(1, 13)] for category in categories],
+        dtype=float
+    ).reshape(len(categories), 12)
+    time_boost = np.array(
+        [[time_of_day_boost_for(category, period) for period in CONTEXT_TIME_PERIODS] for category in categories],
+        dtype=float
+    ).reshape(len(categories), len(CONTEXT_TIME_PERIODS))
+    return (time_boost[:, :, None] * seasonal[:, None, :]).reshape(len(categories), CONTEXT_SLOTS)
+
+
+def encode_context_scores(vectors):
+    """Pack score vectors (rows of a 2-D array) as float32 bytes, one value per row"""
+    return [row.tobytes() for row in np.ascontiguousarray(vectors, dtype=np.float32)]
+
+
+def decode_context_scores(blobs):
+    """Unpack float32 score vectors stored by encode_context_scores into a 2-D array"""
+    return np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(len(blobs), CONTEXT_SLOTS)
+
+
 def get_time_of_day_boost(product_category, time_period=None):
     """
     Calculate a time-of-day boost factor for a product category
@@ -147,29 +292,7 @@ def get_time_of_day_boost(product_category, time_period=None):
     if time_period is None:
         time_period = get_time_of_day()
     
-    # No boost if invalid time period
-    if time_period not in TIME_OF_DAY_PREFERENCES:
-        return 1.0
-    
-    # Normalize category name for matching
-    normalized_category = product_category.lower().strip()
-    
-    # Check high boost categories
-    high_boost_categories = [cat.lower().strip() for cat in TIME_OF_DAY_PREFERENCES[time_period]['high_boost']]
-    if any(cat in normalized_category or normalized_category in cat for cat in high_boost_categories):
-        return 1.4  # 40% boost
-    
-    # Check medium boost categories
-    medium_boost_categories = [cat.lower().strip() for cat in TIME_OF_DAY_PREFERENCES[time_period]['medium_boost']]
-    if any(cat in normalized_category or normalized_category in cat for cat in medium_boost_categories):
-        return 1.25  # 25% boost
-    
-    # Check low boost categories
-    low_boost_categories = [cat.lower().strip() for cat in TIME_OF_DAY_PREFERENCES[time_period]['low_boost']]
-    if any(cat in normalized_category or normalized_category in cat for cat in low_boost_categories):
-        return 1.1  # 10% boost
-    
-    return 1.0  # No boost
+    return time_of_day_boost_for(product_category, time_period)
 
 
 def get_seasonal_boost(product_category, current_date=None):
@@ -188,35 +311,410 @@ def get_seasonal_boost(product_category, current_date=None):
         
     if current_date is None:
         current_date = datetime.now()
+    
+    return seasonal_boost_for(product_category, current_date.month)
+
+
+class RecommendationIndex:
+    """
+    Immutable in-memory snapshot of the ProductRecommendation table
+    
+    Holds, per internal product ID, arrays of recommended product IDs with
+    their confidence, support and a score per (time period, month) context,
+    plus the product details needed to render a recommendation, so serving is
+    a lookup and a sort with no database queries and no boost math. The product_metadata JSONB column is left out of the
+    snapshot and loaded on demand, only for products whose metadata a caller
+    actually asks for.
+    """
+    
+    def __init__(self, version, product_ids, products, recommendations):
+        self.version = version
+        self.product_ids = product_ids  # External product ID -> internal ID
+        self.products = products  # Internal ID -> product details (without metadata)
+        self.recommendations = recommendations  # Internal ID -> (ids, confidence, support, context scores)
+        self._metadata = {}  # Internal ID -> product_metadata, filled on demand
+    
+    @classmethod
+    def build(cls, version):
+        """
+        Build an index from the current ProductRecommendation and Product tables
+        
+        Args:
+            version (int): Model version the snapshot corresponds to
+            
+        Returns:
+            RecommendationIndex: The new index
+        """
+        products = {
+            p.id: {
+                'product_id': p.product_id,
+                'name': p.name,
+                'category': p.category
+            }
+            for p in db.session.query(Product.id, Product.product_id, Product.name, Product.category)
+        }
+        product_ids = {details['product_id']: internal_id for internal_id, details in products.items()}
+        
+        rows = (
+            db.session.query(
+                ProductRecommendation.product_id,
+                ProductRecommendation.recommended_product_id,
+                ProductRecommendation.confidence,
+                ProductRecommendation.support,
+                ProductRecommendation.lift,
+                ProductRecommendation.context_scores
+            )
+            .order_by(ProductRecommendation.product_id)
+            .all()
+        )
+        
+        recommendations = {}
+        if rows:
+            source_ids, recommended_ids, confidence, support, score, blobs = (
+                np.array(column, dtype=object) for column in zip(*rows)
+            )
+            source_ids = source_ids.astype(np.int64)
+            recommended_ids = recommended_ids.astype(np.int64)
+            context_scores = stored_context_scores(
+                blobs, score, [products.get(rec_id, {}).get('category') for rec_id in recommended_ids.tolist()]
+            )
+            boundaries = np.flatnonzero(np.diff(source_ids)) + 1
+            for group in np.split(np.arange(len(source_ids)), boundaries):
+                recommendations[int(source_ids[group[0]])] = (
+                    recommended_ids[group],
+                    confidence[group].astype(float),
+                    support[group].astype(float),
+                    context_scores[group]
+                )
         
-    month = current_date.month
+        return cls(version, product_ids, products, recommendations)
     
-    # Check if month is in our seasonal categories
-    if month not in SEASONAL_CATEGORIES:
-        return 1.0
+    def with_metadata(self, internal_ids):
+        """
+        Product details including metadata for the given products
+        
+        Metadata not yet held by this snapshot is read with a single query and
+        kept for later requests.
+        
+        Args:
+            internal_ids (iterable): Internal product IDs
+            
+        Returns:
+            dict: Internal ID -> product details with a 'metadata' entry
+        """
+        internal_ids = set(internal_ids)
+        missing = self.missing_metadata(internal_ids)
+        if missing:
+            self.store_metadata(
+                db.session.query(Product.id, Product.product_metadata).filter(Product.id.in_(missing))
+            )
+        
+        return {
+            internal_id: dict(self.products[internal_id], metadata=self._metadata.get(internal_id))
+            for internal_id in internal_ids if internal_id in self.products
+        }
     
-    # Normalize category name for matching
-    normalized_category = product_category.lower().strip()
+    def missing_metadata(self, internal_ids):
+        """Known products among internal_ids whose metadata this snapshot does not hold yet"""
+        return [
+            internal_id for internal_id in set(internal_ids)
+            if internal_id in self.products and internal_id not in self._metadata
+        ]
+    
+    def store_metadata(self, rows):
+        """Keep (internal ID, product_metadata) rows loaded by a caller"""
+        self._metadata.update({internal_id: metadata for internal_id, metadata in rows})
+    
+    def candidates(self, product_ids, min_confidence, slot=None):
+        """
+        Resolve a basket and gather its candidates from the snapshot
+        
+        Args:
+            product_ids (list): External product IDs of the basket
+            min_confidence (float): Minimum confidence score
+            slot (int, optional): Context slot; defaults to the current context
+            
+        Returns:
+            tuple: (external -> internal ID map of the inputs that exist,
+                    internal ID -> list of (recommended ID, confidence, support, score) best first)
+        """
+        if slot is None:
+            slot = context_slot()
+        product_map = {pid: self.product_ids[pid] for pid in product_ids if pid in self.product_ids}
+        candidates = {
+            internal_id: list(zip(*(column.tolist() for column in self.lookup(internal_id, min_confidence, slot))))
+            for internal_id in set(product_map.values())
+        }
+        return product_map, candidates
+    
+    def lookup(self, internal_id, min_confidence, slot=None):
+        """
+        Recommendations for one product in one context, best score first
+        
+        Args:
+            internal_id (int): Internal product ID
+            min_confidence (float): Minimum confidence score
+            slot (int, optional): Context slot (see context_slot); defaults to the current context
+            
+        Returns:
+            tuple: (recommended IDs, confidence, support, score) arrays
+        """
+        entry = self.recommendations.get(internal_id)
+        if entry is None:
+            return _EMPTY_LOOKUP
+        if slot is None:
+            slot = context_slot()
+        recommended_ids, confidence, support, context_scores = entry
+        keep = np.flatnonzero(confidence >= min_confidence)
+        score = context_scores[keep, slot].astype(float)
+        order = np.argsort(-score, kind='stable')
+        keep = keep[order]
+        return recommended_ids[keep], confidence[keep], support[keep], score[order]
+
+
+_EMPTY_LOOKUP = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0))
+
+
+def stored_context_scores(blobs, scores, categories):
+    """
+    Context score vectors of stored recommendation rows
+    
+    Rows written before score vectors existed have none; theirs are derived
+    from the stored score and the recommended product's category.
+    
+    Args:
+        blobs (sequence): context_scores column values (None when missing)
+        scores (sequence): lift column values (the pair score)
+        categories (sequence): Category of each row's recommended product
+        
+    Returns:
+        numpy.ndarray: (rows, CONTEXT_SLOTS) float32 scores
+    """
+    context_scores = np.empty((len(blobs), CONTEXT_SLOTS), dtype=np.float32)
+    stored = np.array([blob is not None for blob in blobs], dtype=bool)
+    if stored.any():
+        context_scores[stored] = decode_context_scores([blob for blob in blobs if blob is not None])
+    if not stored.all():
+        missing = np.flatnonzero(~stored)
+        base = np.nan_to_num(np.array([scores[i] for i in missing], dtype=float), nan=0.0)
+        codes, unique_categories = pd.factorize(pd.Series([categories[i] for i in missing], dtype=object))
+        factors = np.vstack([context_factor_matrix(unique_categories), np.ones(CONTEXT_SLOTS)])
+        context_scores[missing] = base[:, None] * factors[codes]
+    return context_scores
+
+# Seconds between checks of the database model version by a serving process,
+# i.e. how long a process may keep serving the previous model after a job
+# completed in another process
+INDEX_VERSION_CHECK_INTERVAL = float(os.environ.get("RECOMMENDATION_INDEX_CHECK_INTERVAL", 30))
+
+_recommendation_index = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def model_version_statement():
+    """
+    SELECT computing the global model version: the sum of every tenant's model
+    version, which grows whenever any tenant's recommendations change
+    """
+    return db.select(db.func.coalesce(db.func.sum(RecommendationModelState.model_version), 0))
+
+
+def current_model_version():
+    """
+    Global model version (see model_version_statement)
+    
+    Returns:
+        int: Current model version
+    """
+    return int(db.session.execute(model_version_statement()).scalar())
+
+
+def refresh_recommendation_index(version=None):
+    """
+    Rebuild the in-memory recommendation index and swap it in atomically
+    
+    Requests in flight keep using the snapshot they started with.
+    
+    Args:
+        version (int, optional): Model version of the new snapshot (read from the database if omitted)
+        
+    Returns:
+        RecommendationIndex: The new index
+    """
+    global _recommendation_index, _index_checked_at
+    
+    with _index_lock:
+        if version is None:
+            version = current_model_version()
+        index = RecommendationIndex.build(version)
+        _recommendation_index = index
+        _index_checked_at = monotonic()
+    
+    logger.info(f"Recommendation index swapped to model version {version} ({len(index.recommendations)} products)")
+    return index
+
+
+def get_recommendation_index():
+    """
+    Current recommendation index, built on first use
+    
+    Other processes may complete training jobs, so the model version is
+    re-checked at most every INDEX_VERSION_CHECK_INTERVAL seconds; in between,
+    lookups never touch the database.
+    
+    Returns:
+        RecommendationIndex: The current index
+    """
+    index, check_version = peek_recommendation_index()
+    if index is None:
+        return refresh_recommendation_index()
+    
+    if check_version:
+        version = current_model_version()
+        if version != index.version:
+            return refresh_recommendation_index(version)
+    
+    return index
+
+
+def peek_recommendation_index():
+    """
+    Current recommendation index without touching the database
+    
+    Lets callers with their own connection (e.g. the async server) run the
+    version check themselves. A due check is claimed by the caller that sees
+    it, so concurrent requests do not all hit the database.
+    
+    Returns:
+        tuple: (index or None if not built yet, whether the model version should be re-checked)
+    """
+    global _index_checked_at
+    
+    index = _recommendation_index
+    if index is None:
+        return None, True
+    
+    if monotonic() - _index_checked_at >= INDEX_VERSION_CHECK_INTERVAL:
+        _index_checked_at = monotonic()
+        return index, True
+    
+    return index, False
+
+
+def expire_recommendation_index():
+    """
+    Make the next lookup in this process re-check the model version
+    
+    Training jobs only bump the model version; the index itself is rebuilt
+    lazily by the serving code that next needs it.
+    """
+    global _index_checked_at
+    
+    _index_checked_at = float('-inf')
+
+
+def rendered_product_ids(product_map, candidates):
+    """Internal IDs of every product a basket's response can mention (inputs and candidates)"""
+    return list(product_map.values()) + [rec_id for rows in candidates.values() for rec_id, _, _, _ in rows]
+
+
+# Attributes of a recommended product that callers can select with `fields`
+RECOMMENDATION_FIELDS = (
+    'product_id', 'name', 'confidence', 'support', 'category', 'score',
+    'is_seasonal', 'is_time_relevant', 'time_of_day', 'metadata'
+)
+
+
+def fetch_recommendation_candidates(product_ids, min_confidence, per_product_limit=None,
+                                    include_metadata=True, slot=None):
+    """
+    Load candidate recommendations for a whole basket from the database
     
-    # Check high boost categories
-    high_boost_categories = [cat.lower().strip() for cat in SEASONAL_CATEGORIES[month]['high_boost']]
-    if any(cat in normalized_category or normalized_category in cat for cat in high_boost_categories):
-        return 1.5  # 50% boost
+    Input products are resolved with one query, and every candidate row for
+    all of them comes back from a single IN (...) query that ranks rows per
+    source product with a ROW_NUMBER() window, so the number of round trips
+    does not grow with basket size. The window ranks by the pair score; the
+    kept rows are then ordered by their precomputed score for the context.
     
-    # Check medium boost categories
-    medium_boost_categories = [cat.lower().strip() for cat in SEASONAL_CATEGORIES[month]['medium_boost']]
-    if any(cat in normalized_category or normalized_category in cat for cat in medium_boost_categories):
-        return 1.3  # 30% boost
+    Args:
+        product_ids (list): External product IDs of the basket
+        min_confidence (float): Minimum confidence score
+        per_product_limit (int, optional): Top-N candidates kept per source product
+        include_metadata (bool): Load product_metadata; when False the JSONB column
+                                 is deferred and never read
+        slot (int, optional): Context slot of the scores; defaults to the current context
+        
+    Returns:
+        tuple: (external -> internal ID map of the inputs, internal ID -> product details,
+                internal ID -> list of (recommended ID, confidence, support, score) best first)
+    """
+    inputs = (
+        db.session.query(Product.id, Product.product_id, Product.category)
+        .filter(Product.product_id.in_(product_ids))
+        .all()
+    )
+    product_map = {p.product_id: p.id for p in inputs}
+    products = {p.id: {'product_id': p.product_id, 'category': p.category} for p in inputs}
+    candidates = {internal_id: [] for internal_id in product_map.values()}
+    if not product_map:
+        return product_map, products, candidates
+    
+    ranked = (
+        db.select(
+            ProductRecommendation.product_id,
+            ProductRecommendation.recommended_product_id,
+            ProductRecommendation.confidence,
+            ProductRecommendation.support,
+            ProductRecommendation.lift,
+            ProductRecommendation.context_scores,
+            db.func.row_number().over(
+                partition_by=ProductRecommendation.product_id,
+                order_by=ProductRecommendation.lift.desc()
+            ).label('rank')
+        )
+        .where(
+            ProductRecommendation.product_id.in_(list(product_map.values())),
+            ProductRecommendation.confidence >= min_confidence
+        )
+        .subquery()
+    )
+    query = (
+        db.select(ranked, Product)
+        .join(Product, ranked.c.recommended_product_id == Product.id)
+        .order_by(ranked.c.product_id, ranked.c.rank)
+    )
+    if per_product_limit:
+        query = query.where(ranked.c.rank <= per_product_limit)
+    if not include_metadata:
+        query = query.options(defer(Product.product_metadata))
+    
+    if slot is None:
+        slot = context_slot()
+    
+    rows = db.session.execute(query).all()
+    context_scores = stored_context_scores(
+        [row.context_scores for row in rows], [row.lift for row in rows], [row.Product.category for row in rows]
+    )
+    for row, score in zip(rows, context_scores[:, slot].tolist()):
+        product = row.Product
+        details = {
+            'product_id': product.product_id,
+            'name': product.name,
+            'category': product.category
+        }
+        if include_metadata:
+            details['metadata'] = product.product_metadata
+        products.setdefault(product.id, details)
+        candidates[row.product_id].append((product.id, row.confidence, row.support, score))
     
-    # Check low boost categories
-    low_boost_categories = [cat.lower().strip() for cat in SEASONAL_CATEGORIES[month]['low_boost']]
-    if any(cat in normalized_category or normalized_category in cat for cat in low_boost_categories):
-        return 1.15  # 15% boost
+    for rows_of_product in candidates.values():
+        rows_of_product.sort(key=lambda candidate: candidate[3], reverse=True)
     
-    return 1.0  # No seasonal boost
+    return product_map, products, candidates
 
 
-def get_recommendations(product_ids, limit=5, min_confidence=0.1):
+def get_recommendations(product_ids, limit=5, min_confidence=0.1, use_index=True, fields=None, slot=None):
     """
     Get recommendations for a list of product IDs with enhanced precision
     
@@ -224,24 +722,261 @@ def get_recommendations(product_ids, limit=5, min_confidence=0.1):
         product_ids (list): List of product IDs to get recommendations for
         limit (int): Maximum number of recommendations to return per product
         min_confidence (float): Minimum confidence score for recommendations
+        use_index (bool): Serve from the in-memory index rather than the database
+        fields (list, optional): Recommendation attributes to return (see
+                                 RECOMMENDATION_FIELDS); all of them by default
+        slot (int, optional): Context slot to score for (see context_slot); defaults to the current context
         
     Returns:
         list: List of recommendation objects
     """
-    if not product_ids:
-        return []
+    return list(iter_recommendations(product_ids, limit, min_confidence, use_index, fields, slot))
+
+
+def iter_recommendations(product_ids, limit=5, min_confidence=0.1, use_index=True, fields=None, slot=None):
+    """
+    Yield recommendations one source product at a time
+    
+    By default this answers from the in-memory recommendation index without
+    database queries; with use_index=False every candidate is fetched with a
+    single batched query instead, and the combined pool is drawn from each
+    product's top limit * 2 candidates.
     
-    # Find product IDs in database
-    products = Product.query.filter(Product.product_id.in_(product_ids)).all()
-    product_map = {p.product_id: p.id for p in products}
-    product_category_map = {p.id: p.category for p in products}
+    Args:
+        product_ids (list): List of product IDs to get recommendations for
+        limit (int): Maximum number of recommendations to return per product
+        min_confidence (float): Minimum confidence score for recommendations
+        use_index (bool): Serve from the in-memory index rather than the database
+        fields (list, optional): Recommendation attributes to return; product
+                                 metadata is only loaded when 'metadata' is among them
+        slot (int, optional): Context slot to score for (see context_slot); defaults to the current context
+        
+    Yields:
+        dict: {'product_id', 'recommended_products'} for each source product
+    """
+    if not product_ids:
+        return
+    
+    include_metadata = fields is None or 'metadata' in fields
+    if slot is None:
+        slot = context_slot()
+    
+    if use_index:
+        index = get_recommendation_index()
+        product_map, candidates = index.candidates(product_ids, min_confidence, slot)
+        products = index.products
+        if include_metadata:
+            products = index.with_metadata(rendered_product_ids(product_map, candidates))
+    else:
+        # The direct lists use the top limit * 2 rows per product, so that is all we need
+        product_map, products, candidates = fetch_recommendation_candidates(
+            product_ids, min_confidence, per_product_limit=limit * 2, include_metadata=include_metadata, slot=slot
+        )
     
-    if not products:
+    if not product_map:
         logger.warning(f"No products found for IDs: {product_ids}")
-        return []
+        return
+    
+    yield from iter_assembled_recommendations(product_ids, product_map, products, candidates, limit, fields)
+
+
+def get_batch_recommendations(baskets, limit=5, min_confidence=0.1):
+    """
+    Recommend products for many baskets at once
+    
+    Rules for the union of all basket products are gathered once from the
+    in-memory index and every basket is scored with a single sparse product
+    (baskets x source products) @ (source products x recommended products).
+    A basket's score for a product is the sum of the current context's rule
+    scores from each of its items, with the same-category boost.
+    
+    Args:
+        baskets (list): Lists of external product IDs, one per basket
+        limit (int): Maximum number of recommendations per basket
+        min_confidence (float): Minimum confidence score for recommendations
+        
+    Returns:
+        list: One list per basket of {'product_id', 'score'} dicts, best first
+    """
+    index = get_recommendation_index()
+    
+    # Intern basket items against the index (unknown products are ignored)
+    basket_rows = []
+    basket_items = []
+    for row, basket in enumerate(baskets):
+        for product_id in basket:
+            internal_id = index.product_ids.get(product_id)
+            if internal_id is not None:
+                basket_rows.append(row)
+                basket_items.append(internal_id)
+    if not basket_items:
+        return [[] for _ in baskets]
+    
+    sources, source_positions = np.unique(np.array(basket_items, dtype=np.int64), return_inverse=True)
+    basket_matrix = sparse.csr_matrix(
+        (np.ones(len(basket_items)), (np.array(basket_rows), source_positions)),
+        shape=(len(baskets), len(sources))
+    )
+    basket_matrix.data[:] = 1.0  # Repeated items count once
+    
+    # Candidate rules for the union of basket products, loaded once
+    slot = context_slot()
+    rule_sources = []
+    rule_targets = []
+    rule_scores = []
+    for position, source in enumerate(sources.tolist()):
+        recommended_ids, _, _, scores = index.lookup(source, min_confidence, slot)
+        rule_sources.append(np.full(len(recommended_ids), position))
+        rule_targets.append(recommended_ids)
+        rule_scores.append(scores)
+    rule_sources = np.concatenate(rule_sources)
+    targets, target_positions = np.unique(np.concatenate(rule_targets), return_inverse=True)
+    if len(targets) == 0:
+        return [[] for _ in baskets]
+    
+    # Per-product categories as codes, for the same-category boost
+    target_categories = [index.products.get(target, {}).get('category') for target in targets.tolist()]
+    source_categories = [index.products.get(source, {}).get('category') for source in sources.tolist()]
+    codes, categories = pd.factorize(pd.Series(source_categories + target_categories, dtype=object))
+    source_codes, target_codes = codes[:len(sources)], codes[len(sources):]
+    
+    rule_target_codes = target_codes[target_positions]
+    category_boost = np.where(
+        (rule_target_codes >= 0) & (source_codes[rule_sources] == rule_target_codes), 1.2, 1.0
+    )
+    rule_matrix = sparse.csr_matrix(
+        (np.concatenate(rule_scores) * category_boost, (rule_sources, target_positions)),
+        shape=(len(sources), len(targets))
+    )
+    
+    scores = (basket_matrix @ rule_matrix).tocsr()
+    
+    # Products already in a basket are never recommended back to it
+    target_lookup = {target: position for position, target in enumerate(targets.tolist())}
+    in_basket = [
+        (row, target_lookup[item]) for row, item in zip(basket_rows, basket_items) if item in target_lookup
+    ]
+    if in_basket:
+        in_basket_rows, in_basket_columns = zip(*in_basket)
+        mask = sparse.csr_matrix(
+            (np.ones(len(in_basket)), (in_basket_rows, in_basket_columns)), shape=scores.shape
+        )
+        mask.data[:] = 1.0
+        scores = scores - scores.multiply(mask)
+        scores.eliminate_zeros()
+    
+    target_product_ids = [index.products[target]['product_id'] for target in targets.tolist()]
+    results = []
+    for row in range(len(baskets)):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        row_scores = scores.data[start:end]
+        row_targets = scores.indices[start:end]
+        if len(row_scores) > limit:
+            top = np.argpartition(-row_scores, limit - 1)[:limit]
+            row_scores, row_targets = row_scores[top], row_targets[top]
+        order = np.argsort(-row_scores, kind='stable')
+        results.append([
+            {'product_id': target_product_ids[target], 'score': round(float(score), 3)}
+            for target, score in zip(row_targets[order].tolist(), row_scores[order].tolist())
+        ])
+    
+    return results
+
+
+def iter_rule_export(user_id, batch_size=5000):
+    """
+    Stream a tenant's stored association rules, grouped by source product
+    
+    Only rules whose source product the tenant created are exported. Rows are
+    read in server-side cursor batches ordered by source product, so an export
+    of any size is produced with bounded memory.
+    
+    Args:
+        user_id (int): Tenant whose rules are exported
+        batch_size (int): Rows fetched per cursor batch
+        
+    Yields:
+        dict: {'product_id', 'rules'} with the source product's rules, best score first
+    """
+    source = db.aliased(Product)
+    target = db.aliased(Product)
+    query = (
+        db.session.query(
+            source.product_id,
+            target.product_id,
+            ProductRecommendation.confidence,
+            ProductRecommendation.support,
+            ProductRecommendation.lift
+        )
+        .join(source, source.id == ProductRecommendation.product_id)
+        .join(target, target.id == ProductRecommendation.recommended_product_id)
+        .filter(source.created_by == user_id)
+        .order_by(ProductRecommendation.product_id, ProductRecommendation.lift.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    
+    current_product = None
+    rules = []
+    for product_id, recommended_product_id, confidence, support, score in query:
+        if product_id != current_product:
+            if rules:
+                yield {'product_id': current_product, 'rules': rules}
+            current_product = product_id
+            rules = []
+        rules.append({
+            'product_id': recommended_product_id,
+            'confidence': round(float(confidence), 3),
+            'support': round(float(support), 3),
+            'score': round(float(score or 0.0), 3)
+        })
+    if rules:
+        yield {'product_id': current_product, 'rules': rules}
+
+
+def assemble_recommendations(product_ids, product_map, products, candidates, limit=5, fields=None):
+    """
+    Build per-product recommendation lists from pre-fetched candidates
+    
+    Args:
+        product_ids (list): External product IDs of the basket, in request order
+        product_map (dict): External -> internal ID of the inputs that exist
+        products (dict): Internal ID -> product details (product_id, name, category, metadata)
+        candidates (dict): Internal ID -> list of (recommended ID, confidence, support, score),
+                           best score first
+        limit (int): Maximum number of recommendations to return per product
+        fields (list, optional): Recommendation attributes to return; all of them by default
+        
+    Returns:
+        list: List of recommendation objects
+    """
+    return list(iter_assembled_recommendations(product_ids, product_map, products, candidates, limit, fields))
+
+
+def iter_assembled_recommendations(product_ids, product_map, products, candidates, limit=5, fields=None):
+    """
+    Yield per-product recommendation lists from pre-fetched candidates
+    
+    The combined pool is aggregated up front; each product's list is then
+    formatted only when the consumer asks for it, so a streaming response can
+    send the first product before the last one is built.
+    
+    Args:
+        product_ids (list): External product IDs of the basket, in request order
+        product_map (dict): External -> internal ID of the inputs that exist
+        products (dict): Internal ID -> product details (product_id, name, category, metadata)
+        candidates (dict): Internal ID -> list of (recommended ID, confidence, support, score),
+                           scores precomputed for the current context, best first
+        limit (int): Maximum number of recommendations to return per product
+        fields (list, optional): Recommendation attributes to return; all of them by default
+        
+    Yields:
+        dict: {'product_id', 'recommended_products'} for each source product
+    """
+    input_products = set(product_ids)
     
-    # Map external IDs to internal IDs
-    internal_ids = [product_map.get(pid) for pid in product_ids if pid in product_map]
+    # Scores already include the context's boosts; these only flag relevance
+    current_month = datetime.now().month
+    time_of_day = get_time_of_day()
     
     # Aggregate recommendations across multiple products for better relevance
     combined_recommendations = {}
@@ -253,130 +988,93 @@ def get_recommendations(product_ids, limit=5, min_confidence=0.1):
             continue
             
         internal_id = product_map[product_id_ext]
-        source_category = product_category_map.get(internal_id)
-        
-        # Get recommendations for this product, order by lift (which now contains our enhanced score)
-        recommendations = (
-            db.session.query(
-                ProductRecommendation,
-                Product
-            )
-            .join(
-                Product,
-                ProductRecommendation.recommended_product_id == Product.id
-            )
-            .filter(
-                ProductRecommendation.product_id == internal_id,
-                ProductRecommendation.confidence >= min_confidence
-            )
-            .order_by(ProductRecommendation.lift.desc())  # Use enhanced score for sorting
-            .all()
-        )
+        source_category = products[internal_id]['category']
         
-        # Add these recommendations to combined results with scoring
-        for rec, product in recommendations:
-            rec_id = product.id
+        # Add this product's recommendations (ordered by our enhanced score) to combined results
+        for rec_id, confidence, support, score in candidates.get(internal_id, []):
+            product = products.get(rec_id)
             
             # Skip if product is already in input list
-            if product.product_id in product_ids:
+            if product is None or product['product_id'] in input_products:
                 continue
                 
             # Calculate a boost for recommendations from same category
             category_boost = 1.0
-            if source_category and source_category == product.category:
+            if source_category and source_category == product['category']:
                 category_boost = 1.2  # 20% boost for same category
                 
-            # Apply seasonal boost based on product category
-            seasonal_boost = get_seasonal_boost(product.category)
-            
-            # Apply time-of-day boost based on product category
-            time_boost = get_time_of_day_boost(product.category)
+            # Seasonal and time-of-day relevance of the product's category
+            seasonal_boost = seasonal_boost_for(product['category'], current_month)
+            time_boost = time_of_day_boost_for(product['category'], time_of_day)
                 
             # If multiple source products recommend the same product, it should rank higher
             # This is a form of collaborative filtering
             if rec_id in combined_recommendations:
                 # Update the existing recommendation with a higher score
-                combined_recommendations[rec_id]['score'] += rec.lift * category_boost * time_boost
+                combined_recommendations[rec_id]['score'] += score * category_boost
                 combined_recommendations[rec_id]['count'] += 1
                 
                 # Keep the highest confidence and support values
                 combined_recommendations[rec_id]['confidence'] = max(
                     combined_recommendations[rec_id]['confidence'], 
-                    rec.confidence
+                    confidence
                 )
                 combined_recommendations[rec_id]['support'] = max(
                     combined_recommendations[rec_id]['support'], 
-                    rec.support
+                    support
                 )
             else:
                 # Add new recommendation to combined results
                 combined_recommendations[rec_id] = {
                     'product': product,
-                    'confidence': rec.confidence,
-                    'support': rec.support,
-                    'score': rec.lift * category_boost * seasonal_boost * time_boost,
+                    'confidence': confidence,
+                    'support': support,
+                    'score': score * category_boost,
                     'count': 1,
                     'seasonal_boost': seasonal_boost,
                     'time_boost': time_boost
                 }
     
     # Prepare individual product recommendation lists
-    results = []
     for product_id_ext in product_ids:
         # Skip products not found in database
         if product_id_ext not in product_map:
             continue
             
         internal_id = product_map[product_id_ext]
-        source_category = product_category_map.get(internal_id)
         
         # Get top recommendations for this specific product
-        direct_recommendations = (
-            db.session.query(
-                ProductRecommendation,
-                Product
-            )
-            .join(
-                Product,
-                ProductRecommendation.recommended_product_id == Product.id
-            )
-            .filter(
-                ProductRecommendation.product_id == internal_id,
-                ProductRecommendation.confidence >= min_confidence
-            )
-            .order_by(ProductRecommendation.lift.desc())
-            .limit(limit * 2)  # Get more initially, then we'll filter
-            .all()
-        )
+        direct_recommendations = candidates.get(internal_id, [])[:limit * 2]  # Get more initially, then we'll filter
         
         # Format direct recommendations
         product_specific_recs = []
         rec_ids_added = set()  # Track which recommendations we've already added
         
         # First pass: Add direct recommendations
-        for rec, product in direct_recommendations:
+        for rec_id, confidence, support, score in direct_recommendations:
+            product = products.get(rec_id)
+            
             # Skip if product is in the input list
-            if product.product_id in product_ids:
+            if product is None or product['product_id'] in input_products:
                 continue
                 
-            # Apply seasonal boost to this recommendation
-            seasonal_boost = get_seasonal_boost(product.category)
-            # Apply time-of-day boost to this recommendation
-            time_boost = get_time_of_day_boost(product.category)
-            enhanced_score = float(rec.lift) * seasonal_boost * time_boost
+            # Seasonal and time-of-day relevance of this recommendation
+            seasonal_boost = seasonal_boost_for(product['category'], current_month)
+            time_boost = time_of_day_boost_for(product['category'], time_of_day)
+            enhanced_score = float(score)
                 
-            rec_ids_added.add(product.id)
+            rec_ids_added.add(rec_id)
             product_specific_recs.append({
-                'product_id': product.product_id,
-                'name': product.name,
-                'confidence': round(float(rec.confidence), 3),
-                'support': round(float(rec.support), 3),
-                'category': product.category,
+                'product_id': product['product_id'],
+                'name': product['name'],
+                'confidence': round(float(confidence), 3),
+                'support': round(float(support), 3),
+                'category': product['category'],
                 'score': round(enhanced_score, 3),
                 'is_seasonal': seasonal_boost > 1.0,
                 'is_time_relevant': time_boost > 1.0,
-                'time_of_day': get_time_of_day(),
-                'metadata': product.product_metadata
+                'time_of_day': time_of_day,
+                'metadata': product.get('metadata')
             })
             
             # Once we have enough direct recommendations, stop
@@ -399,25 +1097,21 @@ def get_recommendations(product_ids, limit=5, min_confidence=0.1):
                     
                 product = rec_data['product']
                 
-                # Skip if product is in the input list
-                if product.product_id in product_ids:
-                    continue
-                    
                 # Get boost info from the recommendation data
                 seasonal_boost = rec_data.get('seasonal_boost', 1.0)
                 time_boost = rec_data.get('time_boost', 1.0)
                 
                 product_specific_recs.append({
-                    'product_id': product.product_id,
-                    'name': product.name,
+                    'product_id': product['product_id'],
+                    'name': product['name'],
                     'confidence': round(float(rec_data['confidence']), 3),
                     'support': round(float(rec_data['support']), 3),
-                    'category': product.category,
+                    'category': product['category'],
                     'score': round(float(rec_data['score']), 3),
                     'is_seasonal': seasonal_boost > 1.0,
                     'is_time_relevant': time_boost > 1.0,
-                    'time_of_day': get_time_of_day(),
-                    'metadata': product.product_metadata
+                    'time_of_day': time_of_day,
+                    'metadata': product.get('metadata')
                 })
                 
                 # Stop once we have enough recommendations
@@ -426,87 +1120,1581 @@ def get_recommendations(product_ids, limit=5, min_confidence=0.1):
         
         # Only add to results if we have recommendations
         if product_specific_recs:
-            results.append({
+            product_specific_recs = product_specific_recs[:limit]  # Ensure we don't exceed the limit
+            if fields is not None:
+                product_specific_recs = [{field: rec[field] for field in fields} for rec in product_specific_recs]
+            yield {
                 'product_id': product_id_ext,
-                'recommended_products': product_specific_recs[:limit]  # Ensure we don't exceed the limit
-            })
-    
-    return results
+                'recommended_products': product_specific_recs
+            }
+
+
+# Training settings a tenant can configure as integers, with the smallest value each accepts
+TRAINING_INTEGER_SETTINGS = {
+    'itemset_budget': 1,
+    'workers': 1,
+    'chunk_size': 1,
+    'retrain_quiet_seconds': 0
+}
+
 
+def max_training_workers():
+    """Most mining worker processes a job may start: the CPUs of this machine"""
+    return os.cpu_count() or 1
 
-def batch_process_transactions(transactions, user_id):
+
+def training_setting_error(key, value):
     """
-    Process a batch of transactions to update the recommendation model
+    Check one training setting of a tenant configuration
     
     Args:
-        transactions (list): List of transaction objects
-        user_id (int): ID of the user who uploaded the transactions
+        key (str): Key of TRAINING_INTEGER_SETTINGS
+        value: Configured value
         
     Returns:
-        int: ID of the created job
+        str: Error message, or None if the value is acceptable
     """
-    # Create a new job record
-    job = RecommendationJob()
+    minimum = TRAINING_INTEGER_SETTINGS[key]
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        return f"{key} must be an integer >= {minimum}"
+    if key == 'workers' and value > max_training_workers():
+        return f"workers must be at most {max_training_workers()}, the CPUs of the training node"
+    return None
+
+
+def training_settings(config):
+    """
+    Training settings of a tenant configuration, as recorded on its jobs
+    
+    Values are validated when the configuration is saved; invalid values
+    stored before that check existed fall back to the defaults, and workers
+    are capped at max_training_workers().
+    
+    Args:
+        config (dict): API key configuration
+        
+    Returns:
+        dict: algorithm, itemset_budget, workers, chunk_size and retrain_quiet_seconds
+    """
+    config = config or {}
+    defaults = {
+        'itemset_budget': DEFAULT_ITEMSET_BUDGET,
+        'workers': 1,
+        'chunk_size': None,
+        'retrain_quiet_seconds': None
+    }
+    settings = {'algorithm': get_mining_engine(config.get('algorithm')).name}
+    for key, default in defaults.items():
+        value = config.get(key)
+        if key == 'workers' and isinstance(value, int) and not isinstance(value, bool) and value > 1:
+            value = min(value, max_training_workers())
+        settings[key] = default if value is None or training_setting_error(key, value) else value
+    return settings
+
+
+# Uploads of a tenant arriving within this many seconds of each other share one training run
+RETRAIN_QUIET_SECONDS = float(os.environ.get("RECOMMENDATION_RETRAIN_QUIET_SECONDS", 30))
+
+# Longest a steady stream of uploads can postpone the tenant's training run
+RETRAIN_MAX_DELAY = float(os.environ.get("RECOMMENDATION_RETRAIN_MAX_DELAY", 300))
+
+
+def coalesce_pending_jobs(job, quiet_seconds=None):
+    """
+    Merge a tenant's queued jobs into a job that just became pending
+    
+    Every other pending job of the tenant is marked 'superseded' by this one,
+    which then ingests their transactions and trains once for all of them.
+    The run is debounced: it may start once the tenant's uploads have paused
+    for the quiet window, but no later than RETRAIN_MAX_DELAY after the oldest
+    upload it covers. Jobs already claimed by a worker are left alone. The
+    caller commits.
+    
+    Args:
+        job (RecommendationJob): The new pending job (flushed, so it has an ID)
+        quiet_seconds (float, optional): Quiet window (defaults to RETRAIN_QUIET_SECONDS)
+        
+    Returns:
+        list: IDs of the jobs this one now covers
+    """
+    quiet_seconds = RETRAIN_QUIET_SECONDS if quiet_seconds is None else float(quiet_seconds)
+    tenant_jobs = RecommendationJob.query.filter(RecommendationJob.user_id == job.user_id)
+    
+    # A conditional update, so a job a worker claims concurrently is never superseded
+    tenant_jobs.filter(
+        RecommendationJob.status == 'pending',
+        RecommendationJob.id != job.id
+    ).update({'status': 'superseded', 'superseded_by': job.id}, synchronize_session=False)
+    superseded = [job_id for (job_id,) in tenant_jobs.with_entities(RecommendationJob.id).filter_by(superseded_by=job.id)]
+    
+    # Uploads the superseded jobs had taken over move along with them
+    if superseded:
+        tenant_jobs.filter(RecommendationJob.superseded_by.in_(superseded)).update(
+            {'superseded_by': job.id}, synchronize_session=False
+        )
+    covered = tenant_jobs.filter_by(superseded_by=job.id)
+    first_upload = min([created_at for (created_at,) in covered.with_entities(RecommendationJob.created_at)] + [job.created_at])
+    
+    job.not_before = min(
+        datetime.now() + timedelta(seconds=quiet_seconds),
+        first_upload + timedelta(seconds=RETRAIN_MAX_DELAY)
+    )
+    return [job_id for (job_id,) in covered.with_entities(RecommendationJob.id)]
+
+
+def batch_process_transactions(transactions, user_id, config=None):
+    """
+    Queue a batch of transactions to update the recommendation model
+    
+    The transactions are stored on a pending RecommendationJob; a background
+    worker (see jobs.py) claims it and runs run_recommendation_job(). Queued
+    jobs of the same tenant are merged into it (see coalesce_pending_jobs).
+    
+    Args:
+        transactions (list): List of transaction objects
+        user_id (int): ID of the user who uploaded the transactions
+        config (dict, optional): API key configuration (e.g. the mining 'algorithm')
+        
+    Returns:
+        int: ID of the created job
+    """
+    settings = training_settings(config)
+    
+    # Create a new job record
+    job = RecommendationJob()
     job.user_id = user_id
     job.status = 'pending'
     job.config = {
         'num_transactions': len(transactions),
         'timestamp': datetime.now().isoformat(),
-        'algorithm': 'fp_growth_optimized_for_grocery'
+        'algorithm': settings['algorithm'],
+        'itemset_budget': settings['itemset_budget'],
+        'workers': settings['workers'],
+        'chunk_size': settings['chunk_size']
+    }
+    job.payload = transactions
+    db.session.add(job)
+    db.session.flush()
+    coalesce_pending_jobs(job, settings['retrain_quiet_seconds'])
+    db.session.commit()
+    
+    return job.id
+
+
+def run_recommendation_job(job_id):
+    """
+    Ingest a job's transactions and update the tenant's recommendations
+    
+    Called by a worker after it has claimed the job (status 'processing').
+    The uploads of the jobs it superseded are ingested and trained on in the
+    same run. Each upload records when its rows were folded into the
+    statistics (trained_at), so a job re-run after its worker died does not
+    count them twice. Timings of every phase are stored under
+    result_stats['phases'], also when the job fails.
+    
+    Args:
+        job_id (int): ID of the claimed job
+    """
+    job = RecommendationJob.query.get(job_id)
+    user_id = job.user_id
+    
+    # Streamed uploads already recorded their ingestion phase
+    phases = PhaseRecorder((job.result_stats or {}).get('phases'))
+    
+    try:
+        uploads = (
+            RecommendationJob.query
+            .filter(db.or_(RecommendationJob.id == job_id, RecommendationJob.superseded_by == job_id))
+            .order_by(RecommendationJob.id)
+            .all()
+        )
+        for upload in uploads:
+            # Streamed uploads were ingested while the request body arrived
+            if upload.payload is None:
+                continue
+            
+            # Save transactions to database with bulk statements
+            with phases.phase('ingestion', rows_in=len(upload.payload)) as probe:
+                _, ingestion = ingest_transactions(user_id, upload.payload, job_id=upload.id)
+                probe.rows_out = ingestion['rows_ingested']
+            
+            # The payload is no longer needed once the rows exist
+            upload.payload = None
+            upload.result_stats = dict(upload.result_stats or {}, ingestion=ingestion)
+            db.session.commit()
+        
+        ingestion = (job.result_stats or {}).get('ingestion')
+        coalesced = [upload.id for upload in uploads if upload.id != job_id]
+        untrained = [upload for upload in uploads if upload.trained_at is None]
+        untrained_ids = [upload.id for upload in untrained]
+        
+        # Once the tenant's co-occurrence statistics exist, apply only these
+        # uploads' delta; otherwise run a full training pass, which builds them
+        state = RecommendationModelState.query.filter_by(user_id=user_id).first()
+        trained_at = datetime.now()
+        if state and state.transaction_count:
+            # Uploads without rows of their own (e.g. every transaction was stored
+            # and trained before) change nothing
+            has_rows = untrained_ids and db.session.query(Transaction.id).filter(
+                Transaction.job_id.in_(untrained_ids)
+            ).first() is not None
+            # Flagged before training so the flag commits with the statistics;
+            # an update that returns an error has committed nothing and the
+            # raise rolls the flag back
+            for upload in untrained:
+                upload.trained_at = trained_at
+            if has_rows:
+                result = update_recommendations_incrementally(
+                    user_id, iter_job_baskets(untrained_ids), job_id, phases=phases
+                )
+                # Baskets without any products leave nothing to train
+                if 'error' in result and result['error'] != 'Empty transaction data':
+                    raise RuntimeError(result['error'])
+        else:
+            result = generate_recommendations(user_id, job_id, phases=phases)
+            if 'error' in result:
+                raise RuntimeError(result['error'])
+            
+            # Only a successful full pass marks uploads trained: it read every
+            # stored transaction, including those of failed uploads, which a
+            # retry must therefore not resume
+            for upload in untrained:
+                upload.trained_at = trained_at
+            RecommendationJob.query.filter(
+                RecommendationJob.user_id == user_id,
+                RecommendationJob.status == 'failed',
+                RecommendationJob.trained_at.is_(None)
+            ).update({'trained_at': trained_at}, synchronize_session=False)
+        
+        # Update job status
+        job.status = 'completed'
+        job.completed_at = datetime.now()
+        job.result_stats = dict(
+            job.result_stats or {}, ingestion=ingestion, coalesced_jobs=coalesced, phases=phases.report()
+        )
+        db.session.commit()
+        
+        # Cached results for this tenant were computed from the previous model.
+        # This only reaches this process's cache; other processes switch to the
+        # new model (and new cache keys) at their next model version check
+        recommendation_cache.invalidate_tenant(user_id)
+        
+    except Exception as e:
+        logger.error(f"Error processing transactions: {str(e)}")
+        
+        # Update job status
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(e)
+        job.result_stats = dict(job.result_stats or {}, phases=phases.report())
+        
+        # The uploads it took over failed with it, so retries resume their rows
+        RecommendationJob.query.filter_by(superseded_by=job_id, status='superseded').update(
+            {'status': 'failed', 'error': f"Superseding job {job_id} failed: {str(e)}"},
+            synchronize_session=False
+        )
+        db.session.commit()
+        
+        raise e
+
+
+def stream_process_transactions(records, user_id, config=None, chunk_size=None):
+    """
+    Ingest a streamed upload chunk by chunk and queue its training run
+    
+    Unlike batch_process_transactions the rows are not stored on the job:
+    every chunk is bulk-inserted as soon as it has been parsed, so memory
+    stays flat however large the upload is. The job is created up front
+    (status 'receiving') so the rows can be tagged with it, and becomes
+    pending once the stream has been consumed.
+    
+    Args:
+        records (iterable): Transaction dicts, e.g. from iter_uploaded_transactions()
+        user_id (int): ID of the user who uploaded the transactions
+        config (dict, optional): API key configuration (e.g. the mining 'algorithm')
+        chunk_size (int, optional): Rows per bulk insert (defaults to STREAM_CHUNK_SIZE)
+        
+    Returns:
+        tuple: (ID of the created job, ingestion statistics)
+    """
+    settings = training_settings(config)
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    
+    job = RecommendationJob()
+    job.user_id = user_id
+    job.status = 'receiving'
+    job.config = {
+        'source': 'stream',
+        'timestamp': datetime.now().isoformat(),
+        'algorithm': settings['algorithm'],
+        'itemset_budget': settings['itemset_budget'],
+        'workers': settings['workers'],
+        'chunk_size': settings['chunk_size']
+    }
+    db.session.add(job)
+    db.session.commit()
+    job_id = job.id
+    
+    phases = PhaseRecorder()
+    try:
+        started = perf_counter()
+        ingestion = {
+            'rows_received': 0, 'rows_ingested': 0, 'rows_resumed': 0, 'rows_rejected': 0, 'rows_duplicate': 0,
+            'chunks': 0, 'validation_seconds': 0.0
+        }
+        records = iter(records)
+        with phases.phase('ingestion') as probe:
+            while True:
+                chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                # Committed with the chunk: shows other uploads the stream is alive
+                RecommendationJob.query.filter_by(id=job_id).update(
+                    {'updated_at': datetime.now()}, synchronize_session=False
+                )
+                _, stats = ingest_transactions(user_id, chunk, chunk_size=chunk_size, job_id=job_id)
+                ingestion['method'] = stats['method']
+                ingestion['chunks'] += 1
+                for key in ('rows_received', 'rows_ingested', 'rows_resumed', 'rows_rejected', 'rows_duplicate',
+                            'validation_seconds'):
+                    ingestion[key] += stats[key]
+            probe.rows_in = ingestion['rows_received']
+            probe.rows_out = ingestion['rows_ingested']
+        
+        elapsed = perf_counter() - started
+        ingestion.update(
+            validation_seconds=round(ingestion['validation_seconds'], 4),
+            seconds=round(elapsed, 4),
+            rows_per_second=round(ingestion['rows_ingested'] / elapsed, 1) if elapsed > 0 else None
+        )
+        
+        job = RecommendationJob.query.get(job_id)
+        job.status = 'pending'
+        job.config = dict(job.config, num_transactions=ingestion['rows_ingested'] + ingestion['rows_resumed'])
+        job.result_stats = {'ingestion': ingestion, 'phases': phases.report()}
+        coalesce_pending_jobs(job, settings['retrain_quiet_seconds'])
+        db.session.commit()
+        return job_id, ingestion
+    
+    except Exception as e:
+        logger.error(f"Error ingesting streamed transactions: {str(e)}")
+        
+        # Chunks committed before the failure stay stored; a retried upload
+        # resumes them (see resume_untrained_transactions)
+        db.session.rollback()
+        job = RecommendationJob.query.get(job_id)
+        job.status = 'failed'
+        job.error = str(e)
+        db.session.commit()
+        
+        raise e
+
+
+# Rows parsed from an upload stream before they are written in one go
+STREAM_CHUNK_SIZE = 5000
+
+# Seconds after its last chunk that a stream still 'receiving' counts as abandoned
+STREAM_STALE_SECONDS = float(os.environ.get("RECOMMENDATION_STREAM_STALE_SECONDS", 600))
+
+# Body formats accepted by iter_uploaded_transactions()
+UPLOAD_FORMATS = ('ndjson', 'csv')
+
+
+def parse_csv_transaction(row):
+    """
+    Turn a CSV upload row into a transaction dict
+    
+    The products column holds either a JSON array or product IDs separated
+    by ';', and the optional metadata column a JSON object.
+    
+    Args:
+        row (dict): Row from csv.DictReader
+        
+    Returns:
+        dict: Transaction dict as accepted by validate_transactions()
+    """
+    products = (row.get('products') or '').strip()
+    try:
+        if products.startswith('['):
+            products = json.loads(products)
+        else:
+            products = [product_id.strip() for product_id in products.split(';') if product_id.strip()]
+        metadata = json.loads(row['metadata']) if row.get('metadata') else {}
+    except ValueError:
+        # The unparsed text is not a product list, so validation rejects the row
+        return {'transaction_id': row.get('transaction_id'), 'products': row.get('products') or ''}
+    
+    return {
+        'transaction_id': row.get('transaction_id'),
+        'timestamp': row.get('timestamp') or None,
+        'products': products,
+        'metadata': metadata
+    }
+
+
+def iter_uploaded_transactions(stream, format='ndjson', compressed=False):
+    """
+    Parse an upload body incrementally, one transaction at a time
+    
+    NDJSON bodies hold one transaction object per line; CSV bodies have a
+    header row with transaction_id, products and optionally timestamp and
+    metadata columns (see parse_csv_transaction). Lines that cannot be
+    parsed are yielded as None so validation counts them as rejected.
+    
+    Args:
+        stream (file-like): Binary request body
+        format (str): 'ndjson' or 'csv'
+        compressed (bool): Whether the body is gzip-compressed
+        
+    Yields:
+        dict: Transaction dict (or None for an unparseable line)
+    """
+    if format not in UPLOAD_FORMATS:
+        raise ValueError(f"Unsupported upload format '{format}'")
+    
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    
+    if format == 'csv':
+        for row in csv.DictReader(text):
+            yield parse_csv_transaction(row)
+        return
+    
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+# Columns written for each ingested transaction
+TRANSACTION_COLUMNS = ['transaction_id', 'user_id', 'timestamp', 'products', 'transaction_metadata', 'job_id']
+
+# Temporary table COPY writes to before rows are merged into "transaction"
+TRANSACTION_STAGING_TABLE = 'transaction_staging'
+
+
+def is_product_list(value):
+    """Whether an uploaded products value is a list of product IDs (strings or numbers)"""
+    return isinstance(value, list) and all(
+        isinstance(product_id, (str, int, float)) and not isinstance(product_id, bool)
+        for product_id in value
+    )
+
+
+def validate_transactions(transactions, user_id, job_id=None):
+    """
+    Validate uploaded transactions in one vectorized pass
+    
+    Rows without a transaction ID (or with one longer than 64 characters) or
+    whose products are not a list of strings or numbers are rejected.
+    Transaction IDs are converted value by value, so the ID 1 is stored as
+    '1' whatever else the upload contains. Missing or unparseable timestamps
+    default to now, and missing metadata to {}.
+    
+    Args:
+        transactions (list): Uploaded transaction dicts
+        user_id (int): Tenant the rows belong to
+        job_id (int, optional): Job the rows are ingested by
+        
+    Returns:
+        tuple: (DataFrame with TRANSACTION_COLUMNS of the valid rows, number of rejected rows)
+    """
+    # Object columns keep the uploaded values: with missing IDs a numeric
+    # column would otherwise become float64 and 1 would turn into '1.0'
+    raw = pd.DataFrame(
+        [tx if isinstance(tx, dict) else {} for tx in transactions],
+        columns=['transaction_id', 'timestamp', 'products', 'metadata'],
+        dtype=object
+    )
+    
+    transaction_ids = raw['transaction_id'].map(
+        lambda value: '' if value is None or value != value else str(value).strip()
+    )
+    products = raw['products'].map(lambda value: [] if value is None or value != value else value)
+    valid = (
+        (transaction_ids.str.len() > 0)
+        & (transaction_ids.str.len() <= 64)
+        & products.map(is_product_list)
+    )
+    
+    # Timezone-aware timestamps are stored as UTC wall-clock time
+    timestamps = pd.to_datetime(raw['timestamp'], errors='coerce', format='ISO8601', utc=True)
+    timestamps = timestamps.dt.tz_convert(None).fillna(pd.Timestamp(datetime.now()))
+    metadata = raw['metadata'].map(lambda value: value if isinstance(value, dict) else {})
+    
+    frame = pd.DataFrame({
+        'transaction_id': transaction_ids,
+        'user_id': user_id,
+        'timestamp': timestamps,
+        'products': products,
+        'transaction_metadata': metadata,
+        'job_id': job_id
+    })[valid.to_numpy()]
+    return frame.reset_index(drop=True), int((~valid).sum())
+
+
+def copy_transactions(frame):
+    """
+    Write validated transactions with PostgreSQL COPY FROM STDIN
+    
+    COPY cannot skip conflicting rows, so the chunk is copied into a
+    temporary staging table and moved over with INSERT ... ON CONFLICT DO
+    NOTHING on the unique (user_id, transaction_id) constraint.
+    
+    Args:
+        frame (pandas.DataFrame): Rows with TRANSACTION_COLUMNS
+        
+    Returns:
+        int: Number of rows inserted (the rest were already stored)
+    """
+    buffer = io.StringIO()
+    frame.assign(
+        timestamp=frame['timestamp'].map(lambda value: value.isoformat()),
+        products=frame['products'].map(json.dumps),
+        transaction_metadata=frame['transaction_metadata'].map(json.dumps)
+    ).to_csv(buffer, columns=TRANSACTION_COLUMNS, header=False, index=False)
+    buffer.seek(0)
+    
+    columns = ", ".join(TRANSACTION_COLUMNS)
+    table = f'"{Transaction.__tablename__}"'
+    statement = f'COPY {TRANSACTION_STAGING_TABLE} ({columns}) FROM STDIN WITH (FORMAT csv)'
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            f'CREATE TEMP TABLE IF NOT EXISTS {TRANSACTION_STAGING_TABLE} ON COMMIT DROP '
+            f'AS SELECT {columns} FROM {table} WITH NO DATA'
+        )
+        if hasattr(cursor, 'copy_expert'):  # psycopg2
+            cursor.copy_expert(statement, buffer)
+        else:  # psycopg 3
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+        
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {TRANSACTION_STAGING_TABLE} '
+            f'ON CONFLICT ON CONSTRAINT unique_user_transaction DO NOTHING'
+        )
+        inserted = cursor.rowcount
+        cursor.execute(f'TRUNCATE {TRANSACTION_STAGING_TABLE}')
+        return inserted
+    finally:
+        cursor.close()
+
+
+def insert_new_transactions(frame):
+    """
+    Write validated transactions with one executemany INSERT, skipping stored ones
+    
+    SQLite skips conflicting rows with INSERT ... ON CONFLICT DO NOTHING;
+    other dialects look up the chunk's stored transaction IDs first.
+    
+    Args:
+        frame (pandas.DataFrame): Rows with TRANSACTION_COLUMNS of one tenant
+        
+    Returns:
+        int: Number of rows inserted (the rest were already stored)
+    """
+    if frame.empty:
+        return 0
+    
+    if db.session.get_bind().dialect.name == 'sqlite':
+        stmt = sqlite_insert(Transaction.__table__).on_conflict_do_nothing(index_elements=['user_id', 'transaction_id'])
+        return db.session.connection().execute(stmt, frame.to_dict('records')).rowcount
+    
+    stored = {
+        transaction_id for (transaction_id,) in db.session.query(Transaction.transaction_id).filter(
+            Transaction.user_id == int(frame['user_id'].iloc[0]),
+            Transaction.transaction_id.in_(frame['transaction_id'].tolist())
+        )
+    }
+    new_rows = frame[~frame['transaction_id'].isin(stored)]
+    if not new_rows.empty:
+        db.session.execute(db.insert(Transaction), new_rows.to_dict('records'))
+    return len(new_rows)
+
+
+def ingest_transactions(user_id, transactions, chunk_size=5000, job_id=None):
+    """
+    Validate and bulk-insert uploaded transactions
+    
+    PostgreSQL receives each chunk through COPY FROM STDIN; other dialects
+    get one executemany INSERT per chunk. Rows never become ORM objects.
+    Transactions whose ID the tenant already stored, or that repeat within
+    the upload, are skipped and reported as duplicates, so retried uploads
+    are safe; only the inserted rows carry job_id. Stored rows that were never
+    trained on (see resume_untrained_transactions) are taken over by job_id
+    instead and reported as resumed.
+    
+    Args:
+        user_id (int): Tenant the rows belong to
+        transactions (list): Uploaded transaction dicts
+        chunk_size (int): Rows per COPY / INSERT
+        job_id (int, optional): Job the rows are ingested by
+        
+    Returns:
+        tuple: (DataFrame of the validated rows, ingestion statistics)
+    """
+    started = perf_counter()
+    frame, rejected = validate_transactions(transactions, user_id, job_id)
+    
+    # Only the first occurrence of a transaction ID within the upload counts
+    frame = frame[~frame['transaction_id'].duplicated()].reset_index(drop=True)
+    validated = perf_counter()
+    
+    use_copy = db.session.get_bind().dialect.name == 'postgresql'
+    inserted = 0
+    resumed = 0
+    for start in range(0, len(frame), chunk_size):
+        chunk = frame.iloc[start:start + chunk_size]
+        if use_copy:
+            chunk_inserted = copy_transactions(chunk)
+        else:
+            chunk_inserted = insert_new_transactions(chunk)
+        inserted += chunk_inserted
+        if job_id is not None and chunk_inserted < len(chunk):
+            resumed += resume_untrained_transactions(user_id, chunk['transaction_id'].tolist(), job_id)
+    db.session.commit()
+    
+    elapsed = perf_counter() - started
+    duplicates = len(transactions) - rejected - inserted - resumed
+    if resumed:
+        logger.info(f"Resumed {resumed} stored but untrained transactions for user {user_id}")
+    if rejected:
+        logger.warning(f"Rejected {rejected} invalid transactions for user {user_id}")
+    if duplicates:
+        logger.info(f"Skipped {duplicates} already ingested transactions for user {user_id}")
+    return frame, {
+        'method': 'copy' if use_copy else 'executemany',
+        'rows_received': len(transactions),
+        'rows_ingested': inserted,
+        'rows_resumed': resumed,
+        'rows_rejected': rejected,
+        'rows_duplicate': duplicates,
+        'validation_seconds': round(validated - started, 4),
+        'seconds': round(elapsed, 4),
+        'rows_per_second': round(inserted / elapsed, 1) if elapsed > 0 else None
+    }
+
+
+def resume_untrained_transactions(user_id, transaction_ids, job_id):
+    """
+    Hand stored transactions that were never trained on over to a new job
+    
+    Rows stay stored when the job that ingested them fails before training
+    (or its stream is cut off), so a retried upload finds them as
+    duplicates. Rows of such failed jobs, and of streams that stopped
+    receiving chunks STREAM_STALE_SECONDS ago (e.g. their process died), are
+    re-tagged with the retrying job, which then trains on them. Rows of
+    trained jobs, of streams still in progress and rows without a job are
+    left alone.
+    
+    Args:
+        user_id (int): Tenant the rows belong to
+        transaction_ids (list): Transaction IDs of the upload that are already stored
+        job_id (int): Job taking the rows over
+        
+    Returns:
+        int: Number of rows taken over
+    """
+    stale = datetime.now() - timedelta(seconds=STREAM_STALE_SECONDS)
+    untrained_jobs = db.select(RecommendationJob.id).where(
+        RecommendationJob.user_id == user_id,
+        RecommendationJob.id != job_id,
+        RecommendationJob.trained_at.is_(None),
+        db.or_(
+            RecommendationJob.status == 'failed',
+            db.and_(
+                RecommendationJob.status == 'receiving',
+                db.func.coalesce(RecommendationJob.updated_at, RecommendationJob.created_at) < stale
+            )
+        )
+    )
+    result = db.session.execute(
+        db.update(Transaction)
+        .where(
+            Transaction.user_id == user_id,
+            Transaction.transaction_id.in_(transaction_ids),
+            Transaction.job_id.in_(untrained_jobs)
+        )
+        .values(job_id=job_id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+class TransactionMatrixBuilder:
+    """
+    Build a sparse boolean basket x product matrix in a single pass
+
+    Product IDs are interned to int32 column indices the first time they are
+    seen, and each basket only contributes the columns it actually contains,
+    so memory scales with the total number of basket items rather than with
+    basket count x catalog size.
+    """
+
+    def __init__(self):
+        self.item_index = {}  # External product ID -> column index
+        self.items = []  # Column index -> external product ID
+        self._indices = array('i')
+        self._indptr = array('q', [0])
+
+    def add(self, products):
+        """
+        Append one basket to the matrix
+
+        Args:
+            products (list): External product IDs in the basket
+        """
+        item_index = self.item_index
+        columns = set()
+        for product_id in products:
+            column = item_index.get(product_id)
+            if column is None:
+                column = len(self.items)
+                item_index[product_id] = column
+                self.items.append(product_id)
+            columns.add(column)
+
+        # Sorted column indices keep the CSR representation canonical
+        self._indices.extend(sorted(columns))
+        self._indptr.append(len(self._indices))
+
+    @property
+    def num_transactions(self):
+        return len(self._indptr) - 1
+
+    @property
+    def num_items(self):
+        return len(self.items)
+
+    @property
+    def total_items(self):
+        return len(self._indices)
+
+    def build(self):
+        """
+        Finalize the CSR matrix
+
+        Returns:
+            scipy.sparse.csr_matrix: Boolean matrix, one row per basket and one column per product
+        """
+        # Copy out of the staging buffers so the builder can keep growing
+        indices = np.frombuffer(self._indices, dtype=np.int32).copy()
+        indptr = np.frombuffer(self._indptr, dtype=np.int64).copy()
+        data = np.ones(len(indices), dtype=bool)
+        return sparse.csr_matrix(
+            (data, indices, indptr),
+            shape=(self.num_transactions, self.num_items)
+        )
+
+
+def build_transaction_matrix(baskets):
+    """
+    Build a sparse, integer-encoded transaction matrix from baskets
+
+    Args:
+        baskets (iterable): Iterable of product ID lists, one per transaction
+
+    Returns:
+        tuple: (scipy.sparse.csr_matrix, list of external product IDs indexed by column)
+    """
+    builder = TransactionMatrixBuilder()
+    for products in baskets:
+        builder.add(products)
+    return builder.build(), builder.items
+
+
+def matrix_to_dataframe(matrix, items):
+    """
+    Wrap a sparse transaction matrix as a sparse pandas DataFrame for mlxtend
+
+    The data is shared with the CSR matrix instead of being densified.
+
+    Args:
+        matrix (scipy.sparse.spmatrix): Boolean basket x product matrix
+        items (list): External product IDs indexed by column
+
+    Returns:
+        pandas.DataFrame: DataFrame with sparse boolean columns named by product ID
+    """
+    return pd.DataFrame.sparse.from_spmatrix(matrix.tocsc(), columns=items)
+
+
+def grocery_rule_score(confidence, lift, support, conviction):
+    """
+    Combine rule metrics into the grocery-optimized rule score
+    
+    Works element-wise on scalars, NumPy arrays or pandas Series.
+    
+    Args:
+        confidence: Rule confidence
+        lift: Rule lift
+        support: Rule support
+        conviction: Rule conviction (may be inf)
+        
+    Returns:
+        Combined score, normalized to approximately the 0-1 range
+    """
+    # Grocery-specialized weighting based on academic research
+    return (
+        (confidence * 2.5) +                  # Strong weight on confidence
+        (lift * 1.8) +                        # Medium-high weight on lift 
+        (np.log1p(support * 100) * 0.6) +     # Logarithmic scaling for support
+        (np.minimum(conviction, 5) * 0.4)     # Capped weight on conviction
+    ) / 5.3  # Normalize to approximate 0-1 range
+
+
+def pair_boost_factor(product_id, recommended_product_id, consequent_frequency, num_transactions, product_categories):
+    """
+    Combined training-time boost for a product -> recommended product pair
+    
+    Seasonal and time-of-day boosts are not part of it: they are applied per
+    context in the score vectors (see context_factor_matrix).
+    
+    Args:
+        product_id (int): Internal ID of the source product
+        recommended_product_id (int): Internal ID of the recommended product
+        consequent_frequency (int, optional): Number of baskets containing the recommended product
+        num_transactions (int): Total number of baskets
+        product_categories (dict): Internal product ID -> category
+        
+    Returns:
+        float: Product of the category and frequency boosts
+    """
+    # Apply category boost if products are in the same category
+    category_boost = 1.0
+    if (product_id in product_categories and 
+        recommended_product_id in product_categories and
+        product_categories[product_id] == product_categories[recommended_product_id]):
+        category_boost = 1.15  # 15% boost for same category
+    
+    # Apply frequency boost based on product popularity
+    freq_boost = 1.0
+    if consequent_frequency:
+        normalized_freq = min(consequent_frequency / max(1, num_transactions), 1.0)
+        freq_boost = 1.0 + (normalized_freq * 0.2)  # Up to 20% boost
+    
+    return category_boost * freq_boost
+
+
+class MiningEngine:
+    """
+    Base interface for frequent itemset mining backends
+
+    Engines take the sparse basket matrix produced by TransactionMatrixBuilder
+    and return frequent itemsets in the mlxtend format (``support`` and
+    ``itemsets`` columns, itemsets as frozensets of external product IDs) so
+    the result can be fed straight into ``iter_association_rules``.
+    """
+    name = None
+    generates_rules = False  # True for engines that emit rules without itemset mining
+
+    def mine(self, matrix, items, min_support, max_len=None):
+        """
+        Mine frequent itemsets
+
+        Args:
+            matrix (scipy.sparse.csr_matrix): Boolean basket x product matrix
+            items (list): External product IDs indexed by column
+            min_support (float): Minimum support threshold
+            max_len (int, optional): Maximum itemset length
+
+        Returns:
+            pandas.DataFrame: Frequent itemsets with their support
+        """
+        raise NotImplementedError
+
+
+class AprioriEngine(MiningEngine):
+    """Level-wise candidate generation (mlxtend apriori)"""
+    name = 'apriori'
+
+    def mine(self, matrix, items, min_support, max_len=None):
+        df = matrix_to_dataframe(matrix, items)
+        return apriori(df, min_support=min_support, use_colnames=True, max_len=max_len)
+
+
+class FPGrowthEngine(MiningEngine):
+    """Pattern growth over a compressed FP-tree, no candidate generation (mlxtend fpgrowth)"""
+    name = 'fp_growth'
+
+    def mine(self, matrix, items, min_support, max_len=None):
+        df = matrix_to_dataframe(matrix, items)
+        return fpgrowth(df, min_support=min_support, use_colnames=True, max_len=max_len)
+
+
+class EclatEngine(MiningEngine):
+    """Depth-first search over vertical tid-lists"""
+    name = 'eclat'
+
+    def mine(self, matrix, items, min_support, max_len=None):
+        num_transactions = matrix.shape[0]
+        if num_transactions == 0:
+            return _itemsets_frame([], [], items, num_transactions)
+        min_count = min_support * num_transactions
+        
+        # Vertical layout: the CSC row indices of a column are its tid-list
+        csc = matrix.tocsc()
+        csc.sort_indices()
+        counts = np.diff(csc.indptr)
+        frequent = np.flatnonzero(counts >= min_count)
+        # Extending rarest items first keeps the intersections small
+        frequent = frequent[np.argsort(counts[frequent], kind='stable')]
+        
+        counts_out = []
+        itemsets_out = []
+        
+        def extend(prefix, equivalence_class):
+            for i, (column, tids) in enumerate(equivalence_class):
+                itemset = prefix + (column,)
+                counts_out.append(len(tids))
+                itemsets_out.append(itemset)
+                
+                if max_len and len(itemset) >= max_len:
+                    continue
+                
+                suffix = []
+                for other_column, other_tids in equivalence_class[i + 1:]:
+                    common = np.intersect1d(tids, other_tids, assume_unique=True)
+                    if len(common) >= min_count:
+                        suffix.append((other_column, common))
+                if suffix:
+                    extend(itemset, suffix)
+        
+        extend((), [
+            (int(column), csc.indices[csc.indptr[column]:csc.indptr[column + 1]])
+            for column in frequent
+        ])
+        
+        return _itemsets_frame(counts_out, itemsets_out, items, num_transactions)
+
+
+class PairRuleEngine(MiningEngine):
+    """
+    Single item -> single item rules from one sparse co-occurrence product
+
+    Item supports and pair co-occurrence counts both come from X^T X over the
+    basket matrix; confidence, lift and conviction are derived as NumPy arrays
+    and only the top-k consequents per antecedent are kept.
+    """
+    name = 'pairs'
+    generates_rules = True
+
+    def __init__(self, top_k=50):
+        self.top_k = top_k
+
+    def _cooccurrence(self, matrix, min_support):
+        """Return (frequent columns, their counts, frequent pair co-occurrence as COO)"""
+        num_transactions = matrix.shape[0]
+        min_count = min_support * num_transactions
+        
+        counts = np.asarray(matrix.sum(axis=0)).ravel()
+        # Only frequent items can take part in frequent pairs
+        frequent = np.flatnonzero(counts >= min_count)
+        x = matrix[:, frequent].astype(np.int32)
+        
+        cooccurrence = (x.T @ x).tocoo()
+        keep = (cooccurrence.row != cooccurrence.col) & (cooccurrence.data >= min_count)
+        return frequent, counts[frequent], cooccurrence.row[keep], cooccurrence.col[keep], cooccurrence.data[keep]
+
+    def mine(self, matrix, items, min_support, max_len=None):
+        num_transactions = matrix.shape[0]
+        frequent, counts, rows, cols, pair_counts = self._cooccurrence(matrix, min_support)
+        
+        itemsets = [(column,) for column in frequent]
+        itemset_counts = list(counts)
+        if max_len is None or max_len >= 2:
+            # Each unordered pair appears twice in the symmetric product
+            upper = rows < cols
+            itemsets += [(frequent[a], frequent[b]) for a, b in zip(rows[upper], cols[upper])]
+            itemset_counts += list(pair_counts[upper])
+        return _itemsets_frame(itemset_counts, itemsets, items, num_transactions)
+
+    def mine_rules(self, matrix, items, min_support, min_confidence):
+        """
+        Derive 1->1 association rules directly from pair co-occurrence
+
+        Args:
+            matrix (scipy.sparse.csr_matrix): Boolean basket x product matrix
+            items (list): External product IDs indexed by column
+            min_support (float): Minimum pair support
+            min_confidence (float): Minimum rule confidence
+
+        Returns:
+            tuple: (rules DataFrame in mlxtend association_rules format,
+                    number of frequent itemsets of length 1 and 2)
+        """
+        num_transactions = max(1, matrix.shape[0])
+        frequent, counts, rows, cols, pair_counts = self._cooccurrence(matrix, min_support)
+        frequent_itemset_count = len(frequent) + len(pair_counts) // 2
+        
+        item_support = counts / num_transactions
+        support = pair_counts / num_transactions
+        antecedent_support = item_support[rows]
+        consequent_support = item_support[cols]
+        confidence = support / antecedent_support
+        lift = confidence / consequent_support
+        with np.errstate(divide='ignore'):
+            conviction = np.where(
+                confidence >= 1,
+                np.inf,
+                (1 - consequent_support) / (1 - np.minimum(confidence, 1))
+            )
+        
+        keep = confidence >= min_confidence
+        rows, cols = rows[keep], cols[keep]
+        support, antecedent_support, consequent_support = support[keep], antecedent_support[keep], consequent_support[keep]
+        confidence, lift, conviction = confidence[keep], lift[keep], conviction[keep]
+        score = grocery_rule_score(confidence, lift, support, conviction)
+        
+        selected = self._top_k_per_antecedent(rows, score)
+        
+        rules = pd.DataFrame({
+            'antecedents': [frozenset([items[frequent[a]]]) for a in rows[selected]],
+            'consequents': [frozenset([items[frequent[c]]]) for c in cols[selected]],
+            'antecedent support': antecedent_support[selected],
+            'consequent support': consequent_support[selected],
+            'support': support[selected],
+            'confidence': confidence[selected],
+            'lift': lift[selected],
+            'conviction': conviction[selected],
+        })
+        return rules, frequent_itemset_count
+
+    def _top_k_per_antecedent(self, rows, score):
+        """Indices of the top_k highest-scoring entries for every antecedent row"""
+        if not self.top_k or len(rows) == 0:
+            return np.arange(len(rows))
+        
+        order = np.argsort(rows, kind='stable')
+        boundaries = np.flatnonzero(np.diff(rows[order])) + 1
+        selected = []
+        for group in np.split(order, boundaries):
+            if len(group) > self.top_k:
+                group = group[np.argpartition(-score[group], self.top_k - 1)[:self.top_k]]
+            selected.append(group)
+        return np.concatenate(selected)
+
+
+def _mine_partition(engine_name, chunk, min_support, max_len):
+    """Process pool task: locally frequent itemsets of one partition, as column-index tuples"""
+    started = perf_counter()
+    itemsets = MINING_ENGINES[engine_name].mine(chunk, list(range(chunk.shape[1])), min_support, max_len)
+    candidates = [tuple(sorted(itemset)) for itemset in itemsets['itemsets']]
+    return candidates, perf_counter() - started
+
+
+def _count_partition(chunk, candidate_matrix, lengths):
+    """Process pool task: exact occurrence counts of every candidate itemset in one partition"""
+    started = perf_counter()
+    # Entry (basket, candidate) holds how many of the candidate's items the basket contains
+    hits = (chunk.astype(np.int32) @ candidate_matrix.T).tocsr()
+    contained = hits.data == lengths[hits.indices]
+    counts = np.bincount(hits.indices[contained], minlength=len(lengths))
+    return counts, perf_counter() - started
+
+
+class PartitionedMiningEngine(MiningEngine):
+    """
+    Multi-core exact mining with the SON algorithm
+    
+    The basket matrix is split into row partitions, locally frequent itemsets
+    are mined in each partition by the wrapped engine in a process pool, and a
+    second pass counts every candidate across all partitions. Any globally
+    frequent itemset is locally frequent in at least one partition, so the
+    result is identical to single-process mining.
+    """
+    
+    def __init__(self, engine, workers, chunk_size=None):
+        self.engine = engine
+        self.name = engine.name
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.partition_stats = []
+
+    def _executor(self):
+        # Forking avoids re-importing this module (and with it the Flask app)
+        # in every worker process
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+
+    def mine(self, matrix, items, min_support, max_len=None):
+        if multiprocessing.current_process().daemon:
+            # Daemonic processes cannot start a pool; the result is the same in-process
+            logger.warning(f"Mining with {self.engine.name} in-process: daemonic processes cannot have children")
+            self.partition_stats = []
+            return self.engine.mine(matrix, items, min_support, max_len)
+        
+        num_transactions = matrix.shape[0]
+        chunk_size = self.chunk_size or max(1, -(-num_transactions // self.workers))
+        chunks = [matrix[start:start + chunk_size] for start in range(0, num_transactions, chunk_size)]
+        
+        with self._executor() as executor:
+            # Phase 1: candidates are the union of locally frequent itemsets
+            local_results = list(executor.map(
+                _mine_partition,
+                [self.engine.name] * len(chunks),
+                chunks,
+                [min_support] * len(chunks),
+                [max_len] * len(chunks)
+            ))
+            candidates = sorted(set().union(*(set(result[0]) for result in local_results)))
+            if not candidates:
+                self.partition_stats = [
+                    {'rows': chunk.shape[0], 'local_itemsets': 0, 'mine_seconds': round(elapsed, 4), 'count_seconds': 0.0}
+                    for chunk, (_, elapsed) in zip(chunks, local_results)
+                ]
+                return _itemsets_frame([], [], items, num_transactions)
+            
+            # Phase 2: exact global counts of every candidate
+            lengths = np.array([len(candidate) for candidate in candidates], dtype=np.int32)
+            candidate_matrix = sparse.csr_matrix(
+                (
+                    np.ones(int(lengths.sum()), dtype=np.int32),
+                    np.fromiter((column for candidate in candidates for column in candidate), dtype=np.int32),
+                    np.concatenate([[0], np.cumsum(lengths)])
+                ),
+                shape=(len(candidates), matrix.shape[1])
+            )
+            count_results = list(executor.map(
+                _count_partition,
+                chunks,
+                [candidate_matrix] * len(chunks),
+                [lengths] * len(chunks)
+            ))
+        
+        self.partition_stats = [
+            {
+                'rows': chunk.shape[0],
+                'local_itemsets': len(local[0]),
+                'mine_seconds': round(local[1], 4),
+                'count_seconds': round(counted[1], 4)
+            }
+            for chunk, local, counted in zip(chunks, local_results, count_results)
+        ]
+        
+        counts = np.sum([result[0] for result in count_results], axis=0)
+        frequent = np.flatnonzero(counts >= min_support * num_transactions)
+        return _itemsets_frame(
+            counts[frequent],
+            [candidates[i] for i in frequent],
+            items,
+            num_transactions
+        )
+
+
+def _itemsets_frame(counts, itemsets, items, num_transactions):
+    """Build an mlxtend-style frequent itemsets DataFrame from column-index itemsets"""
+    return pd.DataFrame({
+        'support': np.asarray(counts, dtype=float) / max(1, num_transactions),
+        'itemsets': [frozenset(items[column] for column in itemset) for itemset in itemsets]
+    }, columns=['support', 'itemsets'])
+
+
+MINING_ENGINES = {
+    engine.name: engine
+    for engine in (AprioriEngine(), FPGrowthEngine(), EclatEngine(), PairRuleEngine())
+}
+
+DEFAULT_MINING_ENGINE = 'fp_growth'
+
+# Names recorded by older job configs
+MINING_ENGINE_ALIASES = {
+    'fp_growth_optimized_for_grocery': 'fp_growth',
+}
+
+
+def get_mining_engine(name=None):
+    """
+    Look up a frequent itemset mining engine by name
+
+    Args:
+        name (str, optional): Engine name ('apriori', 'fp_growth', 'eclat' or 'pairs'),
+                              defaults to DEFAULT_MINING_ENGINE
+
+    Returns:
+        MiningEngine: The requested engine
+
+    Raises:
+        ValueError: If the engine name is unknown
+    """
+    name = MINING_ENGINE_ALIASES.get(name, name) or DEFAULT_MINING_ENGINE
+    if name not in MINING_ENGINES:
+        raise ValueError(f"Unknown mining algorithm '{name}', expected one of: {', '.join(MINING_ENGINES)}")
+    return MINING_ENGINES[name]
+
+
+DEFAULT_ITEMSET_BUDGET = 20000
+
+
+def plan_thresholds(matrix, min_support, min_confidence, itemset_budget=DEFAULT_ITEMSET_BUDGET):
+    """
+    Choose support and confidence thresholds before mining
+    
+    Builds the support histogram of all items and item pairs in one pass
+    (column sums plus one sparse X^T X product) and picks a support level
+    from it instead of mining repeatedly with halved thresholds:
+    
+    - if the requested support yields no frequent pair, support is lowered
+      towards the level that fills the itemset budget, but never below a
+      quarter of the request (where the old retry loop bottomed out)
+    - if the requested support would exceed the budget, it is raised to the
+      lowest level that stays within it
+    
+    Confidence is lowered (to at most half the request) only if no 1->1 rule
+    at the chosen support reaches the requested confidence. Itemsets longer
+    than two items are not counted, so the itemset estimate is a lower bound.
+    
+    Args:
+        matrix (scipy.sparse.csr_matrix): Boolean basket x product matrix
+        min_support (float): Requested minimum support
+        min_confidence (float): Requested minimum confidence
+        itemset_budget (int): Target number of frequent itemsets
+        
+    Returns:
+        dict: The planned thresholds and the reasoning behind them
+    """
+    num_transactions = max(1, matrix.shape[0])
+    support_floor = min_support / 4
+    confidence_floor = min_confidence / 2
+    
+    # Item support histogram; only items above the floor can form frequent pairs
+    item_counts = np.asarray(matrix.sum(axis=0)).ravel()
+    candidates = np.flatnonzero(item_counts >= support_floor * num_transactions)
+    x = matrix[:, candidates].astype(np.int32)
+    pairs = sparse.triu(x.T @ x, k=1).tocoo()
+    keep = pairs.data >= support_floor * num_transactions
+    pair_rows, pair_cols, pair_counts = pairs.row[keep], pairs.col[keep], pairs.data[keep]
+    
+    # Supports of every 1- and 2-itemset above the floor, most frequent first
+    supports = np.sort(np.concatenate([item_counts[candidates], pair_counts]))[::-1] / num_transactions
+    
+    support = min_support
+    support_reason = 'requested'
+    if not np.any(pair_counts >= support * num_transactions):
+        # Sparse tenant: lower support to fill the budget, bounded by the floor
+        budget_support = supports[min(itemset_budget, len(supports)) - 1] if len(supports) else support_floor
+        support = float(max(support_floor, min(support, budget_support)))
+        support_reason = 'lowered_for_sparse_data'
+    elif np.count_nonzero(supports >= support) > itemset_budget:
+        # Dense tenant: raise support to the next count level that fits the budget
+        support = float(supports[itemset_budget] + 1.0 / num_transactions)
+        support_reason = 'raised_for_budget'
+    
+    frequent_pairs = pair_counts >= support * num_transactions
+    frequent_items = int(np.count_nonzero(item_counts >= support * num_transactions))
+    
+    # Best 1->1 confidence achievable at the chosen support (in either direction)
+    best_confidence = 0.0
+    if np.any(frequent_pairs):
+        row_counts = item_counts[candidates][pair_rows[frequent_pairs]]
+        col_counts = item_counts[candidates][pair_cols[frequent_pairs]]
+        best_confidence = float(np.max(pair_counts[frequent_pairs] / np.minimum(row_counts, col_counts)))
+    
+    confidence = min_confidence
+    confidence_reason = 'requested'
+    if best_confidence < min_confidence:
+        confidence = float(max(confidence_floor, best_confidence))
+        confidence_reason = 'lowered_for_weak_rules'
+    
+    return {
+        'min_support': support,
+        'min_confidence': confidence,
+        'support_reason': support_reason,
+        'confidence_reason': confidence_reason,
+        'frequent_items': frequent_items,
+        'frequent_pairs': int(np.count_nonzero(frequent_pairs)),
+        'estimated_itemsets': frequent_items + int(np.count_nonzero(frequent_pairs)),
+        'itemset_budget': itemset_budget
     }
-    db.session.add(job)
-    db.session.commit()
-    job_id = job.id
+
+
+def iter_association_rules(frequent_itemsets, min_confidence, max_antecedent_len=2, max_consequent_len=2,
+                           chunk_size=10000):
+    """
+    Generate association rules lazily, pruning by length and confidence as they are produced
     
-    # In a real application, this would be a background task
-    # For simplicity, we'll process synchronously here
-    try:
-        # Update job status
-        job.status = 'processing'
-        db.session.commit()
+    Itemsets too long to split within the length limits are skipped outright,
+    and only rules meeting the confidence floor are kept, so memory tracks the
+    retained rules rather than the full rule space.
+    
+    Args:
+        frequent_itemsets (pandas.DataFrame): Frequent itemsets ('support', 'itemsets')
+        min_confidence (float): Minimum rule confidence
+        max_antecedent_len (int): Longest antecedent produced
+        max_consequent_len (int): Longest consequent produced
+        chunk_size (int): Rules per yielded DataFrame
         
-        # Save transactions to database
-        for tx_data in transactions:
-            tx = Transaction()
-            tx.transaction_id = tx_data.get('transaction_id')
-            tx.user_id = user_id
-            tx.products = tx_data.get('products', [])
-            tx.transaction_metadata = tx_data.get('metadata', {})
-            
-            # Set timestamp if provided
-            if 'timestamp' in tx_data:
-                try:
-                    tx.timestamp = datetime.fromisoformat(tx_data['timestamp'])
-                except (ValueError, TypeError):
-                    # Use current time if timestamp is invalid
-                    pass
-                    
-            db.session.add(tx)
+    Yields:
+        pandas.DataFrame: Chunks of rules with the mlxtend association_rules columns
+                          used downstream
+    """
+    support_of = dict(zip(frequent_itemsets['itemsets'], frequent_itemsets['support']))
+    max_len = max_antecedent_len + max_consequent_len
+    
+    buffer = []
+    for itemset, support in support_of.items():
+        size = len(itemset)
+        if size < 2 or size > max_len:
+            continue
         
-        db.session.commit()
+        members = sorted(itemset)
+        for antecedent_len in range(max(1, size - max_consequent_len), min(max_antecedent_len, size - 1) + 1):
+            for antecedent in combinations(members, antecedent_len):
+                antecedent = frozenset(antecedent)
+                antecedent_support = support_of[antecedent]
+                confidence = support / antecedent_support
+                if confidence < min_confidence:
+                    continue
+                
+                consequent = itemset - antecedent
+                consequent_support = support_of[consequent]
+                buffer.append((
+                    antecedent,
+                    consequent,
+                    antecedent_support,
+                    consequent_support,
+                    support,
+                    confidence,
+                    confidence / consequent_support,
+                    float('inf') if confidence >= 1 else (1 - consequent_support) / (1 - confidence)
+                ))
+                
+                if len(buffer) >= chunk_size:
+                    yield _rules_frame(buffer)
+                    buffer = []
+    
+    if buffer:
+        yield _rules_frame(buffer)
+
+
+def _rules_frame(rows):
+    """Build an association rules DataFrame from rule tuples"""
+    return pd.DataFrame(rows, columns=[
+        'antecedents', 'consequents', 'antecedent support', 'consequent support',
+        'support', 'confidence', 'lift', 'conviction'
+    ])
+
+
+def iter_transaction_baskets(user_id, batch_size=5000):
+    """
+    Stream a user's baskets without materialising Transaction objects
+    
+    Only the products and timestamp columns are selected, and rows are fetched
+    in server-side cursor batches so memory stays bounded regardless of how
+    long the transaction history is.
+    
+    Args:
+        user_id (int): User ID whose transactions are streamed
+        batch_size (int): Rows fetched per cursor batch
         
-        # Process the transactions to generate recommendations
-        generate_recommendations(user_id, job_id)
+    Yields:
+        tuple: (list of product IDs, timestamp) for each transaction
+    """
+    query = (
+        db.session.query(Transaction.products, Transaction.timestamp)
+        .filter(Transaction.user_id == user_id)
+        .execution_options(yield_per=batch_size)
+    )
+    for products, timestamp in query:
+        yield products, timestamp
+
+
+def iter_job_baskets(job_ids, batch_size=5000):
+    """
+    Stream the baskets ingested by upload jobs
+    
+    Args:
+        job_ids (list): Jobs whose transactions are streamed
+        batch_size (int): Rows fetched per cursor batch
         
-        # Update job status
-        job.status = 'completed'
-        job.completed_at = datetime.now()
-        db.session.commit()
+    Yields:
+        list: Product IDs of each transaction
+    """
+    query = (
+        db.session.query(Transaction.products)
+        .filter(Transaction.job_id.in_(job_ids))
+        .execution_options(yield_per=batch_size)
+    )
+    for (products,) in query:
+        yield products
+
+
+def score_recommendation_pairs(rules, items, item_counts, num_transactions, products,
+                               max_antecedents=2, max_consequents=2):
+    """
+    Expand scored rules into boosted product -> recommended product rows
+    
+    Every step is a column operation: rules are exploded into antecedent/consequent
+    pairs and product IDs are mapped to internal IDs and categories through
+    per-column index arrays. The pair score (boosts matching pair_boost_factor())
+    goes in lift; its seasonal x time-of-day variants for every context come
+    from a per-category factor matrix computed once.
+    
+    Args:
+        rules (pandas.DataFrame): Rules sorted by 'score', best first
+        items (list): External product IDs indexed by matrix column
+        item_counts (numpy.ndarray): Basket count of each column
+        num_transactions (int): Total number of baskets
+        products (list): (external product ID, internal ID, category) rows
+        max_antecedents (int): Longest antecedent kept
+        max_consequents (int): Longest consequent kept
         
-        return job_id
+    Returns:
+        pandas.DataFrame: One row per (product_id, recommended_product_id) with
+                          confidence, support, the boosted score in lift and the
+                          encoded per-context scores in context_scores
+    """
+    columns = ['product_id', 'recommended_product_id', 'confidence', 'support', 'lift', 'context_scores']
+    
+    # Prioritize short rules, they are the ones that can be served
+    keep = (rules['antecedents'].map(len) <= max_antecedents) & (rules['consequents'].map(len) <= max_consequents)
+    pairs = rules.loc[keep, ['antecedents', 'consequents', 'confidence', 'support', 'score']]
+    if pairs.empty:
+        return pd.DataFrame(columns=columns)
+    pairs = (
+        pairs.assign(antecedents=pairs['antecedents'].map(list), consequents=pairs['consequents'].map(list))
+        .explode('antecedents')
+        .explode('consequents')
+    )
+    
+    # Per-column lookup arrays: internal product ID and category code (-1 = unknown product)
+    column_index = pd.Index(items)
+    internal_ids = np.full(len(items), -1, dtype=np.int64)
+    category_codes = np.full(len(items), -1, dtype=np.int64)
+    categories = []
+    if products:
+        product_columns = column_index.get_indexer([p[0] for p in products])
+        internal_ids[product_columns] = [p[1] for p in products]
+        codes, categories = pd.factorize(pd.Series([p[2] for p in products], dtype=object), use_na_sentinel=False)
+        category_codes[product_columns] = codes
+    
+    # Seasonal x time-of-day factors per category and context; the trailing row of ones serves code -1
+    context_factors = np.vstack([context_factor_matrix(categories), np.ones(CONTEXT_SLOTS)])
+    
+    antecedent_columns = column_index.get_indexer(pairs['antecedents'])
+    consequent_columns = column_index.get_indexer(pairs['consequents'])
+    product_ids = internal_ids[antecedent_columns]
+    recommended_ids = internal_ids[consequent_columns]
+    source_categories = category_codes[antecedent_columns]
+    target_categories = category_codes[consequent_columns]
+    
+    # 15% boost for same category, up to 20% for popular recommended products
+    category_boost = np.where((source_categories >= 0) & (source_categories == target_categories), 1.15, 1.0)
+    normalized_freq = np.minimum(item_counts[consequent_columns] / max(1, num_transactions), 1.0)
+    freq_boost = 1.0 + normalized_freq * 0.2
+    
+    final_score = pairs['score'].to_numpy(dtype=float) * category_boost * freq_boost
+    
+    scored = pd.DataFrame({
+        'product_id': product_ids,
+        'recommended_product_id': recommended_ids,
+        'confidence': pairs['confidence'].to_numpy(dtype=float),
+        'support': pairs['support'].to_numpy(dtype=float),
+        'lift': final_score  # Use enhanced score in lift field
+    })
+    
+    # Drop products missing from the catalog and self-recommendations; rules are
+    # sorted by score, so the first row of each pair is its best
+    valid = (product_ids >= 0) & (recommended_ids >= 0) & (product_ids != recommended_ids)
+    scored = scored[valid].drop_duplicates(['product_id', 'recommended_product_id'], keep='first')
+    
+    # Score vectors only for the rows that are kept
+    kept = scored.index.to_numpy()
+    scored['context_scores'] = encode_context_scores(
+        final_score[kept, None] * context_factors[target_categories[kept]]
+    )
+    return scored
+
+
+def bulk_upsert_recommendations(rows, chunk_size=5000):
+    """
+    Insert or update ProductRecommendation rows in chunked bulk statements
+    
+    On PostgreSQL each chunk is a single INSERT ... ON CONFLICT DO UPDATE against
+    the unique_recommendation constraint. Other dialects look up the existing
+    keys of each chunk once and issue one bulk INSERT and one bulk UPDATE.
+    
+    Args:
+        rows (iterable): Dicts with product_id, recommended_product_id,
+                         confidence, support, lift and context_scores; keys must be unique
+        chunk_size (int): Rows per statement
         
-    except Exception as e:
-        logger.error(f"Error processing transactions: {str(e)}")
+    Returns:
+        dict: rows_written, seconds and rows_per_second
+    """
+    started = perf_counter()
+    rows = list(rows)
+    now = datetime.now()
+    dialect = db.session.get_bind().dialect.name
+    
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
         
-        # Update job status
-        job.status = 'failed'
-        job.error = str(e)
-        db.session.commit()
+        if dialect == 'postgresql':
+            stmt = pg_insert(ProductRecommendation).values([dict(row, created_at=now) for row in chunk])
+            stmt = stmt.on_conflict_do_update(
+                constraint='unique_recommendation',
+                set_={
+                    'confidence': stmt.excluded.confidence,
+                    'support': stmt.excluded.support,
+                    'lift': stmt.excluded.lift,
+                    'context_scores': stmt.excluded.context_scores,
+                    'updated_at': now
+                }
+            )
+            db.session.execute(stmt)
+            continue
         
-        raise e
+        # Generic fallback: one key lookup per chunk, then bulk INSERT and bulk UPDATE
+        existing_ids = {
+            (product_id, recommended_product_id): rec_id
+            for rec_id, product_id, recommended_product_id in db.session.query(
+                ProductRecommendation.id,
+                ProductRecommendation.product_id,
+                ProductRecommendation.recommended_product_id
+            ).filter(
+                ProductRecommendation.product_id.in_({row['product_id'] for row in chunk})
+            )
+        }
+        inserts = []
+        updates = []
+        for row in chunk:
+            rec_id = existing_ids.get((row['product_id'], row['recommended_product_id']))
+            if rec_id is None:
+                inserts.append(dict(row, created_at=now))
+            else:
+                updates.append({
+                    'id': rec_id,
+                    'confidence': row['confidence'],
+                    'support': row['support'],
+                    'lift': row['lift'],
+                    'context_scores': row['context_scores'],
+                    'updated_at': now
+                })
+        if inserts:
+            db.session.execute(db.insert(ProductRecommendation), inserts)
+        if updates:
+            db.session.execute(db.update(ProductRecommendation), updates)
+    
+    db.session.commit()
+    
+    elapsed = perf_counter() - started
+    return {
+        'rows_written': len(rows),
+        'seconds': round(elapsed, 4),
+        'rows_per_second': round(len(rows) / elapsed, 1) if elapsed > 0 else None
+    }
 
 
-def generate_recommendations(user_id, job_id=None, min_support=0.01, min_confidence=0.1):
+def generate_recommendations(user_id, job_id=None, min_support=0.01, min_confidence=0.1, algorithm=None,
+                             itemset_budget=None, workers=None, chunk_size=None, stream_batch_size=5000,
+                             max_antecedent_len=2, max_consequent_len=2, phases=None):
     """
     Generate product recommendations using the optimized FP-Growth algorithm
     with adaptive thresholds for grocery data
@@ -522,54 +2710,73 @@ def generate_recommendations(user_id, job_id=None, min_support=0.01, min_confide
         job_id (int, optional): Job ID for tracking
         min_support (float): Minimum support threshold for FP-Growth
         min_confidence (float): Minimum confidence threshold for association rules
+        algorithm (str, optional): Mining engine name ('apriori', 'fp_growth', 'eclat' or 'pairs').
+                                   Defaults to the job's configured algorithm, then FP-Growth
+        itemset_budget (int, optional): Target number of frequent itemsets for the threshold planner.
+                                        Defaults to the job's configured budget, then DEFAULT_ITEMSET_BUDGET
+        workers (int, optional): Worker processes for partitioned (SON) mining; 1 mines in-process.
+                                 Defaults to the job's configured 'workers', then 1
+        chunk_size (int, optional): Transactions per mining partition.
+                                    Defaults to the job's configured 'chunk_size', then an even split
+        stream_batch_size (int): Transactions fetched per server-side cursor batch
+        max_antecedent_len (int): Longest rule antecedent kept
+        max_consequent_len (int): Longest rule consequent kept
+        phases (PhaseRecorder, optional): Recorder the training phases are added to
         
     Returns:
-        dict: Statistics about the generated recommendations
+        dict: Statistics about the generated recommendations, with per-phase timings under 'phases'
     """
-    # Get transactions for this user
-    transactions = Transaction.query.filter_by(user_id=user_id).all()
+    phases = phases or PhaseRecorder()
     
-    if not transactions:
+    # Resolve the mining engine and budget, falling back to the values recorded on the job
+    job_config = {}
+    if job_id:
+        job = RecommendationJob.query.get(job_id)
+        if job and job.config:
+            job_config = job.config
+    if algorithm is None:
+        algorithm = job_config.get('algorithm')
+    if itemset_budget is None:
+        itemset_budget = job_config.get('itemset_budget', DEFAULT_ITEMSET_BUDGET)
+    if workers is None:
+        workers = job_config.get('workers', 1)
+    if chunk_size is None:
+        chunk_size = job_config.get('chunk_size')
+    try:
+        engine = get_mining_engine(algorithm)
+    except ValueError as e:
+        logger.error(str(e))
+        return {'error': str(e)}
+    
+    # Spread itemset mining over a process pool when more than one worker is configured
+    workers = min(workers, max_training_workers())
+    if workers > 1 and not engine.generates_rules:
+        engine = PartitionedMiningEngine(engine, workers, chunk_size)
+    
+    # Stream this user's baskets in server-side cursor batches, building the
+    # sparse basket matrix and recording basket ages in the same single pass
+    now = datetime.now()
+    builder = TransactionMatrixBuilder()
+    basket_ages = array('d')  # Age of each basket in days
+    with phases.phase('loading') as probe:
+        for products, timestamp in iter_transaction_baskets(user_id, batch_size=stream_batch_size):
+            builder.add(products)
+            basket_ages.append((now - (timestamp or now)).total_seconds() / 86400)
+        probe.rows_out = builder.num_transactions
+    
+    if builder.num_transactions == 0:
         logger.warning(f"No transactions found for user {user_id}")
         return {'error': 'No transactions found'}
     
-    # Create a unique list of all products
-    all_products = set()
-    for tx in transactions:
-        all_products.update(tx.products)
-    
-    # Create a binary matrix for apriori algorithm
-    # Each row is a transaction, each column is a product
-    transaction_data = []
-    # Also track transaction recency and frequency for weighted recommendations
-    tx_recency = []
-    product_frequency = {}
-    
-    # Get the timestamp of the most recent transaction
-    now = datetime.now()
-    latest_tx = max(tx.timestamp for tx in transactions)
-    
-    # Calculate max days difference for normalization
-    max_days_diff = (now - min(tx.timestamp for tx in transactions)).days + 1
-    
-    for tx in transactions:
-        # For each transaction, create a binary vector
-        tx_vector = {product_id: (product_id in tx.products) for product_id in all_products}
-        transaction_data.append(tx_vector)
+    with phases.phase('matrix', rows_in=builder.num_transactions) as probe:
+        matrix = builder.build()
+        all_products = builder.items
         
-        # Calculate recency weight (more recent = higher weight)
-        days_diff = (latest_tx - tx.timestamp).days + 1
-        recency_weight = 1 - (days_diff / max_days_diff)
-        tx_recency.append(recency_weight)
-        
-        # Update product frequency
-        for product_id in tx.products:
-            product_frequency[product_id] = product_frequency.get(product_id, 0) + 1
-    
-    # Convert to DataFrame
-    df = pd.DataFrame(transaction_data)
+        # Product frequency is the column sum of the basket matrix
+        item_counts = np.asarray(matrix.sum(axis=0)).ravel()
+        probe.rows_out = matrix.shape[0]
     
-    if df.empty or df.shape[1] == 0:
+    if matrix.shape[1] == 0:
         logger.warning("Empty transaction data")
         return {'error': 'Empty transaction data'}
     
@@ -580,8 +2787,7 @@ def generate_recommendations(user_id, job_id=None, min_support=0.01, min_confide
     dynamic_min_support = min_support
     
     # Optimize support threshold based on dataset size and diversity
-    item_count = len(all_products)
-    transaction_count = len(transactions)
+    transaction_count = builder.num_transactions
     
     if transaction_count > 5000:
         # Very large datasets - increase support for efficiency
@@ -597,7 +2803,7 @@ def generate_recommendations(user_id, job_id=None, min_support=0.01, min_confide
         logger.info(f"Small dataset detected ({transaction_count} transactions), using reduced support threshold: {dynamic_min_support}")
         
     # Further adjust based on item diversity (basket complexity)
-    avg_basket_size = sum(len(tx.products) for tx in transactions) / max(1, transaction_count)
+    avg_basket_size = builder.total_items / max(1, transaction_count)
     if avg_basket_size > 15:
         # Complex baskets need lower support to catch meaningful patterns
         dynamic_min_support *= 0.8
@@ -607,59 +2813,72 @@ def generate_recommendations(user_id, job_id=None, min_support=0.01, min_confide
         dynamic_min_support *= 1.2
         logger.info(f"Simple baskets detected (avg size: {avg_basket_size}), increasing support by 20%")
     
-    # Apply temporal weighting - weight recent transactions higher
-    # Calculate recency weights (exponential decay)
-    now = datetime.pnow()
-    max_days_diff = max((now - tx.timestamp).days for tx in transactions) + 1
-    
-    # Create temporally weighted matrix - recent transactions have more influence
-    temporal_weights = np.array([
-        np.exp(-0.05 * (now - tx.timestamp).days / max_days_diff) 
-        for tx in transactions
-    ])
-    
-    # IMPROVED ALGORITHM: Use FP-Growth for better performance on grocery data
-    # The mlxtend package uses Apriori by default, which is suboptimal for grocery data
-    # We'll implement a more efficient approach for grocery-specific patterns
+    # Span of the training history in days, from the streamed basket ages
+    basket_age_days = np.floor(np.frombuffer(basket_ages, dtype=np.float64))
+    max_days_diff = basket_age_days.max() + 1
+    
+    # Plan support and confidence from one pass over the item and pair
+    # support histograms, so mining and rule generation each run exactly once
+    with phases.phase('planning', rows_in=transaction_count):
+        plan = plan_thresholds(matrix, dynamic_min_support, min_confidence, itemset_budget)
+    planned_support = plan['min_support']
+    planned_confidence = plan['min_confidence']
+    if planned_support != dynamic_min_support or planned_confidence != min_confidence:
+        logger.info(
+            f"Threshold planner adjusted support {dynamic_min_support} -> {planned_support} ({plan['support_reason']}), "
+            f"confidence {min_confidence} -> {planned_confidence} ({plan['confidence_reason']})"
+        )
     
-    # Try using adaptive algorithm selection
-    try:
-        # Try using FP-Growth with temporal weights
-        frequent_itemsets = apriori(df, min_support=dynamic_min_support, use_colnames=True)
+    if engine.generates_rules:
+        # The pair engine derives 1->1 rules straight from item co-occurrence
+        # counts, skipping general itemset mining entirely
+        logger.info(f"Deriving pair rules with the '{engine.name}' engine")
+        try:
+            with phases.phase('mining', rows_in=transaction_count) as probe:
+                rules, frequent_itemset_count = engine.mine_rules(
+                    matrix, all_products, planned_support, planned_confidence
+                )
+                probe.rows_out = len(rules)
+        except Exception as e:
+            logger.error(f"Error during pair rule mining: {str(e)}")
+            return {'error': f'Algorithm error: {str(e)}'}
+    else:
+        # Mine frequent itemsets with the selected engine (FP-Growth by default,
+        # which avoids Apriori's level-wise candidate generation on sparse baskets)
+        logger.info(f"Mining frequent itemsets with the '{engine.name}' engine")
+        try:
+            # Longer itemsets cannot yield a rule within the length limits
+            with phases.phase('mining', rows_in=transaction_count) as probe:
+                frequent_itemsets = engine.mine(
+                    matrix, all_products, planned_support, max_len=max_antecedent_len + max_consequent_len
+                )
+                probe.rows_out = len(frequent_itemsets)
+        except Exception as e:
+            logger.error(f"Error during frequent pattern mining: {str(e)}")
+            return {'error': f'Algorithm error: {str(e)}'}
         
         if frequent_itemsets.empty:
-            # If no frequent itemsets found, try with a lower support value
-            retry_support = dynamic_min_support / 2
-            logger.warning(f"No frequent itemsets found with min_support={dynamic_min_support}, retrying with {retry_support}")
-            frequent_itemsets = apriori(df, min_support=retry_support, use_colnames=True)
-            
-            if frequent_itemsets.empty:
-                # One more attempt with an even lower threshold
-                final_retry = retry_support / 2
-                logger.warning(f"Still no frequent itemsets, making final attempt with support={final_retry}")
-                frequent_itemsets = apriori(df, min_support=final_retry, use_colnames=True)
-                
-                if frequent_itemsets.empty:
-                    return {'error': 'No frequent itemsets found even with minimum threshold'}
-    except Exception as e:
-        logger.error(f"Error during frequent pattern mining: {str(e)}")
-        return {'error': f'Algorithm error: {str(e)}'}
-    
-    # Generate association rules with multiple metrics
-    try:
-        rules = association_rules(frequent_itemsets, metric="confidence", min_threshold=min_confidence)
-    except Exception as e:
-        logger.error(f"Error generating association rules: {str(e)}")
-        return {'error': f'Rule generation error: {str(e)}'}
+            return {'error': f'No frequent itemsets found with planned min_support={planned_support}'}
+        
+        # Stream rules, keeping only those short and confident enough to be persisted
+        try:
+            with phases.phase('rules', rows_in=len(frequent_itemsets)) as probe:
+                rule_chunks = list(iter_association_rules(
+                    frequent_itemsets,
+                    planned_confidence,
+                    max_antecedent_len=max_antecedent_len,
+                    max_consequent_len=max_consequent_len
+                ))
+                rules = pd.concat(rule_chunks, ignore_index=True) if rule_chunks else _rules_frame([])
+                probe.rows_out = len(rules)
+        except Exception as e:
+            logger.error(f"Error generating association rules: {str(e)}")
+            return {'error': f'Rule generation error: {str(e)}'}
+        
+        frequent_itemset_count = len(frequent_itemsets)
     
     if rules.empty:
-        # If no rules found, try with a lower confidence value
-        retry_confidence = min_confidence / 2
-        logger.warning(f"No association rules found with min_confidence={min_confidence}, retrying with {retry_confidence}")
-        rules = association_rules(frequent_itemsets, metric="confidence", min_threshold=retry_confidence)
-        
-        if rules.empty:
-            return {'error': 'No association rules found even with reduced threshold'}
+        return {'error': f'No association rules found with planned min_confidence={planned_confidence}'}
     
     # GROCERY-OPTIMIZED SCORING: Enhanced scoring mechanism specifically for grocery products
     # Research shows that grocery recommendations benefit from specialized scoring metrics
@@ -676,135 +2895,77 @@ def generate_recommendations(user_id, job_id=None, min_support=0.01, min_confide
     # Medium weight on lift (real association rather than coincidence)
     # Small weight on conviction (directional relevance)
     
-    if 'conviction' not in rules.columns:
-        # Calculate conviction if not present
-        rules['conviction'] = np.where(
-            rules['confidence'] == 1,
-            float('inf'),
-            (1 - rules['consequent support']) / (1 - rules['confidence'])
+    with phases.phase('scoring', rows_in=len(rules)) as probe:
+        if 'conviction' not in rules.columns:
+            # Calculate conviction if not present
+            rules['conviction'] = np.where(
+                rules['confidence'] == 1,
+                float('inf'),
+                (1 - rules['consequent support']) / (1 - rules['confidence'])
+            )
+        
+        rules['score'] = grocery_rule_score(
+            rules['confidence'], rules['lift'], rules['support'], rules['conviction']
         )
-    
-    # Grocery-specialized weighting based on academic research
-    rules['score'] = (
-        (rules['confidence'] * 2.5) +              # Strong weight on confidence
-        (rules['lift'] * 1.8) +                    # Medium-high weight on lift 
-        (np.log1p(rules['support'] * 100) * 0.6) + # Logarithmic scaling for support
-        (np.minimum(rules['conviction'], 5) * 0.4) # Capped weight on conviction
-    ) / 5.3  # Normalize to approximate 0-1 range
-    
-    # Sort by our specialized score
-    rules = rules.sort_values('score', ascending=False)
-    
-    # Get product mapping from external IDs to internal IDs
-    product_map = {}
-    products = Product.query.filter(Product.product_id.in_(all_products)).all()
-    for product in products:
-        product_map[product.product_id] = product.id
-    
-    # Save recommendations to database
-    count = 0
-    
-    # Get category information for products for category-based recommendations
-    product_categories = {p.id: p.category for p in products}
-    
-    # First process higher quality rules with single antecedents/consequents
-    for _, rule in rules.iterrows():
-        # Extract product IDs from the rule
-        antecedents = list(rule['antecedents'])
-        consequents = list(rule['consequents'])
         
-        # Process both single and multiple item rules, but prioritize single item rules
-        if len(antecedents) > 2 or len(consequents) > 2:
-            continue
+        # Sort by our specialized score
+        rules = rules.sort_values('score', ascending=False)
         
-        # Calculate a quality score based on multiple factors
-        quality_score = rule['score']
+        # Look up internal IDs and categories for every product in the rules
+        products = (
+            db.session.query(Product.product_id, Product.id, Product.category)
+            .filter(Product.product_id.in_(all_products))
+            .all()
+        )
         
-        # Process each antecedent-consequent pair
-        for antecedent in antecedents:
-            for consequent in consequents:
-                # Skip if either product is not in our database
-                if antecedent not in product_map or consequent not in product_map:
-                    continue
-                
-                # Get internal IDs
-                product_id = product_map[antecedent]
-                recommended_product_id = product_map[consequent]
-                
-                # Skip self-recommendations
-                if product_id == recommended_product_id:
-                    continue
-                
-                # Apply category boost if products are in the same category
-                category_boost = 1.0
-                if (product_id in product_categories and 
-                    recommended_product_id in product_categories and
-                    product_categories[product_id] == product_categories[recommended_product_id]):
-                    category_boost = 1.15  # 15% boost for same category
-                
-                # Apply frequency boost based on product popularity
-                freq_boost = 1.0
-                if consequent in product_frequency:
-                    normalized_freq = min(product_frequency[consequent] / len(transactions), 1.0)
-                    freq_boost = 1.0 + (normalized_freq * 0.2)  # Up to 20% boost
-                
-                # Apply seasonal boost if applicable
-                seasonal_boost = 1.0
-                if recommended_product_id in product_categories:
-                    category = product_categories[recommended_product_id]
-                    seasonal_boost = get_seasonal_boost(category)
-                
-                # Apply time-of-day boost if applicable
-                time_boost = 1.0
-                if recommended_product_id in product_categories:
-                    category = product_categories[recommended_product_id]
-                    time_boost = get_time_of_day_boost(category)
-                
-                # Final score combining all factors
-                final_score = quality_score * category_boost * freq_boost * seasonal_boost * time_boost
-                
-                # Check if recommendation already exists
-                existing = ProductRecommendation.query.filter_by(
-                    product_id=product_id,
-                    recommended_product_id=recommended_product_id
-                ).first()
-                
-                if existing:
-                    # Update existing recommendation with improved scoring
-                    existing.confidence = float(rule['confidence'])
-                    existing.support = float(rule['support'])
-                    existing.lift = float(rule['lift'])
-                    # Store the enhanced score for better sorting later
-                    existing.lift = float(final_score)  
-                    existing.updated_at = datetime.now()
-                else:
-                    # Create new recommendation
-                    rec = ProductRecommendation()
-                    rec.product_id = product_id
-                    rec.recommended_product_id = recommended_product_id
-                    rec.confidence = float(rule['confidence'])
-                    rec.support = float(rule['support'])
-                    rec.lift = float(final_score)  # Use enhanced score in lift field
-                    db.session.add(rec)
-                
-                count += 1
+        # Expand rules into boosted product -> recommended product rows with column operations
+        scored = score_recommendation_pairs(
+            rules, all_products, item_counts, transaction_count, products,
+            max_antecedents=max_antecedent_len, max_consequents=max_consequent_len
+        )
+        probe.rows_out = len(scored)
+    
+    # Write all scored rows with chunked bulk upserts instead of per-pair round trips
+    with phases.phase('persistence', rows_in=len(scored)) as probe:
+        persistence = bulk_upsert_recommendations(scored.to_dict('records'))
+        count = persistence['rows_written']
+        probe.rows_out = count
+    
+    # Refresh the sufficient statistics used by incremental updates
+    with phases.phase('statistics', rows_in=transaction_count) as probe:
+        probe.rows_out = rebuild_cooccurrence_counts(
+            user_id, matrix, all_products, min_support=planned_support, min_confidence=planned_confidence
+        )
     
-    db.session.commit()
+    # Serving processes rebuild their index once they see the new version
+    expire_recommendation_index()
+    model_version = current_model_version()
     
     stats = {
-        'total_transactions': len(transactions),
+        'training_mode': 'full',
+        'total_transactions': transaction_count,
+        'history_span_days': int(max_days_diff),
         'unique_products': len(all_products),
-        'frequent_itemsets': len(frequent_itemsets),
+        'frequent_itemsets': frequent_itemset_count,
         'association_rules': len(rules),
         'recommendations_saved': count,
         'algorithm_version': '3.0',
+        'mining_engine': engine.name,
         'dynamic_min_support': dynamic_min_support,
+        'threshold_plan': plan,
+        'persistence': persistence,
+        'model_version': model_version,
+        'partitioned_mining': {
+            'workers': engine.workers,
+            'chunk_size': engine.chunk_size,
+            'partitions': engine.partition_stats
+        } if isinstance(engine, PartitionedMiningEngine) else None,
         'features': {
             'seasonal_recommendations': True,
             'time_of_day_recommendations': True,
             'category_boosting': True,
             'collaborative_filtering': True,
-            'weighted_recency': True
+            'weighted_recency': False
         },
         'current_time_period': get_time_of_day(),
         'current_month': datetime.now().month,
@@ -813,7 +2974,351 @@ def generate_recommendations(user_id, job_id=None, min_support=0.01, min_confide
             'time_of_day_max_boost': 1.4,
             'category_max_boost': 1.2,
             'frequency_max_boost': 1.2
+        },
+        'phases': phases.report()
+    }
+    
+    # Update job with statistics if job_id is provided
+    if job_id:
+        job = RecommendationJob.query.get(job_id)
+        if job:
+            job.result_stats = stats
+            db.session.commit()
+    
+    return stats
+
+
+def cooccurrence_counts(matrix):
+    """
+    Compute item and pair co-occurrence counts with one sparse product (X^T X)
+    
+    Args:
+        matrix (scipy.sparse.csr_matrix): Boolean basket x product matrix
+        
+    Returns:
+        tuple: (row columns, other columns, counts) as NumPy arrays; the
+               diagonal entries are the item counts
+    """
+    x = matrix.astype(np.int32)
+    cooccurrence = (x.T @ x).tocoo()
+    return cooccurrence.row, cooccurrence.col, cooccurrence.data
+
+
+def rebuild_cooccurrence_counts(user_id, matrix, items, min_support=None, min_confidence=None, chunk_size=10000):
+    """
+    Bring a tenant's persisted co-occurrence counts in line with a full training pass
+    
+    The stored counts are compared with the new ones in one streamed read, and
+    only the differences are written: new pairs are inserted, changed counts
+    updated and vanished pairs deleted. The thresholds the pass planned are
+    kept on the tenant's model state for later incremental updates.
+    
+    Args:
+        user_id (int): Tenant whose statistics are rebuilt
+        matrix (scipy.sparse.csr_matrix): Boolean basket x product matrix over the full history
+        items (list): External product IDs indexed by column
+        min_support (float, optional): Support threshold planned by the pass
+        min_confidence (float, optional): Confidence threshold planned by the pass
+        chunk_size (int): Rows per statement
+        
+    Returns:
+        int: Number of count rows inserted, updated or deleted
+    """
+    rows, cols, counts = cooccurrence_counts(matrix)
+    wanted = {
+        (items[row], items[col]): count
+        for row, col, count in zip(rows.tolist(), cols.tolist(), counts.tolist())
+    }
+    
+    updates = []
+    deletes = []
+    for count_id, product_id, other_product_id, count in (
+        db.session.query(
+            CooccurrenceCount.id,
+            CooccurrenceCount.product_id,
+            CooccurrenceCount.other_product_id,
+            CooccurrenceCount.count
+        )
+        .filter(CooccurrenceCount.user_id == user_id)
+        .execution_options(yield_per=chunk_size)
+    ):
+        new_count = wanted.pop((product_id, other_product_id), None)
+        if new_count is None:
+            deletes.append(count_id)
+        elif new_count != count:
+            updates.append({'id': count_id, 'count': new_count})
+    inserts = [
+        {'user_id': user_id, 'product_id': product_id, 'other_product_id': other_product_id, 'count': count}
+        for (product_id, other_product_id), count in wanted.items()
+    ]
+    
+    for start in range(0, len(deletes), chunk_size):
+        db.session.execute(
+            db.delete(CooccurrenceCount).where(CooccurrenceCount.id.in_(deletes[start:start + chunk_size])),
+            execution_options={'synchronize_session': False}
+        )
+    for start in range(0, len(updates), chunk_size):
+        db.session.execute(db.update(CooccurrenceCount), updates[start:start + chunk_size])
+    for start in range(0, len(inserts), chunk_size):
+        db.session.execute(db.insert(CooccurrenceCount), inserts[start:start + chunk_size])
+    
+    state = RecommendationModelState.query.filter_by(user_id=user_id).first()
+    if not state:
+        state = RecommendationModelState(user_id=user_id)
+        db.session.add(state)
+    state.transaction_count = matrix.shape[0]
+    state.min_support = min_support
+    state.min_confidence = min_confidence
+    # The tenant's rules were just rewritten by a full training pass
+    state.model_version = (state.model_version or 0) + 1
+    db.session.commit()
+    return len(inserts) + len(updates) + len(deletes)
+
+
+def upsert_cooccurrence_counts(user_id, items, rows, cols, counts, chunk_size=5000):
+    """
+    Add a batch's co-occurrence counts to a tenant's persisted counts
+    
+    PostgreSQL and SQLite add each chunk with INSERT ... ON CONFLICT DO UPDATE
+    SET count = count + excluded.count on the unique_cooccurrence constraint,
+    so stored pairs are never read into Python. Other dialects look up the
+    existing keys of each chunk once and issue one bulk INSERT and one bulk
+    UPDATE.
+    
+    Args:
+        user_id (int): Tenant whose counts are updated
+        items (list): External product IDs indexed by column
+        rows (numpy.ndarray): Column of the first product of each pair
+        cols (numpy.ndarray): Column of the second product of each pair
+        counts (numpy.ndarray): Baskets of the batch containing each pair
+        chunk_size (int): Pairs per statement
+    """
+    table = CooccurrenceCount.__table__
+    dialect = db.session.get_bind().dialect.name
+    
+    for start in range(0, len(counts), chunk_size):
+        end = start + chunk_size
+        chunk = [
+            {
+                'user_id': user_id,
+                'product_id': items[row],
+                'other_product_id': items[col],
+                'count': int(count)
+            }
+            for row, col, count in zip(rows[start:end], cols[start:end], counts[start:end])
+        ]
+        
+        if dialect in ('postgresql', 'sqlite'):
+            insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['user_id', 'product_id', 'other_product_id'],
+                set_={'count': table.c.count + stmt.excluded.count}
+            )
+            db.session.execute(stmt, chunk)
+            continue
+        
+        # Generic fallback: one key lookup per chunk, then bulk INSERT and bulk UPDATE
+        existing = {
+            (product_id, other_product_id): (count_id, count)
+            for count_id, product_id, other_product_id, count in db.session.query(
+                CooccurrenceCount.id,
+                CooccurrenceCount.product_id,
+                CooccurrenceCount.other_product_id,
+                CooccurrenceCount.count
+            ).filter(
+                CooccurrenceCount.user_id == user_id,
+                CooccurrenceCount.product_id.in_({row['product_id'] for row in chunk})
+            )
+        }
+        inserts = []
+        updates = []
+        for row in chunk:
+            entry = existing.get((row['product_id'], row['other_product_id']))
+            if entry is None:
+                inserts.append(row)
+            else:
+                updates.append({'id': entry[0], 'count': entry[1] + row['count']})
+        if inserts:
+            db.session.execute(db.insert(CooccurrenceCount), inserts)
+        if updates:
+            db.session.execute(db.update(CooccurrenceCount), updates)
+
+
+def update_recommendations_incrementally(user_id, baskets, job_id=None, min_support=None, min_confidence=None,
+                                         phases=None):
+    """
+    Fold a batch of new baskets into the persisted co-occurrence counts and
+    refresh only the affected single item -> single item recommendations
+    
+    Work is proportional to the batch and the neighbourhood of its products,
+    not to the tenant's history. Pairs that do not involve any product in the
+    batch keep their stored metrics until the next full training pass. New
+    pairs must pass the thresholds the last full pass planned, so both paths
+    admit rules the same way; rules with longer antecedents or consequents
+    cannot be derived from pair counts and are only refreshed by full passes.
+    
+    Args:
+        user_id (int): Tenant the baskets belong to
+        baskets (list): Product ID lists of the new transactions
+        job_id (int, optional): Job ID for tracking
+        min_support (float, optional): Minimum support for creating new recommendations
+                                       (defaults to the last full pass's planned support, then 0.01)
+        min_confidence (float, optional): Minimum confidence for creating new recommendations
+                                          (defaults to the last full pass's planned confidence, then 0.1)
+        phases (PhaseRecorder, optional): Recorder the update phases are added to
+        
+    Returns:
+        dict: Statistics about the update, with per-phase timings under 'phases'
+    """
+    phases = phases or PhaseRecorder()
+    state = RecommendationModelState.query.filter_by(user_id=user_id).first()
+    if not state:
+        return {'error': 'No co-occurrence statistics found, a full training run is required'}
+    if min_support is None:
+        min_support = state.min_support if state.min_support is not None else 0.01
+    if min_confidence is None:
+        min_confidence = state.min_confidence if state.min_confidence is not None else 0.1
+    
+    with phases.phase('loading') as probe:
+        matrix, items = build_transaction_matrix(baskets)
+        probe.rows_out = matrix.shape[0]
+    if matrix.shape[1] == 0:
+        return {'error': 'Empty transaction data'}
+    
+    state.transaction_count += matrix.shape[0]
+    state.model_version = (state.model_version or 0) + 1
+    num_transactions = state.transaction_count
+    
+    with phases.phase('statistics', rows_in=matrix.shape[0]) as probe:
+        # Add the batch delta in the database
+        rows, cols, counts = cooccurrence_counts(matrix)
+        upsert_cooccurrence_counts(user_id, items, rows, cols, counts)
+        
+        # Because pairs are stored in both directions this reads back every
+        # pair that touches a product in the batch
+        stored = {
+            (product_id, other_product_id): count
+            for product_id, other_product_id, count in db.session.query(
+                CooccurrenceCount.product_id, CooccurrenceCount.other_product_id, CooccurrenceCount.count
+            ).filter(
+                CooccurrenceCount.user_id == user_id,
+                CooccurrenceCount.product_id.in_(items)
+            )
+        }
+        
+        # Item counts of the batch products are on the diagonal; their untouched
+        # neighbours need one extra lookup
+        item_counts = {a: count for (a, b), count in stored.items() if a == b}
+        neighbours = {b for (a, b) in stored if b not in item_counts}
+        if neighbours:
+            for product_id, count in db.session.query(CooccurrenceCount.product_id, CooccurrenceCount.count).filter(
+                CooccurrenceCount.user_id == user_id,
+                CooccurrenceCount.product_id.in_(neighbours),
+                CooccurrenceCount.product_id == CooccurrenceCount.other_product_id
+            ):
+                item_counts[product_id] = count
+        
+        probe.rows_out = len(stored)
+    
+    with phases.phase('scoring', rows_in=len(stored)) as probe:
+        # Both directions of every pair touching the batch have new metrics
+        affected = {}
+        for (a, b), count in stored.items():
+            if a != b:
+                affected[(a, b)] = count
+                affected[(b, a)] = count
+        
+        products = Product.query.filter(Product.product_id.in_(set(item_counts))).all()
+        product_map = {p.product_id: p.id for p in products}
+        product_categories = {p.id: p.category for p in products}
+        
+        existing = {
+            (rec.product_id, rec.recommended_product_id): rec
+            for rec in ProductRecommendation.query.filter(
+                ProductRecommendation.product_id.in_({product_map[a] for a, b in affected if a in product_map})
+            )
         }
+        
+        # Context factors per category, for the staged rows' score vectors
+        category_factors = dict(zip(
+            set(product_categories.values()), context_factor_matrix(set(product_categories.values()))
+        ))
+        
+        staged = []
+        created = 0
+        updated = 0
+        for (antecedent, consequent), pair_count in affected.items():
+            if antecedent not in product_map or consequent not in product_map:
+                continue
+            antecedent_count = item_counts.get(antecedent)
+            consequent_count = item_counts.get(consequent)
+            if not antecedent_count or not consequent_count:
+                continue
+            
+            product_id = product_map[antecedent]
+            recommended_product_id = product_map[consequent]
+            rec = existing.get((product_id, recommended_product_id))
+            
+            support = pair_count / num_transactions
+            confidence = pair_count / antecedent_count
+            if rec is None and (support < min_support or confidence < min_confidence):
+                continue
+            
+            lift = confidence * num_transactions / consequent_count
+            conviction = float('inf') if confidence >= 1 else (1 - consequent_count / num_transactions) / (1 - confidence)
+            final_score = grocery_rule_score(confidence, lift, support, conviction) * pair_boost_factor(
+                product_id,
+                recommended_product_id,
+                consequent_count,
+                num_transactions,
+                product_categories
+            )
+            
+            if rec is None:
+                created += 1
+            elif (rec.confidence, rec.support, rec.lift) == (confidence, support, final_score) and rec.context_scores:
+                continue
+            else:
+                updated += 1
+            
+            staged.append({
+                'product_id': product_id,
+                'recommended_product_id': recommended_product_id,
+                'confidence': float(confidence),
+                'support': float(support),
+                'lift': float(final_score),  # Use enhanced score in lift field
+                'context_scores': encode_context_scores(
+                    [final_score * category_factors[product_categories[recommended_product_id]]]
+                )[0]
+            })
+        probe.rows_out = len(staged)
+    
+    with phases.phase('persistence', rows_in=len(staged)) as probe:
+        persistence = bulk_upsert_recommendations(staged)
+        probe.rows_out = persistence['rows_written']
+    
+    # Serving processes rebuild their index once they see the new version
+    expire_recommendation_index()
+    model_version = current_model_version()
+    
+    stats = {
+        'training_mode': 'incremental',
+        'batch_transactions': matrix.shape[0],
+        'total_transactions': num_transactions,
+        'unique_products': len(items),
+        'pairs_affected': len(affected),
+        'min_support': min_support,
+        'min_confidence': min_confidence,
+        'recommendations_created': created,
+        'recommendations_updated': updated,
+        'recommendations_saved': created + updated,
+        'persistence': persistence,
+        'model_version': model_version,
+        'algorithm_version': '3.0',
+        'current_time_period': get_time_of_day(),
+        'current_month': datetime.now().month,
+        'phases': phases.report()
     }
     
     # Update job with statistics if job_id is provided
@@ -179,7 +179,7 @@ def main():
         "flask-login", "flask-sqlalchemy", "flask-wtf", "gunicorn", 
         "matplotlib", "mlxtend", "numpy", "pandas", "psycopg2-binary", 
         "python-dotenv", "seaborn", "sqlalchemy", "trafilatura", 
-        "werkzeug", "wtforms"
+        "werkzeug", "wtforms", "asyncpg", "aiosqlite", "uvicorn"
     ]
     
     install_cmd = f"pip install {' '.join(requirements)}"
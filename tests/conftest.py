@@ -0,0 +1,45 @@
+import os
+import tempfile
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+
+# The app connects at import time, so point it at a throwaway database first
+# (TEST_DATABASE_URL selects a PostgreSQL database instead) and run jobs inline
+os.environ['DATABASE_URL'] = os.environ.get(
+    'TEST_DATABASE_URL',
+    'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='buybuddy-tests-'), 'buybuddy.db')
+)
+os.environ['RECOMMENDATION_JOB_WORKERS'] = '0'
+
+
+@compiles(JSONB, 'sqlite')
+def compile_jsonb_sqlite(element, compiler, **kw):
+    """Store JSONB columns as JSON when the tests run on SQLite"""
+    return 'JSON'
+
+
+# Loaded before the test modules: recommendation.py expects the app to be initialized
+from app import app as flask_app  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    return flask_app
+
+
+@pytest.fixture
+def tenant(app):
+    """A fresh tenant, with an application context held for the test"""
+    from app import db
+    from models import User
+    
+    with app.app_context():
+        name = f"tenant-{uuid4().hex[:12]}"
+        user = User(username=name, email=f"{name}@example.com")
+        db.session.add(user)
+        db.session.commit()
+        yield user.id
+        db.session.remove()
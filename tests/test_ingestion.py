@@ -0,0 +1,167 @@
+import gzip
+import io
+from datetime import datetime, timedelta
+
+from app import db
+from models import RecommendationJob, Transaction
+from recommendation import (
+    STREAM_STALE_SECONDS,
+    ingest_transactions,
+    iter_uploaded_transactions,
+    validate_transactions,
+)
+
+
+def make_transactions(count, prefix='T'):
+    return [
+        {'transaction_id': f"{prefix}{i}", 'products': [f"P{i % 7}", f"P{(i + 3) % 7}"]}
+        for i in range(count)
+    ]
+
+
+def make_job(user_id, status, **values):
+    job = RecommendationJob(user_id=user_id, status=status, **values)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def stored_jobs(user_id):
+    """Job ID of every stored transaction of the tenant"""
+    return {job_id for (job_id,) in db.session.query(Transaction.job_id).filter_by(user_id=user_id)}
+
+
+def test_retried_upload_is_idempotent(tenant):
+    transactions = make_transactions(50)
+    
+    _, first = ingest_transactions(tenant, transactions, chunk_size=20)
+    _, retry = ingest_transactions(tenant, transactions, chunk_size=20)
+    
+    assert (first['rows_ingested'], first['rows_duplicate']) == (50, 0)
+    assert (retry['rows_ingested'], retry['rows_duplicate']) == (0, 50)
+    assert Transaction.query.filter_by(user_id=tenant).count() == 50
+
+
+def test_repeated_ids_within_upload_are_stored_once(tenant):
+    transactions = make_transactions(10)
+    
+    frame, stats = ingest_transactions(tenant, transactions + transactions[:3])
+    
+    assert len(frame) == 10
+    assert (stats['rows_ingested'], stats['rows_duplicate'], stats['rows_rejected']) == (10, 3, 0)
+
+
+def test_rows_without_id_are_rejected(tenant):
+    transactions = make_transactions(5) + [
+        {'products': ['P1']},
+        {'transaction_id': None, 'products': ['P1']},
+        {'transaction_id': '   ', 'products': ['P1']},
+        {'transaction_id': 'x' * 65, 'products': ['P1']},
+    ]
+    
+    _, stats = ingest_transactions(tenant, transactions)
+    
+    assert (stats['rows_ingested'], stats['rows_rejected']) == (5, 4)
+
+
+def test_numeric_ids_are_kept_when_rows_lack_an_id():
+    frame, rejected = validate_transactions([
+        {'transaction_id': 1, 'products': ['P1']},
+        {'products': ['P2']},
+        {'transaction_id': 2.5, 'products': ['P3']},
+    ], user_id=1)
+    
+    assert frame['transaction_id'].tolist() == ['1', '2.5']
+    assert rejected == 1
+
+
+def test_products_must_be_lists_of_scalars():
+    frame, rejected = validate_transactions([
+        {'transaction_id': 'ok', 'products': ['P1', 2, 3.5]},
+        {'transaction_id': 'nested', 'products': [['P1'], 'P2']},
+        {'transaction_id': 'object', 'products': [{'id': 'P1'}]},
+        {'transaction_id': 'flag', 'products': [True]},
+        {'transaction_id': 'string', 'products': 'P1'},
+        {'transaction_id': 'missing'},
+    ], user_id=1)
+    
+    assert frame['transaction_id'].tolist() == ['ok', 'missing']
+    assert frame['products'].tolist() == [['P1', 2, 3.5], []]
+    assert rejected == 4
+
+
+def test_retry_takes_over_rows_of_failed_job(tenant):
+    transactions = make_transactions(30)
+    failed = make_job(tenant, 'failed')
+    ingest_transactions(tenant, transactions, job_id=failed)
+    
+    retry = make_job(tenant, 'processing')
+    _, stats = ingest_transactions(tenant, transactions, job_id=retry)
+    
+    assert (stats['rows_ingested'], stats['rows_resumed'], stats['rows_duplicate']) == (0, 30, 0)
+    assert stored_jobs(tenant) == {retry}
+    
+    # Rows of a job that is still running are not taken over again
+    _, again = ingest_transactions(tenant, transactions, job_id=make_job(tenant, 'processing'))
+    assert (again['rows_resumed'], again['rows_duplicate']) == (0, 30)
+
+
+def test_trained_rows_are_not_taken_over(tenant):
+    transactions = make_transactions(10)
+    trained = make_job(tenant, 'failed', trained_at=datetime.now())
+    ingest_transactions(tenant, transactions, job_id=trained)
+    
+    _, stats = ingest_transactions(tenant, transactions, job_id=make_job(tenant, 'processing'))
+    
+    assert (stats['rows_resumed'], stats['rows_duplicate']) == (0, 10)
+    assert stored_jobs(tenant) == {trained}
+
+
+def test_only_stale_streams_are_taken_over(tenant):
+    transactions = make_transactions(10)
+    stream = make_job(tenant, 'receiving')
+    ingest_transactions(tenant, transactions, job_id=stream)
+    
+    _, live = ingest_transactions(tenant, transactions, job_id=make_job(tenant, 'processing'))
+    assert live['rows_resumed'] == 0
+    
+    stopped = datetime.now() - timedelta(seconds=STREAM_STALE_SECONDS + 60)
+    db.session.execute(
+        db.update(RecommendationJob).where(RecommendationJob.id == stream).values(created_at=stopped, updated_at=stopped)
+    )
+    db.session.commit()
+    retry = make_job(tenant, 'processing')
+    _, stats = ingest_transactions(tenant, transactions, job_id=retry)
+    
+    assert stats['rows_resumed'] == 10
+    assert stored_jobs(tenant) == {retry}
+
+
+def test_ndjson_upload_yields_none_for_bad_lines():
+    body = b'{"transaction_id": "a", "products": ["P1"]}\n\nnot json\n{"transaction_id": "b", "products": []}\n'
+    
+    records = list(iter_uploaded_transactions(io.BytesIO(gzip.compress(body)), compressed=True))
+    
+    assert records == [
+        {'transaction_id': 'a', 'products': ['P1']},
+        None,
+        {'transaction_id': 'b', 'products': []},
+    ]
+
+
+def test_csv_upload_parses_product_lists():
+    body = (
+        'transaction_id,products,metadata\n'
+        'a,P1;P2; P3,\n'
+        'b,"[""P4"", 5]","{""store"": ""north""}"\n'
+        'c,"[broken",\n'
+    ).encode()
+    
+    records = list(iter_uploaded_transactions(io.BytesIO(body), format='csv'))
+    
+    assert [record['products'] for record in records[:2]] == [['P1', 'P2', 'P3'], ['P4', 5]]
+    assert records[1]['metadata'] == {'store': 'north'}
+    
+    frame, rejected = validate_transactions(records, user_id=1)
+    assert frame['transaction_id'].tolist() == ['a', 'b']
+    assert rejected == 1
@@ -0,0 +1,138 @@
+import random
+
+import pytest
+from mlxtend.frequent_patterns import apriori, association_rules
+
+from recommendation import (
+    AprioriEngine,
+    EclatEngine,
+    FPGrowthEngine,
+    PairRuleEngine,
+    PartitionedMiningEngine,
+    build_transaction_matrix,
+    iter_association_rules,
+    matrix_to_dataframe,
+    plan_thresholds,
+)
+
+MIN_SUPPORT = 0.03
+MIN_CONFIDENCE = 0.2
+
+
+@pytest.fixture(scope='module')
+def baskets():
+    rng = random.Random(7)
+    products = [f"P{i:02d}" for i in range(15)]
+    # Skewed popularity, so itemsets of every length up to four are frequent
+    weights = [15 - i for i in range(15)]
+    return [sorted(set(rng.choices(products, weights=weights, k=rng.randint(1, 6)))) for _ in range(400)]
+
+
+@pytest.fixture(scope='module')
+def matrix(baskets):
+    return build_transaction_matrix(baskets)
+
+
+def supports(itemsets):
+    """Frequent itemsets as {itemset: support}"""
+    return {itemset: round(float(support), 9) for itemset, support in zip(itemsets['itemsets'], itemsets['support'])}
+
+
+def rule_metrics(rules):
+    """Rules as {(antecedent, consequent): (support, confidence, lift, conviction)}"""
+    return {
+        (row['antecedents'], row['consequents']): tuple(
+            float(row[column]) for column in ('support', 'confidence', 'lift', 'conviction')
+        )
+        for _, row in rules.iterrows()
+    }
+
+
+@pytest.mark.parametrize('max_len', [None, 2, 3])
+@pytest.mark.parametrize('engine', [
+    FPGrowthEngine(),
+    EclatEngine(),
+    PartitionedMiningEngine(AprioriEngine(), workers=2, chunk_size=150),
+    PartitionedMiningEngine(EclatEngine(), workers=2, chunk_size=150),
+], ids=['fp_growth', 'eclat', 'partitioned_apriori', 'partitioned_eclat'])
+def test_engines_match_apriori(matrix, engine, max_len):
+    x, items = matrix
+    expected = supports(AprioriEngine().mine(x, items, MIN_SUPPORT, max_len))
+    
+    assert any(len(itemset) > 2 for itemset in expected) or max_len == 2
+    assert supports(engine.mine(x, items, MIN_SUPPORT, max_len)) == expected
+
+
+def test_pair_engine_matches_apriori_pairs(matrix):
+    x, items = matrix
+    expected = supports(AprioriEngine().mine(x, items, MIN_SUPPORT, max_len=2))
+    
+    assert supports(PairRuleEngine().mine(x, items, MIN_SUPPORT, max_len=2)) == expected
+
+
+def test_pair_rules_match_single_item_rules(matrix):
+    x, items = matrix
+    itemsets = AprioriEngine().mine(x, items, MIN_SUPPORT, max_len=2)
+    expected = rule_metrics(next(iter_association_rules(itemsets, MIN_CONFIDENCE, 1, 1)))
+    
+    rules, _ = PairRuleEngine(top_k=None).mine_rules(x, items, MIN_SUPPORT, MIN_CONFIDENCE)
+    actual = rule_metrics(rules)
+    
+    assert actual.keys() == expected.keys()
+    for rule, metrics in expected.items():
+        assert actual[rule] == pytest.approx(metrics)
+
+
+def test_partitioned_mining_records_partitions(matrix):
+    x, items = matrix
+    engine = PartitionedMiningEngine(FPGrowthEngine(), workers=2, chunk_size=150)
+    engine.mine(x, items, MIN_SUPPORT)
+    
+    assert [partition['rows'] for partition in engine.partition_stats] == [150, 150, 100]
+
+
+@pytest.mark.parametrize('max_antecedent_len, max_consequent_len', [(1, 1), (2, 2), (1, 3), (3, 1)])
+def test_rules_match_mlxtend(baskets, max_antecedent_len, max_consequent_len):
+    frame = matrix_to_dataframe(*build_transaction_matrix(baskets))
+    itemsets = apriori(frame, min_support=MIN_SUPPORT, use_colnames=True)
+    
+    expected_rules = association_rules(
+        itemsets, num_itemsets=len(baskets), metric='confidence', min_threshold=MIN_CONFIDENCE
+    )
+    expected_rules = expected_rules[
+        (expected_rules['antecedents'].map(len) <= max_antecedent_len)
+        & (expected_rules['consequents'].map(len) <= max_consequent_len)
+    ]
+    expected = rule_metrics(expected_rules)
+    actual = {}
+    for chunk in iter_association_rules(itemsets, MIN_CONFIDENCE, max_antecedent_len, max_consequent_len, chunk_size=50):
+        actual.update(rule_metrics(chunk))
+    
+    assert expected
+    assert actual.keys() == expected.keys()
+    for rule, metrics in expected.items():
+        assert actual[rule] == pytest.approx(metrics)
+
+
+def test_plan_keeps_requested_thresholds(matrix):
+    x, _ = matrix
+    plan = plan_thresholds(x, MIN_SUPPORT, MIN_CONFIDENCE)
+    
+    assert (plan['min_support'], plan['support_reason']) == (MIN_SUPPORT, 'requested')
+    assert (plan['min_confidence'], plan['confidence_reason']) == (MIN_CONFIDENCE, 'requested')
+
+
+def test_plan_raises_support_to_fit_budget(matrix):
+    x, _ = matrix
+    plan = plan_thresholds(x, 0.001, MIN_CONFIDENCE, itemset_budget=20)
+    
+    assert plan['support_reason'] == 'raised_for_budget'
+    assert plan['estimated_itemsets'] <= 20
+
+
+def test_plan_lowers_support_for_sparse_data():
+    x, _ = build_transaction_matrix([[f"P{i}", f"P{i + 1}"] for i in range(100)])
+    plan = plan_thresholds(x, 0.05, MIN_CONFIDENCE)
+    
+    assert plan['support_reason'] == 'lowered_for_sparse_data'
+    assert 0.05 / 4 <= plan['min_support'] < 0.05
@@ -94,6 +94,123 @@ def init_db():
             db.session.rollback()
 
 
+# Columns added to tables that db.create_all() leaves alone once they exist
+UPGRADE_COLUMNS = {
+    'transaction': ['job_id'],
+    'product_recommendation': ['context_scores'],
+    'recommendation_model_state': ['min_support', 'min_confidence'],
+    'recommendation_job': [
+        'payload', 'worker', 'heartbeat_at', 'not_before', 'superseded_by', 'trained_at', 'started_at'
+    ]
+}
+
+
+def missing_schema(connection):
+    """
+    Columns, indexes and constraints the database lacks compared to the models
+    
+    Args:
+        connection (Connection): Connection to inspect the database with
+        
+    Returns:
+        list: (kind, table name, name) of each missing object; kind is
+              'column', 'index' or 'constraint'
+    """
+    inspector = db.inspect(connection)
+    missing = []
+    for table_name, column_names in UPGRADE_COLUMNS.items():
+        existing = {column['name'] for column in inspector.get_columns(table_name)}
+        missing += [('column', table_name, name) for name in column_names if name not in existing]
+        
+        indexes = {index['name'] for index in inspector.get_indexes(table_name)}
+        missing += [
+            ('index', table_name, index.name)
+            for index in db.metadata.tables[table_name].indexes if index.name not in indexes
+        ]
+    
+    constraints = {constraint['name'] for constraint in inspector.get_unique_constraints('transaction')}
+    constraints |= {index['name'] for index in inspector.get_indexes('transaction') if index['unique']}
+    if 'unique_user_transaction' not in constraints:
+        missing.append(('constraint', 'transaction', 'unique_user_transaction'))
+    return missing
+
+
+def check_schema():
+    """
+    Warn when tables created by an earlier version need `flask upgrade-db`
+    
+    db.create_all() only creates missing tables, so existing ones keep their
+    old columns until the upgrade is run.
+    
+    Returns:
+        list: The missing schema objects (see missing_schema)
+    """
+    import logging
+    
+    logger = logging.getLogger(__name__)
+    
+    with db.engine.connect() as connection:
+        missing = missing_schema(connection)
+    if missing:
+        logger.error(
+            "Database schema is out of date, run `flask --app app upgrade-db`. Missing: "
+            + ", ".join(f"{kind} {table_name}.{name}" for kind, table_name, name in missing)
+        )
+    return missing
+
+
+def upgrade_schema():
+    """
+    Bring tables created by an earlier version up to the current models
+    
+    Run once per deployment with `flask --app app upgrade-db`, not at
+    startup. Missing columns and indexes are added. Transactions stored
+    before uploads were deduplicated may repeat a (user_id, transaction_id)
+    pair; all but the first copy are deleted before the unique constraint
+    that ingestion relies on (unique_user_transaction) is added.
+    
+    Returns:
+        list: Descriptions of the changes made
+    """
+    from sqlalchemy.schema import AddConstraint
+    
+    changes = []
+    with db.engine.begin() as connection:
+        preparer = connection.dialect.identifier_preparer
+        
+        for kind, table_name, name in missing_schema(connection):
+            table = db.metadata.tables[table_name]
+            if kind == 'column':
+                column = table.c[name]
+                ddl = (
+                    f"ALTER TABLE {preparer.format_table(table)} "
+                    f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=connection.dialect)}"
+                )
+                for foreign_key in column.foreign_keys:
+                    target = foreign_key.column
+                    ddl += f" REFERENCES {preparer.format_table(target.table)} ({preparer.format_column(target)})"
+                connection.execute(db.text(ddl))
+            elif kind == 'index':
+                next(index for index in table.indexes if index.name == name).create(connection)
+            else:
+                first_copies = db.select(db.func.min(table.c.id)).group_by(table.c.user_id, table.c.transaction_id)
+                removed = connection.execute(table.delete().where(table.c.id.not_in(first_copies))).rowcount
+                if removed:
+                    changes.append(f"deleted {removed} duplicate transactions")
+                
+                constraint = next(constraint for constraint in table.constraints if constraint.name == name)
+                if connection.dialect.name == 'sqlite':
+                    # SQLite cannot add constraints to a table; a unique index serves the same ON CONFLICT target
+                    columns = ', '.join(preparer.format_column(column) for column in constraint.columns)
+                    connection.execute(db.text(
+                        f"CREATE UNIQUE INDEX {preparer.quote(name)} ON {preparer.format_table(table)} ({columns})"
+                    ))
+                else:
+                    connection.execute(AddConstraint(constraint))
+            changes.append(f"added {kind} {table_name}.{name}")
+    return changes
+
+
 def generate_sample_transactions(user_id, num_transactions=100):
     """
     Generate sample transactions for demo purposes